@@ -1,23 +1,38 @@
 import os
-import base64
-import requests
+import json
+import uuid
+import hashlib
 import fitz  
+from concurrent.futures import ProcessPoolExecutor
+from pydantic import Field
 from crewai.tools import BaseTool
-from langchain_experimental.tools import PythonREPLTool
+from image_filter import prefilter_images
+from vision_client import get_vision_client
+from interpreter_pool import get_interpreter_pool, format_reply
+import table_store
 
 # --- 1. Code Interpreter ---
+# Runs in the shared, pre-warmed worker pool (see interpreter_pool.py).
+# Variables persist across calls with the same session_id; give each crew
+# run its own tool instance (or call close()) so runs don't see each other's state.
 class CodeInterpreterTool(BaseTool):
     name: str = "Code Interpreter"
-    description: str = "Useful for executing Python code to analyze data. Input: Python code string."
+    description: str = ("Useful for executing Python code to analyze data. pandas (pd) and numpy (np) are "
+                        "already imported and variables persist between calls. The value of the last line "
+                        "is returned, like in a notebook. Input: Python code string.")
+    session_id: str = Field(default_factory=lambda: uuid.uuid4().hex)
 
     def _run(self, code: str) -> str:
-        repl = PythonREPLTool()
         try:
             clean_code = code.replace("```python", "").replace("```", "").strip()
-            return repl.run(clean_code)
+            return format_reply(get_interpreter_pool().run(clean_code, session=self.session_id))
         except Exception as e:
             return f"Error: {e}"
 
+    def close(self):
+        """Drops this session's variables in the worker."""
+        get_interpreter_pool().end_session(self.session_id)
+
 # --- 2. File Lister  ---
 class FileListerTool(BaseTool):
     name: str = "List PDF Files"
@@ -34,6 +49,100 @@ class FileListerTool(BaseTool):
         return f"Available PDFs: {', '.join(files)}"
 
 # --- 3. PDF Image Extractor ---
+# Page ranges are spread over a process pool. Within a range each image xref
+# is decoded once and each distinct image (by sha256 of its bytes) written
+# once, so a logo on every page costs one file, not hundreds. Results are
+# cached per PDF hash in a manifest, so asking again for an unchanged PDF
+# returns immediately.
+
+IMAGE_DIR = "extracted_images"
+IMAGE_MANIFEST = os.path.join(IMAGE_DIR, "manifest.json")
+MIN_IMAGE_BYTES = 2000  # Skip very small images (icons/lines)
+IMAGE_PAGES_PER_TASK = 32
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _extract_page_range(pdf_path, start, end, prefix, output_dir):
+    """
+    Runs in a worker process. Writes the distinct images on pages [start, end)
+    and returns (page_index, image_index, sha256, path) for each one.
+    """
+    doc = fitz.open(pdf_path)
+    seen_xrefs, seen_hashes, found = set(), set(), []
+    for page_index in range(start, min(end, doc.page_count)):
+        for image_index, img in enumerate(doc[page_index].get_images(full=True)):
+            xref = img[0]
+            if xref in seen_xrefs:
+                continue
+            seen_xrefs.add(xref)
+            base_image = doc.extract_image(xref)
+            image_bytes = base_image["image"]
+            if len(image_bytes) < MIN_IMAGE_BYTES:
+                continue
+            digest = hashlib.sha256(image_bytes).hexdigest()
+            if digest in seen_hashes:
+                continue  # Same picture embedded under another xref
+            seen_hashes.add(digest)
+            image_name = f"{prefix}_p{page_index+1}_i{image_index+1}.{base_image['ext']}"
+            image_save_path = os.path.join(output_dir, image_name)
+            with open(image_save_path, "wb") as f:
+                f.write(image_bytes)
+            found.append((page_index, image_index, digest, image_save_path))
+    doc.close()
+    return found
+
+def load_image_manifest():
+    if not os.path.exists(IMAGE_MANIFEST):
+        return {}
+    with open(IMAGE_MANIFEST, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_image_manifest(manifest):
+    os.makedirs(IMAGE_DIR, exist_ok=True)
+    tmp_path = IMAGE_MANIFEST + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, IMAGE_MANIFEST)
+
+def extract_pdf_images(pdf_path, prefix=None, workers=None, pages_per_task=IMAGE_PAGES_PER_TASK):
+    """Returns the paths of the distinct images in 'pdf_path', extracting them only once per PDF version."""
+    prefix = prefix or os.path.basename(pdf_path)
+    pdf_hash = _file_sha256(pdf_path)
+    manifest = load_image_manifest()
+    cached = manifest.get(pdf_hash)
+    if cached and cached["prefix"] == prefix and all(os.path.exists(p) for p in cached["images"]):
+        return cached["images"]
+
+    os.makedirs(IMAGE_DIR, exist_ok=True)
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
+    ranges = [(s, s + pages_per_task) for s in range(0, page_count, pages_per_task)]
+    workers = min(workers or os.cpu_count() or 2, len(ranges))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_extract_page_range, *zip(*[(pdf_path, s, e, prefix, IMAGE_DIR) for s, e in ranges])))
+    else:
+        parts = [_extract_page_range(pdf_path, s, e, prefix, IMAGE_DIR) for s, e in ranges]
+
+    # The same image can still turn up in two ranges; keep the first page's copy
+    images, seen = [], set()
+    for page_index, image_index, digest, path in sorted(found for part in parts for found in part):
+        if digest in seen:
+            os.remove(path)
+            continue
+        seen.add(digest)
+        images.append(path)
+
+    manifest = load_image_manifest()  # Re-read: another run may have added PDFs meanwhile
+    manifest[pdf_hash] = {"prefix": prefix, "images": images}
+    save_image_manifest(manifest)
+    return images
+
 class PDFImageExtractorTool(BaseTool):
     name: str = "PDF Image Extractor"
     description: str = "Extracts images from a specific PDF. Input: The filename (e.g., 'knowledge.pdf')."
@@ -41,40 +150,25 @@ class PDFImageExtractorTool(BaseTool):
     def _run(self, pdf_filename: str) -> str:
         data_dir = "data"
         pdf_path = os.path.join(data_dir, pdf_filename.strip())
-        output_dir = "extracted_images"
         
         if not os.path.exists(pdf_path):
             return f"Error: File '{pdf_filename}' not found."
 
-        os.makedirs(output_dir, exist_ok=True)
-        extracted_images = []
-        
         try:
-            doc = fitz.open(pdf_path)
-            for page_index, page in enumerate(doc):
-                image_list = page.get_images(full=True)
-                
-                for image_index, img in enumerate(image_list):
-                    xref = img[0]
-                    base_image = doc.extract_image(xref)
-                    image_bytes = base_image["image"]
-                    
-                    # Skip very small images (icons/lines)
-                    if len(image_bytes) < 2000: 
-                        continue
-
-                    image_ext = base_image["ext"]
-                    image_name = f"{pdf_filename}_p{page_index+1}_i{image_index+1}.{image_ext}"
-                    image_save_path = os.path.join(output_dir, image_name)
-                    
-                    with open(image_save_path, "wb") as f:
-                        f.write(image_bytes)
-                    extracted_images.append(image_save_path)
+            extracted_images = extract_pdf_images(pdf_path, prefix=pdf_filename.strip())
             
             if not extracted_images:
                 return "No significant images found in this PDF."
-            
-            return f"IMAGES FOUND: {', '.join(extracted_images)}"
+
+            # Only the most chart/table-like images are worth a vision call
+            kept, skipped = prefilter_images(extracted_images)
+            if not kept:
+                return "No significant images found in this PDF."
+
+            result = f"IMAGES FOUND: {', '.join(path for path, _ in kept)}"
+            if skipped:
+                result += f"\n({len(skipped)} decorative, duplicate or lower-ranked images were skipped.)"
+            return result
             
         except Exception as e:
             return f"Extraction failed: {str(e)}"
@@ -82,40 +176,61 @@ class PDFImageExtractorTool(BaseTool):
 # --- 4. Vision Tool ---
 class VisionTool(BaseTool):
     name: str = "Vision Analyst"
-    description: str = "Analyzes an image file. Input: The file path (e.g., 'extracted_images/file.png')."
+    description: str = ("Analyzes image files. Input: one file path (e.g., 'extracted_images/file.png') "
+                        "or several paths separated by commas to analyze them all at once.")
 
     def _run(self, image_path: str) -> str:
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not os.path.exists(image_path):
+        # A file name may itself contain a comma: only split if the whole input isn't a file
+        whole = image_path.strip()
+        paths = [whole] if os.path.exists(whole) else [p.strip() for p in image_path.split(",") if p.strip()]
+        missing = [p for p in paths if not os.path.exists(p)]
+        if not paths or len(missing) == len(paths):
             return "Error: Image not found."
 
-        def encode_image(path):
-            with open(path, "rb") as image_file:
-                return base64.b64encode(image_file.read()).decode('utf-8')
+        # Pooled, cached and concurrent (see vision_client.py)
+        results = get_vision_client().analyze_many([p for p in paths if p not in missing])
+        if len(paths) == 1:
+            return results[paths[0]]
+        sections = [f"{path}:\n{answer}" for path, answer in results.items()]
+        sections.extend(f"{path}:\nError: Image not found." for path in missing)
+        return "\n\n".join(sections)
+
+# --- 5. Table Lookup ---
+# Tables were extracted to Parquet at ingest time (see table_store.py). This
+# tool lists them and loads one straight into the Code Interpreter session it
+# shares, so numbers never have to be re-typed from chunk text.
+class TableLookupTool(BaseTool):
+    name: str = "Table Lookup"
+    description: str = ("Finds tables extracted from the PDFs and loads them into the Code Interpreter as pandas "
+                        "DataFrames. Input: 'list' (optionally followed by a word to match file names or column "
+                        "names, e.g. 'list revenue'), or a table id from that list (e.g. 'q3/report.pdf:p3:t1').")
+    session_id: str = ""  # The Code Interpreter session to load tables into
+
+    def _run(self, query: str) -> str:
+        query = query.strip().strip("'\"")
+        if not query or query.lower().startswith("list"):
+            tables = table_store.list_tables(query[4:].strip())
+            if not tables:
+                return "No extracted tables found."
+            return "\n".join(f"{t['id']}: {t['rows']} rows, columns: {', '.join(t['columns'])}" for t in tables)
 
         try:
-            base64_image = encode_image(image_path)
-            headers = {"Authorization": f"Bearer {api_key}"}
-            payload = {
-                "model": "gpt-4o",
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": "Describe this image in detail. If it is a chart or table, extract the data points. If it is a diagram, explain the process."},
-                            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
-                        ]
-                    }
-                ],
-                "max_tokens": 400
-            }
-            response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
-            return response.json()['choices'][0]['message']['content']
-        except Exception as e:
-            return f"Error analyzing image: {e}"
+            table = table_store.get_table(query)
+        except ValueError as e:
+            return f"Error: {e}. Use one of the full ids."
+        if table is None:
+            return f"Error: Unknown table '{query}'. Use 'list' to see the available tables."
+        var = table_store.variable_name(table["id"])
+        code = f"{var} = pd.read_parquet({os.path.abspath(table['file'])!r})\n{var}.head(10)"
+        reply = get_interpreter_pool().run(code, session=self.session_id)
+        if reply["error"]:
+            return format_reply(reply)
+        return (f"Loaded '{table['id']}' into the Code Interpreter as the DataFrame `{var}` "
+                f"({table['rows']} rows). First rows:\n{reply['result']}")
 
 # Export tools
 code_interpreter = CodeInterpreterTool()
 file_lister = FileListerTool()
 pdf_extractor = PDFImageExtractorTool()
-vision_tool = VisionTool()
\ No newline at end of file
+vision_tool = VisionTool()
+table_lookup = TableLookupTool(session_id=code_interpreter.session_id)
\ No newline at end of file
@@ -21,7 +21,9 @@ from dotenv import load_dotenv
 from fpdf import FPDF
 from crewai import Agent, Task, Crew, Process, LLM
 from tools import search_tool
-from analysis_tools import code_interpreter, file_lister, pdf_extractor, vision_tool
+from tracing import CrewTracer
+from analysis_tools import CodeInterpreterTool, TableLookupTool, file_lister, pdf_extractor, vision_tool
+from interpreter_pool import get_interpreter_pool
 from crewai_tools import SerperDevTool, ScrapeWebsiteTool
 
 # --- 1. SETUP & CONFIG ---
@@ -194,6 +196,10 @@ def run_simple_chat(user_question, chat_history_context, llm_instance):
 
 def run_crew_logic(user_question, chat_history_context, llm_instance, specific_file, use_vision, use_web, target_url, serper_key):
     researcher_tools = [search_tool, file_lister, pdf_extractor]
+    # Own interpreter session per run; starting the pool here warms it while the researcher works
+    get_interpreter_pool()
+    code_interpreter = CodeInterpreterTool()
+    table_lookup = TableLookupTool(session_id=code_interpreter.session_id)
     if use_web and serper_key:
         os.environ["SERPER_API_KEY"] = serper_key
         researcher_tools.append(SerperDevTool())
@@ -210,8 +216,9 @@ def run_crew_logic(user_question, chat_history_context, llm_instance, specific_f
                        backstory=(f"You are a thorough researcher. 1. Search vector DB. 2. {vision_instr} 3. {web_instr} 4. {url_instr}"),
                        tools=researcher_tools, llm=llm_instance)
     analyst = Agent(role='Senior Data Analyst', goal='Analyze trends.', verbose=True, memory=True,
-                    backstory=("Analyze data. Use 'Code Interpreter' for tables. Use 'Vision Analyst' for images."),
-                    tools=[code_interpreter, vision_tool], llm=llm_instance)
+                    backstory=("Analyze data. For tables, use 'Table Lookup' to load the extracted table as a DataFrame, then 'Code Interpreter' to compute. "
+                               "Use 'Vision Analyst' for images (pass all paths in one call, comma-separated)."),
+                    tools=[table_lookup, code_interpreter, vision_tool], llm=llm_instance)
     writer = Agent(role='Lead Technical Writer', goal='Write report.', verbose=True, memory=True,
                    backstory="Write professional reports.", llm=llm_instance)
 
@@ -219,8 +226,13 @@ def run_crew_logic(user_question, chat_history_context, llm_instance, specific_f
     task_research = Task(description=(f"Query: '{user_question}'.{context_str}\nPDF: {specific_file}\nURL: {target_url}"), expected_output='Summary.', agent=researcher)
     task_analysis = Task(description="Analyze findings.", expected_output='Analysis.', agent=analyst, context=[task_research])
     task_writing = Task(description=f"Write answer to: '{user_question}'.", expected_output='Final report.', agent=writer, context=[task_analysis])
-    crew = Crew(agents=[researcher, analyst, writer], tasks=[task_research, task_analysis, task_writing], process=Process.sequential)
-    return crew.kickoff()
+    tracer = CrewTracer()
+    crew = Crew(agents=[researcher, analyst, writer], tasks=[task_research, task_analysis, task_writing], process=Process.sequential,
+                step_callback=tracer.step, task_callback=tracer.task)
+    try:
+        return tracer.kickoff(crew)
+    finally:
+        code_interpreter.close()
 
 # --- 6. LANDING PAGE ---
 def landing_page():
@@ -0,0 +1,219 @@
+import os
+import time
+import random
+import hashlib
+import argparse
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.embeddings import Embeddings
+
+# --- Batched Embedding Layer ---
+# Groups texts into request batches sized by (approximate) token count and
+# keeps several batches in flight at once. The token budget per batch adapts
+# AIMD-style: it grows while batches come back under the latency target and
+# is halved whenever a batch is slow or the backend errors out.
+
+DEFAULT_BATCH_TOKENS = 2048
+MIN_BATCH_TOKENS = 256
+MAX_BATCH_TOKENS = 32768
+DEFAULT_CONCURRENCY = 4
+DEFAULT_TARGET_LATENCY = 2.0  # seconds per batch
+MAX_RETRIES = 4
+# "ollama": nomic-embed-text via Ollama; "fake": FakeEmbeddings (offline, benchmarks)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "ollama")
+FAKE_EMBED_LATENCY = float(os.getenv("FAKE_EMBED_LATENCY", "0.05"))
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token for English text)."""
+    return max(1, len(text) // 4)
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Wraps an embeddings backend (e.g. OllamaEmbeddings) and sends
+    embed_documents() calls to it as adaptive, concurrent batches.
+    """
+
+    def __init__(self, embeddings, batch_tokens=DEFAULT_BATCH_TOKENS, concurrency=DEFAULT_CONCURRENCY,
+                 target_latency=DEFAULT_TARGET_LATENCY, min_tokens=MIN_BATCH_TOKENS,
+                 max_tokens=MAX_BATCH_TOKENS, adaptive=True):
+        self.embeddings = embeddings
+        # Expose the backend model so CachedEmbeddings keys on the real model name
+        self.model = getattr(embeddings, "model", type(embeddings).__name__)
+        self.batch_tokens = batch_tokens
+        self.concurrency = concurrency
+        self.target_latency = target_latency
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.adaptive = adaptive
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.latencies = []
+
+    # --- Batching ---
+
+    def _make_batches(self, indexed):
+        """Cuts [(i, text), ...] into batches under the current token budget."""
+        budget = self.batch_tokens
+        batches, current, tokens = [], [], 0
+        for i, text in indexed:
+            cost = estimate_tokens(text)
+            if current and tokens + cost > budget:
+                batches.append(current)
+                current, tokens = [], 0
+            current.append((i, text))
+            tokens += cost
+        if current:
+            batches.append(current)
+        return batches
+
+    def _adapt(self, latency=None, failed=False):
+        if not self.adaptive:
+            return
+        with self._lock:
+            if failed or (latency is not None and latency > self.target_latency):
+                self.batch_tokens = max(self.min_tokens, self.batch_tokens // 2)
+            else:
+                self.batch_tokens = min(self.max_tokens, self.batch_tokens + self.min_tokens)
+
+    def _embed_batch(self, batch, attempt=0):
+        texts = [t for _, t in batch]
+        t0 = time.perf_counter()
+        try:
+            vectors = self.embeddings.embed_documents(texts)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            self._adapt(failed=True)
+            if attempt >= MAX_RETRIES:
+                raise
+            time.sleep(min(2.0, 0.1 * 2 ** attempt))
+            # Retry in halves: an oversized batch is the most common cause
+            if len(batch) > 1:
+                mid = len(batch) // 2
+                return self._embed_batch(batch[:mid], attempt + 1) + self._embed_batch(batch[mid:], attempt + 1)
+            return self._embed_batch(batch, attempt + 1)
+        latency = time.perf_counter() - t0
+        with self._lock:
+            self.requests += 1
+            self.latencies.append(latency)
+        self._adapt(latency=latency)
+        return [(i, v) for (i, _), v in zip(batch, vectors)]
+
+    # --- Embeddings API ---
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        results = [None] * len(texts)
+        remaining = list(enumerate(texts))
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            while remaining:
+                # Re-batch each wave with the latest budget so adaptation takes effect
+                batches = self._make_batches(remaining)
+                wave, later = batches[:self.concurrency], batches[self.concurrency:]
+                for pairs in pool.map(self._embed_batch, wave):
+                    for i, vector in pairs:
+                        results[i] = vector
+                remaining = [item for batch in later for item in batch]
+        return results
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+    def stats(self):
+        lat = sorted(self.latencies)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "batch_tokens": self.batch_tokens,
+            "p50_latency": lat[len(lat) // 2] if lat else 0.0,
+        }
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic local backend for offline benchmarks.
+    Latency = base + per_token * tokens; batches above 'overload_tokens'
+    fail, like an Ollama server running out of context/memory.
+    """
+
+    def __init__(self, dim=768, base_latency=0.05, per_token_latency=0.00002,
+                 overload_tokens=16384, error_rate=0.0, seed=0):
+        self.model = "fake-embed"
+        self.dim = dim
+        self.base_latency = base_latency
+        self.per_token_latency = per_token_latency
+        self.overload_tokens = overload_tokens
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vec = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return (vec / np.linalg.norm(vec)).tolist()
+
+    def embed_documents(self, texts):
+        tokens = sum(estimate_tokens(t) for t in texts)
+        with self._lock:
+            self.calls += 1
+            flaky = self._rng.random() < self.error_rate
+        time.sleep(self.base_latency + self.per_token_latency * tokens)
+        if tokens > self.overload_tokens or flaky:
+            raise RuntimeError(f"fake backend overloaded ({tokens} tokens)")
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def make_embeddings(backend=None, batching=True):
+    """
+    The project's embedder: the on-disk cache in front of the backend, with
+    adaptive batching for bulk work (ingest). Queries skip the batching layer.
+    """
+    from embedding_cache import CachedEmbeddings
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "fake":
+        base = FakeEmbeddings(base_latency=FAKE_EMBED_LATENCY)
+    else:
+        from langchain_ollama import OllamaEmbeddings
+        base = OllamaEmbeddings(model="nomic-embed-text")
+    return CachedEmbeddings(BatchingEmbeddings(base) if batching else base)
+
+
+def benchmark(n_texts=2000, chars=1000, concurrency=DEFAULT_CONCURRENCY):
+    rng = random.Random(42)
+    words = ["revenue", "battery", "growth", "market", "policy", "clause", "grid", "supply"]
+    texts = [" ".join(rng.choice(words) for _ in range(chars // 7)) for _ in range(n_texts)]
+
+    print(f"\n📏 Embedding {n_texts} chunks (~{chars} chars) with the fake backend\n")
+    runs = [
+        ("one request per chunk", dict(batch_tokens=1, adaptive=False, concurrency=1)),
+        ("fixed batches", dict(adaptive=False, concurrency=1)),
+        ("adaptive + concurrent", dict(concurrency=concurrency)),
+    ]
+    for label, kwargs in runs:
+        backend = FakeEmbeddings(dim=64)
+        embedder = BatchingEmbeddings(backend, **kwargs)
+        t0 = time.perf_counter()
+        embedder.embed_documents(texts)
+        elapsed = time.perf_counter() - t0
+        s = embedder.stats()
+        print(f"   - {label:<24} {n_texts / elapsed:>9.1f} emb/s   requests={s['requests']:<5} "
+              f"errors={s['errors']:<3} final_batch_tokens={s['batch_tokens']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark for the batching embedder.")
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--chars", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    args = parser.parse_args()
+    benchmark(args.texts, args.chars, args.concurrency)
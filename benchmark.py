@@ -0,0 +1,395 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import fitz
+
+# --- Offline End-to-End Benchmark ---
+# Runs ingest, retrieval, the LangGraph agent, the vision tool and the code
+# interpreter against
+# deterministic local stand-ins, so it works in CI or on an air-gapped box:
+#   embedder       batch_embedder.FakeEmbeddings   (EMBEDDING_BACKEND=fake)
+#   chat LLM       llm_cache.FakeChatModel         (LLM_BACKEND=fake)
+#   cross-encoder  rerank_service.FakeCrossEncoder (RERANKER_BACKEND=fake)
+#   vision API     StubVisionServer below          (VISION_API_URL)
+# Everything is written under --workdir, which becomes the working directory
+# (index, caches, traces), so a run never touches the real knowledge base.
+# The workdir is marked with WORKDIR_MARKER; a run only ever wipes or re-uses
+# a directory carrying that marker (or an empty one).
+#
+#   python benchmark.py --docs 4 --pages 25 --questions 40
+
+WORKDIR_MARKER = ".benchmark_workdir"
+TOPICS = ["battery", "inverter", "charging", "cooling", "drivetrain", "chassis", "telemetry", "grid"]
+FILLER = ("the market report notes steady growth across regions while supply chains adapt to "
+          "new policy targets and manufacturers expand capacity for next generation vehicles").split()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of finished children (pool workers)."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024  # bytes on macOS, KiB on Linux
+    return own / scale, children / scale
+
+
+def percentiles(values):
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]) if values else (0.0, 0.0, 0.0)
+    return {"p50_ms": p50 * 1000, "p95_ms": p95 * 1000, "p99_ms": p99 * 1000}
+
+
+# --- Synthetic PDF corpus ---
+
+def _chart_png(rng, width=480, height=300):
+    """A bar chart drawn straight into a pixmap (no plotting dependency)."""
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, width, height), False)
+    pix.set_rect(pix.irect, (255, 255, 255))
+    for y in range(20, height - 10, 40):  # Grid lines
+        pix.set_rect(fitz.IRect(0, y, width, y + 1), (220, 220, 220))
+    bars = rng.randint(3, 8)
+    slot = width // bars
+    for i in range(bars):
+        top = rng.randint(20, height - 20)
+        color = tuple(rng.randint(0, 200) for _ in range(3))
+        pix.set_rect(fitz.IRect(i * slot + 8, top, (i + 1) * slot - 8, height - 10), color)
+    # Scanner-like speckle, so the image isn't trivially compressible (the
+    # extractor skips images under 2 KB as icons)
+    for _ in range(600):
+        shade = rng.randint(120, 240)
+        pix.set_pixel(rng.randrange(width), rng.randrange(height), (shade, shade, shade))
+    return pix.tobytes("png")
+
+
+def _draw_table(page, rng, x0=80, y0=600, col_w=110, row_h=18, rows=6):
+    """A ruled quarter / units / revenue / margin table (what PyMuPDF's table finder looks for)."""
+    cells = [["Quarter", "Units", "Revenue ($)", "Margin"]]
+    for r in range(rows - 1):
+        cells.append([f"Q{r % 4 + 1}-{2020 + r // 4}", f"{rng.randint(100, 9999):,}",
+                      f"{rng.randint(10000, 999999):,}", f"{rng.uniform(2, 30):.1f}%"])
+    for r, row in enumerate(cells):
+        for c, text in enumerate(row):
+            page.insert_text((x0 + c * col_w + 4, y0 + r * row_h + 13), text, fontsize=9)
+    for r in range(len(cells) + 1):
+        page.draw_line((x0, y0 + r * row_h), (x0 + len(cells[0]) * col_w, y0 + r * row_h))
+    for c in range(len(cells[0]) + 1):
+        page.draw_line((x0 + c * col_w, y0), (x0 + c * col_w, y0 + len(cells) * row_h))
+
+
+def generate_corpus(data_dir, docs=4, pages=25, chart_every=5, seed=0):
+    """
+    Writes 'docs' PDFs of 'pages' pages each. Every page carries filler text
+    plus one unique fact; every 'chart_every'-th page also gets a bar chart,
+    and the page two after it a ruled table.
+    Returns [(question, part number that answers it), ...].
+    """
+    rng = random.Random(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    facts = []
+    for d in range(docs):
+        pdf = fitz.open()
+        for p in range(pages):
+            page = pdf.new_page()
+            topic = rng.choice(TOPICS)
+            part = f"PN-{d:03d}{p:03d}"
+            kw = rng.randint(10, 990)
+            fact = f"Part {part} is rated at {kw} kW for the {topic} module."
+            lines = [" ".join(rng.choice(FILLER) for _ in range(14)) + "." for _ in range(18)]
+            lines.insert(rng.randint(0, len(lines)), fact)
+            page.insert_textbox(fitz.Rect(50, 50, 550, 560), " ".join(lines), fontsize=9)
+            if chart_every and p % chart_every == 0:
+                page.insert_image(fitz.Rect(150, 580, 470, 780), stream=_chart_png(rng))
+            elif chart_every and p % chart_every == 2:
+                _draw_table(page, rng)
+            facts.append((f"Which part is rated at {kw} kW for the {topic} module?", part))
+        pdf.save(os.path.join(data_dir, f"synthetic_{d:03d}.pdf"))
+        pdf.close()
+    return facts
+
+
+# --- Stub vision endpoint (OpenAI chat-completions shape) ---
+
+class StubVisionServer:
+    """Local HTTP server answering like /v1/chat/completions after 'latency' seconds."""
+
+    def __init__(self, latency=0.2):
+        self.latency = latency
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stub.requests += 1
+                time.sleep(stub.latency)
+                body = json.dumps({"choices": [{"message": {
+                    "content": "Bar chart with several series; values rise left to right."}}]}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v1/chat/completions"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# --- Stages ---
+
+def bench_ingest(data_dir, workers):
+    import pipeline
+    t0 = time.perf_counter()
+    stats = pipeline.IngestionPipeline(data_dir=data_dir, workers=workers, incremental=False).run()
+    elapsed = time.perf_counter() - t0
+    return {
+        "seconds": elapsed,
+        "pages": stats["parse"].items,
+        "chunks": stats["split"].items,
+        "pages_per_s": stats["parse"].items / elapsed,
+        "chunks_per_s": stats["split"].items / elapsed,
+    }
+
+
+def bench_retrieval(facts, concurrency, k=3):
+    import tools
+
+    def one(fact):
+        question, part = fact
+        t0 = time.perf_counter()
+        docs = tools.retrieve_documents(question, k_final=k)
+        return time.perf_counter() - t0, any(part in d.page_content for d in docs)
+
+    tools.get_vector_db()  # Load outside the timed section
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, facts))
+    elapsed = time.perf_counter() - t0
+    return {
+        "queries": len(facts),
+        "concurrency": concurrency,
+        "qps": len(facts) / elapsed,
+        f"hit_at_{k}": sum(hit for _, hit in results) / len(results),
+        **percentiles([lat for lat, _ in results]),
+    }
+
+
+def bench_graph(facts, retrieval_mode="hybrid"):
+    """
+    The sequential graph over 'facts' with dense-only or hybrid (dense + BM25)
+    retrieval. Starts from empty query/rerank caches and bypasses the LLM
+    response cache, so running both modes on the same questions is a fair
+    comparison of how many retrieve loops each needs.
+    """
+    import graph
+    import tools
+    compiled = graph.sequential_workflow.compile()  # No node memoization / checkpoints
+    llms = [graph.get_answer_llm(), tools.get_llm()]
+    saved = (tools.RETRIEVAL_MODE, [m.cache for m in llms])
+    tools.RETRIEVAL_MODE = retrieval_mode
+    tools.query_cache.clear()
+    tools.get_reranker().clear()
+    for m in llms:
+        m.cache = False
+    latencies, loops, answered = [], [], []
+    try:
+        for question, part in facts:
+            t0 = time.perf_counter()
+            state = compiled.invoke(graph.initial_state(question))
+            latencies.append(time.perf_counter() - t0)
+            loops.append(state["loop_step"])
+            if any(part in text for text in state["documents"]):  # Answered from the right chunk
+                answered.append(state["loop_step"])
+    finally:
+        tools.RETRIEVAL_MODE = saved[0]
+        for m, cache in zip(llms, saved[1]):
+            m.cache = cache
+    return {"questions": len(facts), "retrieval_mode": retrieval_mode,
+            "mean_loops": float(np.mean(loops)) if loops else 0.0,
+            "answered": len(answered),
+            "loops_per_answered": float(np.mean(answered)) if answered else 0.0,
+            **percentiles(latencies)}
+
+
+def bench_vision(data_dir, stub):
+    from analysis_tools import pdf_extractor, vision_tool
+    from vision_client import get_vision_client
+    images = []
+    t0 = time.perf_counter()
+    for name in sorted(os.listdir(data_dir)):
+        result = pdf_extractor._run(name)
+        if result.startswith("IMAGES FOUND: "):
+            images.extend(result.splitlines()[0][len("IMAGES FOUND: "):].split(", "))
+    extract_s = time.perf_counter() - t0
+
+    # Every image in one tool call (concurrent), then each again (cache hits)
+    t0 = time.perf_counter()
+    vision_tool._run(", ".join(images))
+    batch_s = time.perf_counter() - t0
+    requests_sent = stub.requests
+    latencies = []
+    for path in images:
+        t1 = time.perf_counter()
+        vision_tool._run(path)
+        latencies.append(time.perf_counter() - t1)
+    client = get_vision_client()
+    return {"images": len(images), "extract_s": extract_s, "batch_s": batch_s, "requests": requests_sent,
+            "concurrency": client.concurrency, "bytes_sent": client.bytes_sent,
+            "bytes_saved": client.bytes_saved, "cached": percentiles(latencies)}
+
+
+TABLE_SNIPPETS = [
+    "df = pd.DataFrame({'quarter': ['Q1', 'Q2', 'Q3', 'Q4'] * 50, 'region': ['EU', 'US'] * 100, "
+    "'revenue': np.linspace(10, 60, 200)})",
+    "df.groupby('quarter')['revenue'].agg(['mean', 'sum'])",
+    "df.pivot_table(index='region', columns='quarter', values='revenue').pct_change(axis=1).round(3)",
+    "df['revenue'].describe()",
+]
+
+
+def bench_interpreter(runs=10):
+    """
+    A typical table analysis: fresh interpreter per call vs. the warm,
+    stateful worker pool; plus loading every extracted table into it.
+    """
+    from interpreter_pool import get_interpreter_pool
+    from analysis_tools import table_lookup
+    import table_store
+    cold = []
+    for _ in range(3):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import numpy as np, pandas as pd\n" + "\n".join(TABLE_SNIPPETS)],
+                       check=True, capture_output=True)
+        cold.append(time.perf_counter() - t0)
+    pool = get_interpreter_pool()
+    pool.warm_up()
+    table_loads = []
+    for table in table_store.list_tables():  # Extracted during ingest
+        t0 = time.perf_counter()
+        reply = table_lookup._run(table["id"])
+        table_loads.append(time.perf_counter() - t0)
+        if reply.startswith("Error"):
+            raise RuntimeError(reply)
+    warm = []
+    for i in range(runs):
+        for code in TABLE_SNIPPETS:
+            t0 = time.perf_counter()
+            reply = pool.run(code, session=f"bench-{i}")
+            warm.append(time.perf_counter() - t0)
+            if reply["error"]:
+                raise RuntimeError(reply["error"])
+        pool.end_session(f"bench-{i}")
+    return {"cold": percentiles(cold), "warm": percentiles(warm), "calls": len(warm),
+            "tables": len(table_loads), "table_load": percentiles(table_loads)}
+
+
+def run(args):
+    workdir = os.path.abspath(args.workdir)
+    if os.path.isdir(workdir) and os.listdir(workdir) and not os.path.exists(os.path.join(workdir, WORKDIR_MARKER)):
+        # Not a directory this script created: never wipe it or write an index into it
+        sys.exit(f"❌ {workdir} exists and is not a benchmark workdir. Pick a new or empty --workdir.")
+    if os.path.exists(workdir) and not args.keep:
+        shutil.rmtree(workdir)
+    os.makedirs(workdir, exist_ok=True)
+    open(os.path.join(workdir, WORKDIR_MARKER), "w").close()
+    os.chdir(workdir)
+
+    # Must be set before the project modules are imported
+    os.environ.update({
+        "EMBEDDING_BACKEND": "fake", "FAKE_EMBED_LATENCY": str(args.embed_latency),
+        "LLM_BACKEND": "fake", "FAKE_LLM_LATENCY": str(args.llm_latency),
+        "RERANKER_BACKEND": "fake", "FAKE_RERANK_LATENCY": str(args.rerank_latency),
+        "TRACE_FILE": os.path.join(workdir, "traces.jsonl"),
+    })
+
+    report = {"config": vars(args)}
+    print(f"📄 Generating {args.docs} x {args.pages}-page synthetic PDFs in {workdir}/data ...")
+    facts = generate_corpus("data", args.docs, args.pages, seed=args.seed)
+    # Retrieval and graph get disjoint questions: a graph question that was
+    # already retrieved would be a semantic-cache hit and hide retrieval cost
+    sampled = random.Random(args.seed).sample(facts, min(args.questions + args.graph_questions, len(facts)))
+    questions, graph_questions = sampled[:args.questions], sampled[args.questions:]
+
+    print("\n=== Ingest ===")
+    report["ingest"] = bench_ingest("data", args.workers)
+    print("\n=== Retrieval ===")
+    report["retrieval"] = bench_retrieval(questions, args.concurrency)
+    print("\n=== Graph ===")
+    report["graph"] = bench_graph(graph_questions, "hybrid")
+    report["graph_dense"] = bench_graph(graph_questions, "dense")
+    if not args.skip_vision:
+        print("\n=== Vision ===")
+        with StubVisionServer(args.vision_latency) as stub:
+            os.environ["VISION_API_URL"] = stub.url
+            import vision_client
+            vision_client.VISION_API_URL = stub.url
+            report["vision"] = bench_vision("data", stub)
+    print("\n=== Code interpreter ===")
+    report["interpreter"] = bench_interpreter()
+    own, children = peak_rss_mb()
+    report["peak_rss_mb"] = {"main": own, "workers": children}
+
+    print("\n📊 Benchmark summary")
+    i, r, g, gd = report["ingest"], report["retrieval"], report["graph"], report["graph_dense"]
+    print(f"   ingest     {i['pages']} pages / {i['chunks']} chunks in {i['seconds']:.2f}s "
+          f"-> {i['pages_per_s']:.1f} pages/s, {i['chunks_per_s']:.1f} chunks/s")
+    print(f"   retrieval  {r['qps']:.1f} QPS at concurrency {r['concurrency']}, "
+          f"p50 {r['p50_ms']:.1f} / p95 {r['p95_ms']:.1f} / p99 {r['p99_ms']:.1f} ms, hit@3 {r['hit_at_3']:.0%}")
+    print(f"   graph      p50 {g['p50_ms']:.1f} / p95 {g['p95_ms']:.1f} / p99 {g['p99_ms']:.1f} ms, "
+          f"{g['mean_loops']:.2f} retrieve loops/question")
+    print(f"   hybrid vs dense  {g['loops_per_answered']:.2f} vs {gd['loops_per_answered']:.2f} loops per answered "
+          f"question ({g['answered']} vs {gd['answered']} of {g['questions']} answered)")
+    if "vision" in report:
+        v = report["vision"]
+        print(f"   vision     {v['images']} images, extract {v['extract_s']:.2f}s, "
+              f"analyse all {v['batch_s']:.2f}s ({v['requests']} requests, concurrency {v['concurrency']}, "
+              f"{v['bytes_sent'] / 1024:.0f} KB sent), cached p50 {v['cached']['p50_ms']:.1f} ms")
+    c = report["interpreter"]
+    print(f"   interpreter fresh process p50 {c['cold']['p50_ms']:.0f} ms, "
+          f"warm pool p50 {c['warm']['p50_ms']:.1f} / p95 {c['warm']['p95_ms']:.1f} ms per call")
+    print(f"   tables     {c['tables']} extracted at ingest, loaded as DataFrames in p50 {c['table_load']['p50_ms']:.1f} ms")
+    print(f"   peak RSS   main {own:.0f} MB, workers {children:.0f} MB")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"💾 Report written to {os.path.join(workdir, args.json)}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark with fake backends.")
+    parser.add_argument("--workdir", default="bench_run")
+    parser.add_argument("--keep", action="store_true", help="Re-use the workdir (warm caches) instead of wiping it.")
+    parser.add_argument("--docs", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=25)
+    parser.add_argument("--questions", type=int, default=40)
+    parser.add_argument("--graph-questions", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Seconds per embedding request.")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Seconds per LLM call.")
+    parser.add_argument("--rerank-latency", type=float, default=0.002, help="Seconds per cross-encoder pair.")
+    parser.add_argument("--vision-latency", type=float, default=0.2, help="Seconds per vision request.")
+    parser.add_argument("--skip-vision", action="store_true")
+    parser.add_argument("--json", help="Also write the report to this JSON file (inside the workdir).")
+    run(parser.parse_args())
@@ -0,0 +1,202 @@
+import os
+import re
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+from collections import defaultdict
+
+# --- Lexical (BM25) Inverted Index ---
+# Dense retrieval misses exact strings like part numbers, clause ids and
+# acronyms. Ingest builds a BM25 index over the same chunks, in the same row
+# order as the FAISS index, stored as flat numpy arrays that are memory-mapped
+# at query time:
+#   bm25_terms.npy   - sorted vocabulary (fixed-width bytes, binary searched)
+#   bm25_ptr.npy     - postings start offset of term t (length V + 1)
+#   bm25_rows.npy    - chunk rows, grouped by term
+#   bm25_tf.npy      - term frequency for each posting
+#   bm25_doclen.npy  - token count of every chunk
+#   bm25_meta.json   - N, average length, k1, b
+
+K1 = 1.5
+B = 0.75
+RRF_K = 60
+# Terms in more than half the chunks carry almost no signal but have the
+# longest postings; skip them once the corpus is big enough for it to matter.
+MAX_DF_RATIO = 0.5
+MIN_DOCS_FOR_DF_CUTOFF = 1000
+MAX_TERM_LEN = 48
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_FILES = ("bm25_terms.npy", "bm25_ptr.npy", "bm25_rows.npy", "bm25_tf.npy", "bm25_doclen.npy", "bm25_meta.json")
+
+
+def tokenize(text):
+    """
+    Lowercased word tokens. Compound ids like 'PN-0042' or '4.2.1' are kept
+    whole *and* split into their parts, so both exact and partial matches work.
+    """
+    tokens = []
+    for match in _TOKEN_RE.findall(text.lower()):
+        match = match[:MAX_TERM_LEN]
+        tokens.append(match)
+        if not match.isalnum():
+            tokens.extend(p for p in re.split(r"[-_./]", match) if p)
+    return tokens
+
+
+def _save_array(path, array):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def build_index(texts, db_path):
+    """Builds the BM25 files for 'texts' (row i = faiss position i)."""
+    postings = defaultdict(list)
+    doclen = np.zeros(len(texts), dtype=np.int32)
+    for row, text in enumerate(texts):
+        counts = defaultdict(int)
+        tokens = tokenize(text)
+        for tok in tokens:
+            counts[tok] += 1
+        doclen[row] = len(tokens)
+        for tok, tf in counts.items():
+            postings[tok].append((row, tf))
+
+    terms = sorted(postings)
+    ptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    for i, term in enumerate(terms):
+        ptr[i + 1] = ptr[i] + len(postings[term])
+    rows = np.empty(ptr[-1], dtype=np.int32)
+    tfs = np.empty(ptr[-1], dtype=np.uint16)
+    for i, term in enumerate(terms):
+        plist = postings[term]
+        rows[ptr[i]:ptr[i + 1]] = [r for r, _ in plist]
+        tfs[ptr[i]:ptr[i + 1]] = [min(tf, 65535) for _, tf in plist]
+
+    width = max((len(t.encode("utf-8")) for t in terms), default=1)
+    os.makedirs(db_path, exist_ok=True)
+    # Running searchers have the old arrays mapped: never overwrite them in
+    # place, write a new file and swap it in
+    _save_array(os.path.join(db_path, "bm25_terms.npy"), np.array([t.encode("utf-8") for t in terms], dtype=f"S{width}"))
+    _save_array(os.path.join(db_path, "bm25_ptr.npy"), ptr)
+    _save_array(os.path.join(db_path, "bm25_rows.npy"), rows)
+    _save_array(os.path.join(db_path, "bm25_tf.npy"), tfs)
+    _save_array(os.path.join(db_path, "bm25_doclen.npy"), doclen)
+    meta = {"n": len(texts), "avgdl": float(doclen.mean()) if len(texts) else 0.0, "k1": K1, "b": B}
+    meta_path = os.path.join(db_path, "bm25_meta.json")
+    with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(meta_path + ".tmp", meta_path)
+
+
+def build_from_vector_db(vector_db, db_path):
+    """Convenience for ingest: index every chunk of 'vector_db' in faiss row order."""
+    texts = [vector_db.docstore.search(vector_db.index_to_docstore_id[i]).page_content
+             for i in range(vector_db.index.ntotal)]
+    build_index(texts, db_path)
+
+
+class BM25Index:
+    def __init__(self, db_path):
+        load = lambda name: np.load(os.path.join(db_path, name), mmap_mode="r")
+        self.terms = load("bm25_terms.npy")
+        self.ptr = load("bm25_ptr.npy")
+        self.rows = load("bm25_rows.npy")
+        self.tf = load("bm25_tf.npy")
+        self.doclen = load("bm25_doclen.npy")
+        with open(os.path.join(db_path, "bm25_meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.n = meta["n"]
+        self.avgdl = meta["avgdl"] or 1.0
+        self.k1 = meta["k1"]
+        self.b = meta["b"]
+
+    @classmethod
+    def load(cls, db_path):
+        """Returns None if ingest hasn't built the lexical index yet."""
+        if not all(os.path.exists(os.path.join(db_path, f)) for f in _FILES):
+            return None
+        return cls(db_path)
+
+    def _postings(self, term):
+        key = term.encode("utf-8")
+        i = int(np.searchsorted(self.terms, key))
+        if i >= len(self.terms) or self.terms[i] != key:
+            return None
+        return self.rows[self.ptr[i]:self.ptr[i + 1]], self.tf[self.ptr[i]:self.ptr[i + 1]]
+
+    def search(self, query, k=10):
+        """Top-k (row, score) pairs by BM25."""
+        scores = None
+        for term in set(tokenize(query)):
+            hit = self._postings(term)
+            if hit is None:
+                continue
+            rows, tf = hit
+            if self.n >= MIN_DOCS_FOR_DF_CUTOFF and len(rows) > MAX_DF_RATIO * self.n:
+                continue
+            if scores is None:
+                scores = np.zeros(self.n, dtype=np.float32)
+            idf = np.log(1 + (self.n - len(rows) + 0.5) / (len(rows) + 0.5))
+            tf = tf.astype(np.float32)
+            norm = self.k1 * (1 - self.b + self.b * self.doclen[rows] / self.avgdl)
+            # Rows are unique within one postings list, so fancy-index += is safe
+            scores[rows] += idf * tf * (self.k1 + 1) / (tf + norm)
+        if scores is None:
+            return []
+        k = min(k, self.n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(r), float(scores[r])) for r in top if scores[r] > 0]
+
+
+def reciprocal_rank_fusion(ranked_lists, k=RRF_K):
+    """Merges ranked lists of hashable ids: score(d) = sum 1 / (k + rank)."""
+    fused = defaultdict(float)
+    for ranking in ranked_lists:
+        for rank, item in enumerate(ranking):
+            fused[item] += 1.0 / (k + rank + 1)
+    return [item for item, _ in sorted(fused.items(), key=lambda x: x[1], reverse=True)]
+
+
+# --- Benchmark: lexical lookup latency ---
+
+def benchmark(n_chunks=100_000, queries=1000):
+    """
+    Lexical lookup latency on a synthetic corpus (scratch index in a temp dir).
+    Whether hybrid retrieval saves graph loops over dense-only is measured
+    end to end by benchmark.py (bench_graph in both retrieval modes).
+    """
+    rng = np.random.default_rng(0)
+    vocab = [f"term{i}" for i in range(20_000)]
+    texts = []
+    for i in range(n_chunks):
+        words = rng.choice(vocab, 150).tolist()
+        texts.append(" ".join(words) + f" clause 4.{i % 97}.{i % 13} part PN-{i:06d}")
+
+    with tempfile.TemporaryDirectory(prefix="bm25_bench_") as db_path:
+        t0 = time.perf_counter()
+        build_index(texts, db_path)
+        print(f"\n📏 Built BM25 over {n_chunks} chunks in {time.perf_counter() - t0:.1f}s")
+
+        index = BM25Index.load(db_path)
+        picks = rng.integers(0, n_chunks, queries)
+        t0 = time.perf_counter()
+        found = 0
+        for i in picks:
+            top = index.search(f"part PN-{i:06d}", k=10)
+            found += any(row == i for row, _ in top)
+        ms = (time.perf_counter() - t0) * 1000 / queries
+        del index  # Unmap before the directory goes
+    print(f"   - exact part-number lookups: {ms:.3f} ms/query, target in top-10: {found / queries:.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark BM25 lexical lookups.")
+    parser.add_argument("--chunks", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+    benchmark(args.chunks, args.queries)
@@ -0,0 +1,139 @@
+import os
+import re
+import hashlib
+import numpy as np
+
+from bm25_index import tokenize
+
+# --- Context Assembly under a Token Budget ---
+# Everything that survives grading used to be pasted into the prompt as-is,
+# and prompt processing dominates latency on a local phi3. Before a context
+# reaches an LLM it is:
+#   1. deduplicated - chunks whose MinHash Jaccard estimate with an earlier
+#      (better-ranked) chunk is above DEDUP_THRESHOLD are dropped
+#   2. trimmed      - if it's still over budget, each chunk keeps only its
+#      sentences that overlap the query most (in their original order)
+#   3. fitted       - chunks are added in rank order until the budget is used up
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+DEDUP_THRESHOLD = 0.8
+NUM_PERM = 64
+SHINGLE_SIZE = 3
+MIN_CHUNK_TOKENS = 64  # Never trim a chunk below this share of the budget
+_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(42)
+_PERM_A = _rng.integers(1, _PRIME, NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, _PRIME, NUM_PERM, dtype=np.uint64)
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+_WORD_RE = re.compile(r"\w+|[^\w\s]")
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # Not installed, or the vocab can't be fetched offline
+    _encoding = None
+
+
+def count_tokens(text):
+    """tiktoken count when available, else ~1.3 tokens per word/punctuation mark."""
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return int(len(_WORD_RE.findall(text)) * 1.3) + 1
+
+
+def truncate_tokens(text, budget):
+    """The longest prefix of 'text' that is at most 'budget' tokens."""
+    if budget <= 0:
+        return ""
+    if _encoding is not None:
+        tokens = _encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= budget else _encoding.decode(tokens[:budget]).strip()
+    words = list(_WORD_RE.finditer(text))
+    keep = max(int((budget - 1) / 1.3), 0)
+    if keep >= len(words):
+        return text
+    return text[:words[keep - 1].end()] if keep else ""
+
+
+def minhash(text):
+    words = re.findall(r"\w+", text.lower())
+    shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(len(words) - SHINGLE_SIZE + 1, 1))}
+    hashes = np.array([int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+                       for s in shingles], dtype=np.uint64)
+    # a * h stays below 2^62, so uint64 arithmetic can't overflow
+    return ((np.outer(hashes, _PERM_A) + _PERM_B) % _PRIME).min(axis=0)
+
+
+def drop_near_duplicates(texts, threshold=DEDUP_THRESHOLD):
+    """Keeps the first of every group of near-identical texts (order preserved)."""
+    kept, signatures = [], []
+    for text in texts:
+        sig = minhash(text)
+        if any(np.mean(sig == other) >= threshold for other in signatures):
+            continue
+        kept.append(text)
+        signatures.append(sig)
+    return kept
+
+
+def split_sentences(text):
+    return [s.strip() for s in _SENTENCE_RE.split(text) if s.strip()]
+
+
+def trim_to_budget(query, text, budget):
+    """
+    Keeps the sentences of 'text' that share the most (rare) terms with the
+    query, up to 'budget' tokens, in their original order.
+    """
+    if count_tokens(text) <= budget:
+        return text
+    sentences = split_sentences(text)
+    terms = [set(tokenize(s)) for s in sentences]
+    query_terms = set(tokenize(query))
+    df = {t: sum(t in ts for ts in terms) for t in query_terms}
+    scores = [sum(np.log(1 + len(sentences) / df[t]) for t in query_terms & ts) for ts in terms]
+
+    chosen, used = set(), 0
+    for i in sorted(range(len(sentences)), key=lambda i: scores[i], reverse=True):
+        cost = count_tokens(sentences[i])
+        if used + cost > budget:
+            continue
+        chosen.add(i)
+        used += cost
+    if not chosen:
+        # No sentence fits (e.g. a table row or bullet dump without
+        # punctuation): hard-cut the best-matching one instead of losing it
+        best = max(range(len(sentences)), key=lambda i: scores[i]) if sentences else None
+        return truncate_tokens(sentences[best] if best is not None else text, budget)
+    return " ".join(sentences[i] for i in sorted(chosen))
+
+
+def fit_context(query, documents, budget=CONTEXT_TOKEN_BUDGET, dedup_threshold=DEDUP_THRESHOLD):
+    """
+    Returns the (deduplicated, trimmed) chunks of 'documents' that fit into
+    'budget' tokens. 'documents' must be best-first, as retrieval returns them.
+    """
+    chunks = drop_near_duplicates([d for d in documents if d.strip()], dedup_threshold)
+    if sum(count_tokens(c) for c in chunks) <= budget:
+        return chunks
+
+    share = max(budget // max(len(chunks), 1), MIN_CHUNK_TOKENS)
+    fitted, remaining = [], budget
+    for chunk in chunks:
+        trimmed = trim_to_budget(query, chunk, min(share, remaining))
+        cost = count_tokens(trimmed)
+        if not trimmed or cost > remaining:
+            continue  # A lower-ranked chunk may still fit
+        fitted.append(trimmed)
+        remaining -= cost
+    return fitted
+
+
+def assemble_context(query, documents, budget=CONTEXT_TOKEN_BUDGET, separator="\n\n"):
+    """fit_context() joined into one block, with a one-line size report."""
+    before = sum(count_tokens(d) for d in documents)
+    fitted = fit_context(query, documents, budget)
+    context = separator.join(fitted)
+    if before:
+        print(f"   📦 Context: {len(fitted)}/{len(documents)} chunks, {before} -> {count_tokens(context)} tokens")
+    return context
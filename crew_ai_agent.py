@@ -3,7 +3,9 @@ import sys
 from dotenv import load_dotenv
 from crewai import Agent, Task, Crew, Process, LLM
 from tools import search_tool
-from analysis_tools import code_interpreter, file_lister, pdf_extractor, vision_tool
+from tracing import CrewTracer
+from analysis_tools import code_interpreter, table_lookup, file_lister, pdf_extractor, vision_tool
+from interpreter_pool import get_interpreter_pool
 
 # --- 1. Load Secrets ---
 load_dotenv()
@@ -70,11 +72,13 @@ analyst = Agent(
     memory=True,
     backstory=(
         "You receive raw text and lists of image paths."
-        "1. If you see tabular data in the text, use 'Code Interpreter' to calculate trends/averages."
-        "2. You must use the 'Vision Analyst' tool on EVERY image path provided by the Researcher."
+        "1. If you see tabular data in the text, use 'Table Lookup' to load the extracted table as a DataFrame, "
+        "then 'Code Interpreter' to calculate trends/averages."
+        "2. You must use the 'Vision Analyst' tool on EVERY image path provided by the Researcher "
+        "(pass them all in one call, separated by commas, so they are analyzed concurrently)."
         "3. You verify if the text matches the visual data."
     ),
-    tools=[code_interpreter, vision_tool], 
+    tools=[table_lookup, code_interpreter, vision_tool], 
     llm=selected_llm
 )
 
@@ -110,8 +114,8 @@ def run_crew(user_question):
     task_analysis = Task(
         description=(
             "Review the Researcher's output.\n"
-            "1. If image paths are listed, use the 'Vision Analyst' tool on EACH image to understand what it shows (charts, diagrams, etc.).\n"
-            "2. If tabular data is found, use 'Code Interpreter' to check the numbers.\n"
+            "1. If image paths are listed, use the 'Vision Analyst' tool on EACH image (all paths in one comma-separated call) to understand what it shows (charts, diagrams, etc.).\n"
+            "2. If tabular data is found, load it with 'Table Lookup' and use 'Code Interpreter' to check the numbers.\n"
             "3. Combine the visual insights with the text facts."
         ),
         expected_output='A technical analysis merging text data and visual descriptions.',
@@ -133,13 +137,22 @@ def run_crew(user_question):
         context=[task_analysis] 
     )
 
+    # Times every agent step and task (see tracing.py)
+    tracer = CrewTracer()
     enterprise_crew = Crew(
         agents=[researcher, analyst, writer],
         tasks=[task_research, task_analysis, task_writing],
-        process=Process.sequential 
+        process=Process.sequential,
+        step_callback=tracer.step,
+        task_callback=tracer.task
     )
 
-    result = enterprise_crew.kickoff()
+    # Start the interpreter workers now, so pandas is imported while the researcher works
+    get_interpreter_pool()
+    try:
+        result = tracer.kickoff(enterprise_crew)
+    finally:
+        code_interpreter.close()  # Next run starts with a clean namespace
     return result
 
 # --- 4. Execution ---
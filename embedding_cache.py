@@ -0,0 +1,263 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, use one process per cache dir
+    fcntl = None
+
+# --- Persistent Embedding Cache ---
+# Wraps any LangChain embeddings object. Vectors are stored as one
+# memory-mapped float32 matrix per model ('vectors.f32'). Which text hash
+# owns which row is kept in an append-only log ('index.log', one "hash row"
+# line per stored vector), so a call only writes what it added. When the
+# cache is full the least recently used row is overwritten, so the files
+# never grow past the size cap; the log is compacted once it is mostly
+# superseded lines. Several processes (app, ingest) can share a cache dir:
+# every access takes a file lock and first replays what others appended.
+
+CACHE_DIR = "embedding_cache"
+DEFAULT_MAX_ENTRIES = 200_000
+GROW_ROWS = 4096
+COMPACT_FACTOR = 2  # rewrite the log once it has this many lines per live entry
+
+
+def normalize_text(text):
+    """Collapses whitespace so cosmetic differences still hit the cache."""
+    return " ".join(text.split())
+
+
+def text_hash(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Drop-in replacement for OllamaEmbeddings that only calls the backend
+    for texts it has never seen before (per model).
+    """
+
+    def __init__(self, embeddings, model=None, cache_dir=CACHE_DIR, max_entries=DEFAULT_MAX_ENTRIES):
+        self.embeddings = embeddings
+        self.model = model or getattr(embeddings, "model", type(embeddings).__name__)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        safe_model = "".join(c if c.isalnum() or c in "-_." else "_" for c in self.model)
+        self.path = os.path.join(cache_dir, safe_model)
+        self.vectors_path = os.path.join(self.path, "vectors.f32")
+        self.log_path = os.path.join(self.path, "index.log")
+        self.meta_path = os.path.join(self.path, "meta.json")
+        os.makedirs(self.path, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._lock_file = open(os.path.join(self.path, ".lock"), "a+")
+        self._matrix = None
+        self.dim = None
+        self.capacity = 0
+        self._reset()
+        with self._locked():
+            self._migrate_json_index()
+            self._catch_up()
+
+    # --- Storage ---
+
+    def _reset(self):
+        self.entries = OrderedDict()  # hash -> row, least recently used first
+        self._owners = {}             # row -> hash
+        self._log_offset = 0
+        self._log_inode = None
+        self._log_lines = 0
+
+    @contextmanager
+    def _locked(self):
+        """Thread lock plus an exclusive lock on the cache dir (shared with other processes)."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _assign(self, key, row):
+        old_owner = self._owners.get(row)
+        if old_owner is not None and old_owner != key:
+            self.entries.pop(old_owner, None)  # Evicted (here or by another process)
+        old_row = self.entries.get(key)
+        if old_row is not None and old_row != row:
+            self._owners.pop(old_row, None)
+        self.entries[key] = row
+        self.entries.move_to_end(key)
+        self._owners[row] = key
+
+    def _map(self):
+        """(Re)maps the vectors file if it grew, possibly in another process."""
+        if self.dim is None or not os.path.exists(self.vectors_path):
+            return
+        capacity = os.path.getsize(self.vectors_path) // (4 * self.dim)
+        if capacity != self.capacity or self._matrix is None:
+            self._matrix = None
+            self.capacity = capacity
+            if capacity:
+                self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r+",
+                                         shape=(capacity, self.dim))
+
+    def _catch_up(self):
+        """Replays log lines written since we last looked (by any process). Caller holds the lock."""
+        if self.dim is None and os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+        if not os.path.exists(self.log_path):
+            if self._log_inode is not None:
+                self._reset()
+            self._map()
+            return
+        stat = os.stat(self.log_path)
+        if stat.st_ino != self._log_inode or stat.st_size < self._log_offset:
+            self._reset()  # Compacted (replaced) by someone: read it from the start
+            self._log_inode = stat.st_ino
+        if stat.st_size > self._log_offset:
+            with open(self.log_path, "rb") as f:
+                f.seek(self._log_offset)
+                data = f.read()
+            end = data.rfind(b"\n") + 1  # Ignore a half-written last line
+            for line in data[:end].decode("ascii").splitlines():
+                key, row = line.split()
+                self._assign(key, int(row))
+                self._log_lines += 1
+            self._log_offset += end
+        self._map()
+
+    def _migrate_json_index(self):
+        """Converts the older index.json (hash -> [row, last_used]) into the log."""
+        old_path = os.path.join(self.path, "index.json")
+        if not os.path.exists(old_path) or os.path.exists(self.log_path):
+            return
+        try:
+            with open(old_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            items = sorted(meta["entries"].items(), key=lambda kv: kv[1][1])
+            self._write_meta(meta["dim"])
+            with open(self.log_path, "w", encoding="ascii") as f:
+                f.writelines(f"{key} {row}\n" for key, (row, _) in items)
+        except (OSError, ValueError, KeyError):
+            print("⚠️  Old embedding cache index is unreadable. Starting empty.")
+        os.remove(old_path)
+
+    def _write_meta(self, dim):
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": dim}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def _grow(self, rows):
+        self._matrix = None
+        capacity = min(self.max_entries, max(rows, self.capacity + GROW_ROWS))
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(capacity * self.dim * 4)
+        self._map()
+
+    def _free_row(self):
+        """Returns a writable row, evicting the least recently used entry if full."""
+        used = len(self._owners)
+        if used < self.max_entries:
+            if used >= self.capacity:
+                self._grow(used + 1)
+            # Rows are packed 0..used-1 until the cap is reached
+            return used
+        victim, row = self.entries.popitem(last=False)
+        del self._owners[row]
+        return row
+
+    def _append(self, lines):
+        with open(self.log_path, "ab") as f:
+            f.write("".join(lines).encode("ascii"))
+        self._log_lines += len(lines)
+        self._log_offset = os.path.getsize(self.log_path)
+        self._log_inode = os.stat(self.log_path).st_ino
+        if self._log_lines > COMPACT_FACTOR * max(len(self.entries), GROW_ROWS):
+            self._compact()
+
+    def _compact(self):
+        """Rewrites the log as one line per live entry, in LRU order."""
+        tmp_path = self.log_path + ".tmp"
+        with open(tmp_path, "w", encoding="ascii") as f:
+            f.writelines(f"{key} {row}\n" for key, row in self.entries.items())
+        os.replace(tmp_path, self.log_path)
+        stat = os.stat(self.log_path)
+        self._log_inode, self._log_offset, self._log_lines = stat.st_ino, stat.st_size, len(self.entries)
+
+    def flush(self):
+        with self._locked():
+            if self._matrix is not None:
+                self._matrix.flush()
+
+    # --- Embeddings API ---
+
+    def embed_documents(self, texts):
+        keys = [text_hash(t) for t in texts]
+        results = [None] * len(texts)
+        missing = {}
+
+        with self._locked():
+            self._catch_up()
+            for i, key in enumerate(keys):
+                row = self.entries.get(key)
+                if row is not None:
+                    self.entries.move_to_end(key)
+                    results[i] = self._matrix[row].tolist()
+                else:
+                    missing.setdefault(key, []).append(i)
+            self.hits += len(texts) - sum(len(v) for v in missing.values())
+            self.misses += len(missing)
+
+        if not missing:
+            return results
+
+        # Only unseen texts go to the backend (one request, deduplicated)
+        pending = list(missing)
+        vectors = self.embeddings.embed_documents([texts[missing[k][0]] for k in pending])
+        for key, vector in zip(pending, vectors):
+            for i in missing[key]:
+                results[i] = vector
+
+        with self._locked():
+            self._catch_up()
+            if self.dim is None:
+                self.dim = len(vectors[0])
+                self._write_meta(self.dim)
+            lines = []
+            for key, vector in zip(pending, vectors):
+                if key in self.entries:
+                    continue  # Another thread/process stored it meanwhile
+                row = self._free_row()
+                self._matrix[row] = np.asarray(vector, dtype=np.float32)
+                self._assign(key, row)
+                lines.append(f"{key} {row}\n")
+            if lines:
+                # Vectors first, then the log lines that make them visible
+                self._matrix.flush()
+                self._append(lines)
+        return results
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "entries": len(self.entries),
+        }
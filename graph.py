@@ -4,13 +4,45 @@ os.environ["USE_TF"] = "0"
 os.environ["USE_TORCH"] = "1"
 os.environ["TRANSFORMERS_NO_ADVISORY_WARNINGS"] = "true"
 
+import re
+import json
+import time
+import uuid
+import hashlib
+import sqlite3
+import asyncio
+import inspect
+import threading
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from typing import TypedDict, List
 from langgraph.graph import StateGraph, END
+from langgraph.types import CachePolicy
+from langgraph.cache.sqlite import SqliteCache
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_ollama import ChatOllama
+from langchain_core.runnables import RunnableConfig
+from langchain_core.callbacks import BaseCallbackHandler
 
 # Import our custom tools
-from tools import retrieve_documents, validate_relevance
+from tools import (retrieve_documents, validate_relevance_batch, get_reranker, get_llm, get_embeddings,
+                   query_cache, RERANK_ACCEPT_SCORE, RERANK_REJECT_SCORE, DB_PATH)
+from rerank_service import doc_key
+from llm_cache import make_chat_model
+from context_budget import assemble_context
+import tracing
+
+# "sequential": rewrite one query per failed grading, up to 3 loops.
+# "speculative": write N rewrites up front, retrieve for all of them at once,
+# and grade the merged candidates a single time.
+REWRITE_MODE = os.getenv("REWRITE_MODE", "sequential")
+SPECULATIVE_REWRITES = int(os.getenv("SPECULATIVE_REWRITES", "3"))
+SPECULATIVE_K = 5  # Merged candidates passed on to grading
+
+# Checkpoints (resumable runs) and memoized node results share one SQLite file
+GRAPH_STATE_DB = os.getenv("GRAPH_STATE_DB", "graph_state.sqlite")
+NODE_CACHE_TTL = int(os.getenv("NODE_CACHE_TTL", "0")) or None  # seconds; 0 = keep forever
 
 # --- 1. Define the "State" ---
 # The State is the "Short-term Memory" of the agent.
@@ -18,12 +50,26 @@ from tools import retrieve_documents, validate_relevance
 class AgentState(TypedDict):
     question: str
     documents: List[str]
+    scores: List[float]  # cross-encoder score of each document
     loop_step: int
+    answer: str
 
 # --- 2. Define the Nodes (The Actions) ---
 
-llm = ChatOllama(model="phi3", temperature=0)
+# Built on first use: make_chat_model opens the LLM response cache (a file)
+_llm = None
+_llm_lock = threading.Lock()
 
+def get_answer_llm():
+    """The chat model that writes answers and rewrites questions."""
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                _llm = make_chat_model("phi3", temperature=0)
+    return _llm
+
+@tracing.traced("graph.retrieve")
 def retrieve_node(state: AgentState):
     """
     Action: Search the vector database.
@@ -32,48 +78,60 @@ def retrieve_node(state: AgentState):
     print(f"\n--- 🔄 Step {state['loop_step']}: Retrieving Documents ---")
     
     # Use our tool from Step 3
-    docs = retrieve_documents(question)
+    docs = retrieve_documents(question, with_scores=True)
     
     # Extract just the text content to keep state clean
-    doc_texts = [d.page_content for d in docs]
+    doc_texts = [d.page_content for d, _ in docs]
+    scores = [score for _, score in docs]
     
-    return {"documents": doc_texts, "loop_step": state["loop_step"] + 1}
+    return {"documents": doc_texts, "scores": scores, "loop_step": state["loop_step"] + 1}
 
+@tracing.traced("graph.grade")
 def grade_documents_node(state: AgentState):
     """
-    Action: Check if the retrieved documents are relevant.
-    This node doesn't change data, it just passes it to the 'Conditional Edge' logic.
+    Action: Check which of the retrieved documents are relevant.
+    Confident cross-encoder scores decide on their own; everything in between
+    is graded by the LLM in one batch. Only the chunks that pass are kept,
+    so an empty list still means "retry".
     """
     print("--- ⚖️  Grading Documents ---")
     question = state["question"]
     documents = state["documents"]
+    scores = state.get("scores") or [None] * len(documents)
     
-    # We only check the first (best) document for speed in this demo
     if not documents:
-        return {"documents": []} # No docs found
-        
-    validation = validate_relevance(question, documents[0])
-    
-    # We verify the result. If "yes", we keep the docs. If "no", we clear them.
-    if validation['relevance'] == 'yes':
-        print("   ✅ Validator: Documents are RELEVANT.")
-        return {"documents": documents} # Keep them
+        return {"documents": [], "scores": []} # No docs found
+
+    verdicts = [None] * len(documents)
+    undecided = []
+    for i, score in enumerate(scores):
+        if score is not None and score >= RERANK_ACCEPT_SCORE:
+            verdicts[i] = True
+        elif score is not None and score <= RERANK_REJECT_SCORE:
+            verdicts[i] = False
+        else:
+            undecided.append(i)
+
+    skipped = len(documents) - len(undecided)
+    if skipped:
+        print(f"   ⚡ {skipped} document(s) decided by re-ranker score alone.")
+    if undecided:
+        results = validate_relevance_batch(question, [documents[i] for i in undecided])
+        for i, result in zip(undecided, results):
+            verdicts[i] = result.get("relevance") == "yes"
+
+    kept = [i for i, ok in enumerate(verdicts) if ok]
+    if kept:
+        print(f"   ✅ Validator: {len(kept)}/{len(documents)} documents are RELEVANT.")
     else:
         print("   ❌ Validator: Documents are IRRELEVANT.")
-        return {"documents": []} # Clear them to trigger a re-try
+    return {"documents": [documents[i] for i in kept], "scores": [scores[i] for i in kept]}
 
-def generate_node(state: AgentState):
-    """
-    Action: Generate the final answer using the relevant documents.
-    """
-    print("--- ✍️  Generating Final Answer ---")
-    question = state["question"]
-    documents = state["documents"]
+def build_answer_prompt(question, documents):
+    # Combine the docs into one context block that fits the token budget
+    context = assemble_context(question, documents)
     
-    # Combine all docs into one context block
-    context = "\n\n".join(documents)
-    
-    prompt = f"""
+    return f"""
     You are an Enterprise Assistant. Use the following context to answer the user's question.
     If the answer is not in the context, say "I don't know".
     
@@ -85,11 +143,30 @@ def generate_node(state: AgentState):
     
     Answer:
     """
+
+@tracing.traced("graph.generate")
+def generate_node(state: AgentState):
+    """
+    Action: Generate the final answer using the relevant documents.
+    """
+    print("--- ✍️  Generating Final Answer ---")
+    prompt = build_answer_prompt(state["question"], state["documents"])
     
-    response = llm.invoke(prompt)
+    response = get_answer_llm().invoke(prompt)
     print(f"\n🤖 FINAL ANSWER:\n{response.content}")
-    return {}
+    return {"answer": response.content}
 
+def build_rewrite_messages(question):
+    return [
+        HumanMessage(content=f"""
+        Look at the input and try to reason about the underlying semantic intent / meaning.
+        Input: {question}
+        
+        Return ONLY the improved query string, nothing else.
+        """)
+    ]
+
+@tracing.traced("graph.rewrite")
 def rewrite_query_node(state: AgentState):
     """
     Action: The documents were bad, so we rewrite the question to try again.
@@ -97,19 +174,114 @@ def rewrite_query_node(state: AgentState):
     print("--- 🧠 Reasoning: Rewriting Query ---")
     question = state["question"]
     
-    msg = [
+    response = get_answer_llm().invoke(build_rewrite_messages(question))
+    new_query = response.content
+    print(f"   Original: '{question}' -> New: '{new_query}'")
+    
+    return {"question": new_query}
+
+def generate_rewrites(question, n=SPECULATIVE_REWRITES):
+    """
+    Asks for 'n' differently-phrased search queries in one LLM call.
+    Returns at most 'n' distinct queries (may be fewer if the model rambles).
+    """
+    response = get_answer_llm().invoke([
         HumanMessage(content=f"""
         Look at the input and try to reason about the underlying semantic intent / meaning.
         Input: {question}
         
-        Return ONLY the improved query string, nothing else.
+        Write {n} different search queries for it, e.g. using synonyms, expanding
+        acronyms or naming the specific figures the user is after.
+        Return ONLY the queries, one per line, nothing else.
         """)
-    ]
-    
-    response = llm.invoke(msg)
+    ])
+    rewrites = []
+    for line in response.content.splitlines():
+        query = re.sub(r"^\s*(?:[-*•]|\d+[.)])\s*", "", line).strip().strip('"')
+        if query and query.lower() != question.lower() and query not in rewrites:
+            rewrites.append(query)
+    return rewrites[:n]
+
+@tracing.traced("graph.speculative_retrieve")
+def speculative_retrieve_node(state: AgentState):
+    """
+    Action: Retrieve for the original question and N rewrites concurrently.
+    The original query starts searching while the rewrites are being written.
+    Candidates are deduplicated by chunk id and re-scored against the
+    original question, so scores from different queries are comparable.
+    """
+    question = state["question"]
+    print(f"\n--- 🔀 Step {state['loop_step']}: Speculative Retrieval ---")
+
+    with ThreadPoolExecutor(max_workers=SPECULATIVE_REWRITES + 1) as pool:
+        futures = [pool.submit(retrieve_documents, question, with_scores=True)]
+        rewrites = generate_rewrites(question)
+        print(f"   Rewrites: {rewrites}")
+        futures += [pool.submit(retrieve_documents, q, with_scores=True) for q in rewrites]
+        results = [f.result() for f in futures]
+
+    unique = {}
+    for docs in results:
+        for doc, _ in docs:
+            unique.setdefault(doc_key(doc), doc)
+    candidates = list(unique.values())
+    if not candidates:
+        return {"documents": [], "scores": [], "loop_step": state["loop_step"] + 1}
+
+    # Pairs for the original query's own hits come from the rerank cache
+    scores = get_reranker().score(question, candidates)
+    ranked = sorted(zip(candidates, scores), key=lambda x: x[1], reverse=True)[:SPECULATIVE_K]
+    print(f"   Merged {sum(len(r) for r in results)} hits into {len(candidates)} unique chunks.")
+    return {
+        "documents": [d.page_content for d, _ in ranked],
+        "scores": [s for _, s in ranked],
+        "loop_step": state["loop_step"] + 1,
+    }
+
+
+# --- 2b. Async Nodes ---
+# Same actions for app.ainvoke / app.astream, so many questions can share one
+# event loop. Retrieval and grading are CPU/blocking work, so they run in a
+# worker thread; the LLM calls are awaited natively.
+
+async def aretrieve_node(state: AgentState):
+    return await asyncio.to_thread(retrieve_node, state)
+
+async def agrade_documents_node(state: AgentState):
+    return await asyncio.to_thread(grade_documents_node, state)
+
+@tracing.traced("graph.generate")
+async def agenerate_node(state: AgentState, config: RunnableConfig):
+    """
+    Streams the answer token by token. Pass a sync or async callable as
+    config["configurable"]["on_token"] to receive each token as it arrives.
+    """
+    print("--- ✍️  Generating Final Answer (streaming) ---")
+    on_token = config.get("configurable", {}).get("on_token")
+    prompt = build_answer_prompt(state["question"], state["documents"])
+
+    parts = []
+    async for chunk in get_answer_llm().astream(prompt):
+        token = chunk.content
+        if not token:
+            continue
+        parts.append(token)
+        if on_token is not None:
+            result = on_token(token)
+            if inspect.isawaitable(result):
+                await result
+    return {"answer": "".join(parts)}
+
+async def aspeculative_retrieve_node(state: AgentState):
+    return await asyncio.to_thread(speculative_retrieve_node, state)
+
+@tracing.traced("graph.rewrite")
+async def arewrite_query_node(state: AgentState):
+    print("--- 🧠 Reasoning: Rewriting Query ---")
+    question = state["question"]
+    response = await get_answer_llm().ainvoke(build_rewrite_messages(question))
     new_query = response.content
     print(f"   Original: '{question}' -> New: '{new_query}'")
-    
     return {"question": new_query}
 
 
@@ -136,50 +308,275 @@ def decide_next_step(state: AgentState):
 
 
 # --- 4. Build the Graph ---
+# Every run is checkpointed per thread id, so a run that dies halfway is
+# resumed from the last finished node. On top of that each node's output is
+# memoized by a hash of the state fields it actually reads, so repeating a
+# question (even on a new thread) skips work that was already done.
+
+def _state_key(*fields):
+    def key(state):
+        values = [state.get(f) for f in fields]
+        return hashlib.sha256(json.dumps(values, default=str).encode("utf-8")).hexdigest()
+    return key
+
+def _index_stamp():
+    # Retrieval results are only reusable until ingest rewrites the index
+    try:
+        st = os.stat(os.path.join(DB_PATH, "manifest.json"))
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+def _retrieve_key(state):
+    return _state_key("question", "loop_step")(state) + str(_index_stamp())
 
-workflow = StateGraph(AgentState)
+CACHE_POLICIES = {
+    "retrieve": CachePolicy(key_func=_retrieve_key, ttl=NODE_CACHE_TTL),
+    "grade": CachePolicy(key_func=_state_key("question", "documents", "scores"), ttl=NODE_CACHE_TTL),
+    "rewrite": CachePolicy(key_func=_state_key("question"), ttl=NODE_CACHE_TTL),
+    "generate": CachePolicy(key_func=_state_key("question", "documents"), ttl=NODE_CACHE_TTL),
+}
 
-# Add the nodes
-workflow.add_node("retrieve", retrieve_node)
-workflow.add_node("grade", grade_documents_node)
-workflow.add_node("rewrite", rewrite_query_node)
-workflow.add_node("generate", generate_node)
+def build_graph(retrieve, grade, rewrite, generate):
+    workflow = StateGraph(AgentState)
 
-# Set the Entry Point
-workflow.set_entry_point("retrieve")
+    # Add the nodes
+    workflow.add_node("retrieve", retrieve, cache_policy=CACHE_POLICIES["retrieve"])
+    workflow.add_node("grade", grade, cache_policy=CACHE_POLICIES["grade"])
+    workflow.add_node("rewrite", rewrite, cache_policy=CACHE_POLICIES["rewrite"])
+    workflow.add_node("generate", generate, cache_policy=CACHE_POLICIES["generate"])
 
-# Add the edges (Connections)
-workflow.add_edge("retrieve", "grade")
+    # Set the Entry Point
+    workflow.set_entry_point("retrieve")
 
-# Conditional Edge: After grading, decide what to do
-workflow.add_conditional_edges(
-    "grade",
-    decide_next_step,
-    {
-        "generate": "generate",
-        "rewrite": "rewrite"
+    # Add the edges (Connections)
+    workflow.add_edge("retrieve", "grade")
+
+    # Conditional Edge: After grading, decide what to do
+    workflow.add_conditional_edges(
+        "grade",
+        decide_next_step,
+        {
+            "generate": "generate",
+            "rewrite": "rewrite"
+        }
+    )
+
+    # Connect the loop back
+    workflow.add_edge("rewrite", "retrieve")
+    workflow.add_edge("generate", END)
+
+    return workflow
+
+def build_speculative_graph(retrieve, grade, generate):
+    # No loop: one round of (original + N rewrites) retrieval, one grading pass
+    workflow = StateGraph(AgentState)
+    workflow.add_node("retrieve", retrieve, cache_policy=CACHE_POLICIES["retrieve"])
+    workflow.add_node("grade", grade, cache_policy=CACHE_POLICIES["grade"])
+    workflow.add_node("generate", generate, cache_policy=CACHE_POLICIES["generate"])
+    workflow.set_entry_point("retrieve")
+    workflow.add_edge("retrieve", "grade")
+    workflow.add_edge("grade", "generate")
+    workflow.add_edge("generate", END)
+    return workflow
+
+sequential_workflow = build_graph(retrieve_node, grade_documents_node, rewrite_query_node, generate_node)
+speculative_workflow = build_speculative_graph(speculative_retrieve_node, grade_documents_node, generate_node)
+if REWRITE_MODE == "speculative":
+    async_workflow = build_speculative_graph(aspeculative_retrieve_node, agrade_documents_node, agenerate_node)
+else:
+    async_workflow = build_graph(aretrieve_node, agrade_documents_node, arewrite_query_node, agenerate_node)
+
+# Compile the machine. GRAPH_STATE_DB is only opened on first use, so
+# importing this module (e.g. for the benchmark) creates no files.
+_node_cache = None
+_app = None
+_async_app = None
+_compile_lock = threading.Lock()
+
+def get_node_cache():
+    global _node_cache
+    if _node_cache is None:
+        with _compile_lock:
+            if _node_cache is None:
+                _node_cache = SqliteCache(path=GRAPH_STATE_DB)
+    return _node_cache
+
+def get_app():
+    """The checkpointed, memoized graph for REWRITE_MODE (compiled on first use)."""
+    global _app
+    if _app is None:
+        node_cache = get_node_cache()
+        with _compile_lock:
+            if _app is None:
+                checkpointer = SqliteSaver(sqlite3.connect(GRAPH_STATE_DB, check_same_thread=False))
+                workflow = speculative_workflow if REWRITE_MODE == "speculative" else sequential_workflow
+                _app = workflow.compile(checkpointer=checkpointer, cache=node_cache)
+    return _app
+
+def get_async_app():
+    """
+    Memoized but not checkpointed; astream_answer / arun_many open an async
+    checkpointer themselves, since it must be created inside the event loop.
+    """
+    global _async_app
+    if _async_app is None:
+        node_cache = get_node_cache()
+        with _compile_lock:
+            if _async_app is None:
+                _async_app = async_workflow.compile(cache=node_cache)
+    return _async_app
+
+def initial_state(question):
+    return {
+        "question": question,
+        "documents": [],
+        "scores": [],
+        "loop_step": 0,
+        "answer": ""
     }
-)
 
-# Connect the loop back
-workflow.add_edge("rewrite", "retrieve")
-workflow.add_edge("generate", END)
+def thread_config(thread_id=None, **configurable):
+    """
+    Run config for one graph run. Without a thread id every run gets a fresh one;
+    pass the same id again to resume that run.
+    """
+    thread_id = thread_id or uuid.uuid4().hex
+    return {"configurable": {"thread_id": thread_id, **configurable}}
+
+def run_question(question, thread_id=None):
+    """
+    Answers 'question' on a checkpointed thread. If an earlier run on the same
+    thread stopped before finishing, it is resumed instead of restarted.
+    """
+    app = get_app()
+    config = thread_config(thread_id)
+    with tracing.span("graph.run", thread_id=config["configurable"]["thread_id"]):
+        if app.get_state(config).next:
+            print("--- ♻️  Resuming unfinished run ---")
+            return app.invoke(None, config)
+        return app.invoke(initial_state(question), config)
+
+async def _arun_question(graph, question, thread_id=None, **configurable):
+    config = thread_config(thread_id, **configurable)
+    with tracing.span("graph.run", thread_id=config["configurable"]["thread_id"]):
+        if (await graph.aget_state(config)).next:
+            print("--- ♻️  Resuming unfinished run ---")
+            return await graph.ainvoke(None, config)
+        return await graph.ainvoke(initial_state(question), config)
+
+async def astream_answer(question, thread_id=None):
+    """
+    Async iterator over the answer tokens for one question. The graph runs
+    as a background task; tokens are yielded as soon as the LLM emits them.
+    """
+    tokens = asyncio.Queue()
+    done = object()
+    streamed = False
+
+    async def run():
+        try:
+            async with AsyncSqliteSaver.from_conn_string(GRAPH_STATE_DB) as saver:
+                graph = async_workflow.compile(checkpointer=saver, cache=get_node_cache())
+                return await _arun_question(graph, question, thread_id, on_token=tokens.put)
+        finally:
+            await tokens.put(done)
+
+    task = asyncio.create_task(run())
+    while (token := await tokens.get()) is not done:
+        streamed = True
+        yield token
+    result = await task  # Re-raise any error from the graph
+    if not streamed and result.get("answer"):
+        yield result["answer"]  # Memoized answer: nothing was generated, so nothing streamed
+
+async def arun_many(questions):
+    """Answers several questions concurrently on one event loop."""
+    async with AsyncSqliteSaver.from_conn_string(GRAPH_STATE_DB) as saver:
+        graph = async_workflow.compile(checkpointer=saver, cache=get_node_cache())
+        results = await asyncio.gather(*(_arun_question(graph, q) for q in questions))
+    return [r["answer"] for r in results]
+
+# --- Benchmark: sequential loop vs. speculative rewrites ---
+
+class LLMCallCounter(BaseCallbackHandler):
+    def __init__(self):
+        self.calls = 0
+
+    def on_llm_start(self, *args, **kwargs):
+        self.calls += 1
+
+    def on_chat_model_start(self, *args, **kwargs):
+        self.calls += 1
+
+def benchmark_rewrite_modes(questions):
+    """End-to-end latency and LLM calls per question for both graph variants."""
+    counter = LLMCallCounter()
+    llms = [get_answer_llm(), get_llm()]
+    saved = [(m.callbacks, m.cache) for m in llms]
+    for m in llms:
+        m.callbacks = [counter]
+        m.cache = False  # LLM response cache off: both modes pay for every call
+
+    report = {}
+    try:
+        # Plain compiles (no node memoization). The in-memory query and
+        # rerank caches are emptied before each mode, so the mode that runs
+        # second doesn't get the first one's retrievals for free. The
+        # questions' embeddings are cached up front, so both modes find them warm.
+        get_embeddings().embed_documents(questions)
+        for mode, graph in (("sequential", sequential_workflow.compile()), ("speculative", speculative_workflow.compile())):
+            query_cache.clear()
+            get_reranker().clear()
+            latencies, calls = [], []
+            for question in questions:
+                counter.calls = 0
+                t0 = time.perf_counter()
+                graph.invoke(initial_state(question))
+                latencies.append(time.perf_counter() - t0)
+                calls.append(counter.calls)
+            report[mode] = {
+                "mean_s": sum(latencies) / len(latencies),
+                "max_s": max(latencies),
+                "mean_llm_calls": sum(calls) / len(calls),
+                "max_llm_calls": max(calls),
+            }
+    finally:
+        for m, (callbacks, cache) in zip(llms, saved):
+            m.callbacks = callbacks
+            m.cache = cache
+
+    print(f"\n📊 Rewrite modes over {len(questions)} question(s):")
+    for mode, r in report.items():
+        print(f"   - {mode:<12} mean {r['mean_s']:.2f}s  max {r['max_s']:.2f}s  "
+              f"LLM calls mean {r['mean_llm_calls']:.1f}  max {r['max_llm_calls']}")
+    return report
 
-# Compile the machine
-app = workflow.compile()
 
 # --- 5. Run It ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the autonomous research agent.")
+    parser.add_argument("--benchmark", nargs="+", metavar="QUESTION",
+                        help="Compare the sequential and speculative rewrite modes on these questions.")
+    parser.add_argument("--thread", help="Thread id to run on (re-use one to resume an interrupted run).")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark_rewrite_modes(args.benchmark)
+        raise SystemExit
+
     print("\n🚀 Starting Autonomous Agent...")
     
     # Test Question (Try a tricky one!)
     user_input = input("Enter your question: ")
+    thread_id = args.thread or uuid.uuid4().hex
+    print(f"🧵 Thread {thread_id} (pass --thread {thread_id} to resume it)")
     
-    inputs = {
-        "question": user_input,
-        "documents": [],
-        "loop_step": 0
-    }
-    
-    # Run the graph
-    result = app.invoke(inputs)
\ No newline at end of file
+    # Run the graph, printing the answer as it streams in
+    async def main():
+        print("\n🤖 FINAL ANSWER:")
+        async for token in astream_answer(user_input, thread_id):
+            print(token, end="", flush=True)
+        print()
+
+    asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,150 @@
+import os
+import argparse
+import numpy as np
+import fitz
+
+# --- Image Relevance Prefilter ---
+# Every image the Vision Analyst looks at costs a GPT-4o round trip. Before
+# that, a cheap local pass (downscaled pixmap + numpy) drops:
+#   - solid-colour and very-low-entropy images (spacers, backgrounds, rules)
+#   - near-duplicates of an image already kept (64-bit difference hash)
+#   - extreme banners (aspect ratio)
+# and ranks the rest by how chart/table/diagram-like they look: charts are
+# mostly flat background with a few solid colours, crisp edges and long
+# horizontal/vertical lines (axes, grid, table rules); photos have many
+# colours and soft, scattered edges. Only the top-N go on to vision.
+
+VISION_TOP_N = int(os.getenv("VISION_TOP_N", "8"))
+MIN_CHART_SCORE = 0.35
+MIN_ENTROPY = 0.1      # bits; solid fill 0, black-on-white line art ~0.3, photo ~7
+MIN_STD = 4.0          # grey-level standard deviation
+MAX_ASPECT = 5.0       # wider (or taller) than 5:1 is a banner / divider
+DUP_DISTANCE = 6       # max differing bits between dHashes of near-duplicates
+MAX_SIDE = 256         # features are computed on a downscaled copy
+
+
+def load_pixels(path):
+    """RGB uint8 array of the image, shrunk by powers of two to <= MAX_SIDE."""
+    pix = fitz.Pixmap(path)
+    if pix.colorspace is None or pix.colorspace.n != 3:
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)
+    shrink = 0
+    while max(pix.width, pix.height) >> shrink > MAX_SIDE:
+        shrink += 1
+    width, height = pix.width, pix.height
+    if shrink:
+        pix.shrink(shrink)
+    rgb = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)[:, :, :3]
+    return rgb, width, height
+
+
+def _block_mean(gray, rows, cols):
+    return np.array([[block.mean() for block in np.array_split(band, cols, axis=1)]
+                     for band in np.array_split(gray, rows, axis=0)])
+
+
+def dhash(gray):
+    """64-bit difference hash: is each cell brighter than its right neighbour?"""
+    # Below 8x9 pixels some cells would be empty (NaN means): repeat pixels first
+    rows, cols = -(-8 // gray.shape[0]), -(-9 // gray.shape[1])
+    if rows > 1 or cols > 1:
+        gray = np.repeat(np.repeat(gray, rows, axis=0), cols, axis=1)
+    small = _block_mean(gray, 8, 9)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def image_features(path):
+    rgb, width, height = load_pixels(path)
+    gray = rgb.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+    hist = np.bincount(gray.astype(np.uint8).ravel(), minlength=256) / gray.size
+    entropy = float(-(hist[hist > 0] * np.log2(hist[hist > 0])).sum())
+
+    # Colour concentration: share of pixels in the 8 most common 4-bit-per-channel colours
+    quantized = (rgb >> 4).astype(np.int32)
+    codes = (quantized[:, :, 0] << 8) | (quantized[:, :, 1] << 4) | quantized[:, :, 2]
+    counts = np.bincount(codes.ravel(), minlength=4096)
+    palette = float(np.sort(counts)[-8:].sum() / codes.size)
+
+    gx = np.abs(np.diff(gray, axis=1))
+    gy = np.abs(np.diff(gray, axis=0))
+    edges_x, edges_y = gx > 40, gy > 40
+    edge_density = float((edges_x.sum() + edges_y.sum()) / gray.size)
+    # Long straight lines: rows / columns where most pixels sit on a vertical edge
+    # (horizontal line) or horizontal edge (vertical line)
+    line_rows = float(np.mean(edges_y.mean(axis=1) > 0.5)) if edges_y.size else 0.0
+    line_cols = float(np.mean(edges_x.mean(axis=0) > 0.5)) if edges_x.size else 0.0
+    background = float(np.mean(gray > 230))
+
+    return {
+        "width": width,
+        "height": height,
+        "aspect": max(width, height) / max(min(width, height), 1),
+        "entropy": entropy,
+        "std": float(gray.std()),
+        "palette": palette,
+        "edge_density": edge_density,
+        "lines": line_rows + line_cols,
+        "background": background,
+        "dhash": dhash(gray),
+    }
+
+
+def chart_score(f):
+    """0..1: how much the image looks like a chart, table or diagram."""
+    score = 0.35 * f["palette"]                              # few flat colours
+    score += 0.25 * min(f["background"] / 0.5, 1.0)          # mostly plain background
+    score += 0.2 * min(f["lines"] / 0.05, 1.0)               # axes, gridlines, table rules
+    score += 0.2 * (1.0 - min(abs(f["edge_density"] - 0.08) / 0.08, 1.0))  # crisp but not busy
+    return float(score)
+
+
+def prefilter_images(paths, top_n=VISION_TOP_N, min_score=MIN_CHART_SCORE):
+    """
+    Returns (kept, skipped): 'kept' is up to top_n (path, score) pairs, best
+    first; 'skipped' maps each dropped path to the reason.
+    """
+    candidates, skipped, hashes = [], {}, []
+    for path in paths:
+        try:
+            f = image_features(path)
+        except Exception as e:
+            skipped[path] = f"unreadable ({e})"
+            continue
+        if f["std"] < MIN_STD or f["entropy"] < MIN_ENTROPY:
+            skipped[path] = "solid / low entropy"
+            continue
+        if f["aspect"] > MAX_ASPECT:
+            skipped[path] = "banner"
+            continue
+        if any(bin(f["dhash"] ^ h).count("1") <= DUP_DISTANCE for h in hashes):
+            skipped[path] = "near-duplicate"
+            continue
+        hashes.append(f["dhash"])
+        score = chart_score(f)
+        if score < min_score:
+            skipped[path] = f"not chart-like ({score:.2f})"
+            continue
+        candidates.append((path, score))
+
+    candidates.sort(key=lambda x: x[1], reverse=True)
+    for path, score in candidates[top_n:]:
+        skipped[path] = f"below top {top_n} ({score:.2f})"
+    return candidates[:top_n], skipped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rank images by how chart/table-like they are.")
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--top", type=int, default=VISION_TOP_N)
+    args = parser.parse_args()
+    kept, skipped = prefilter_images(args.images, args.top)
+    print("🖼️  Sent to vision:")
+    for path, score in kept:
+        print(f"   {score:.2f}  {path}")
+    print("🚫 Skipped:")
+    for path, reason in skipped.items():
+        print(f"   {path}: {reason}")
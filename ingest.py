@@ -1,51 +1,259 @@
 import os
+import json
+import hashlib
+import argparse
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_ollama import OllamaEmbeddings
 from langchain_community.vectorstores import FAISS
+from batch_embedder import make_embeddings
+import vector_index
+import mmap_store
+import bm25_index
+import table_store
 
 # Configuration
 PDF_PATH = "knowledge.pdf"
+DATA_DIR = "data"  # Corpus root shared with pipeline.py
 DB_PATH = "faiss_index"
+MANIFEST_PATH = os.path.join(DB_PATH, "manifest.json")
+MANIFEST_VERSION = 1
+WINDOW_SIZE = 256  # chunks embedded + added per step when streaming
 
-def ingest_documents():
-    # 1. Load the Data
-    # In a real enterprise app, you would have logic here to handle 
-    # different file types (confluence, slack dumps, etc.)
-    if not os.path.exists(PDF_PATH):
-        print(f"❌ Error: Could not find {PDF_PATH}. Please add a PDF to the folder.")
-        return
+# --- Manifest Helpers (Incremental Mode) ---
+# The manifest lives next to the FAISS files and remembers, per source file,
+# the file hash and the id/hash of every chunk we embedded from it.
+# Chunk ids are content hashes, so an unchanged chunk always maps to the same
+# vector and never has to be embedded again.
+
+def file_sha256(path):
+    """Hashes a file in 1MB blocks so large PDFs don't sit in memory."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def chunk_id(chunk):
+    """Stable id for a chunk: source + page + start offset + text."""
+    meta = chunk.metadata
+    key = f"{meta.get('source')}|{meta.get('page')}|{meta.get('start_index')}|{chunk.page_content}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_PATH):
+        return {"version": MANIFEST_VERSION, "files": {}}
+    with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        print("⚠️  Manifest version mismatch. Falling back to a full rebuild.")
+        return {"version": MANIFEST_VERSION, "files": {}}
+    return manifest
+
+def save_manifest(manifest):
+    os.makedirs(DB_PATH, exist_ok=True)
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, MANIFEST_PATH)
 
-    print(f"📄 Loading {PDF_PATH}...")
-    loader = PyPDFLoader(PDF_PATH)
-    raw_documents = loader.load()
-    print(f"   - Loaded {len(raw_documents)} pages.")
+# --- Source List ---
+# ingest.py and pipeline.py write the same index and manifests, so they must
+# agree on what the corpus is: every PDF under DATA_DIR, plus files given
+# explicitly. A manifest entry outside DATA_DIR is only dropped once the file
+# itself is gone, so neither entry point deletes the other's extra files.
 
-    # 2. Chunking Strategy (Crucial for RAG)
+def find_pdfs(data_dir=DATA_DIR):
+    pdfs = []
+    for root, _, files in os.walk(data_dir):
+        for name in sorted(files):
+            if name.lower().endswith(".pdf"):
+                pdfs.append(os.path.join(root, name))
+    return sorted(pdfs)
+
+def is_under(path, root):
+    root = os.path.abspath(root)
+    return os.path.commonpath([os.path.abspath(path), root]) == root
+
+def removed_files(manifest_files, sources, data_dir=DATA_DIR):
+    """Manifest entries that left the corpus: gone from data_dir, or deleted from disk."""
+    sources = set(sources)
+    return [p for p in manifest_files
+            if p not in sources and (is_under(p, data_dir) or not os.path.exists(p))]
+
+def make_splitter():
+    # Chunking Strategy (Crucial for RAG)
     # We split text into chunks of 1000 characters.
-    # 'chunk_overlap=200' ensures that sentences aren't cut in half 
+    # 'chunk_overlap=200' ensures that sentences aren't cut in half
     # at the edge of a chunk.
-    print("✂️  Splitting text into chunks...")
-    text_splitter = RecursiveCharacterTextSplitter(
+    return RecursiveCharacterTextSplitter(
         chunk_size=1000,
         chunk_overlap=200,
         add_start_index=True
     )
-    chunks = text_splitter.split_documents(raw_documents)
-    print(f"   - Created {len(chunks)} text chunks.")
+
+def iter_pdf_pages(path):
+    """Yields one page Document at a time instead of loading the whole PDF."""
+    loader = PyPDFLoader(path)
+    yield from loader.lazy_load()
+
+def iter_chunk_windows(path, window_size=WINDOW_SIZE):
+    """
+    Streams a PDF as lists of at most 'window_size' chunks.
+    Only the pages/chunks of the current window are alive at any time,
+    so peak memory doesn't depend on the page count.
+    """
+    text_splitter = make_splitter()
+    window = []
+    pages = 0
+    for page in iter_pdf_pages(path):
+        pages += 1
+        window.extend(text_splitter.split_documents([page]))
+        while len(window) >= window_size:
+            yield window[:window_size]
+            window = window[window_size:]
+    if window:
+        yield window
+    print(f"   - Streamed {pages} pages from {path}.")
+
+def ingest_documents(pdf_paths=None, incremental=True, window_size=WINDOW_SIZE, index_type=None):
+    """
+    Builds (or updates) the FAISS index.
+    With incremental=True only new/changed chunks are embedded and vectors
+    belonging to changed or deleted files are removed from the existing index.
+    Pages are read, split, embedded and added in windows of 'window_size' chunks.
+    'index_type' is one of vector_index.INDEX_TYPES (default: keep the current one).
+    The corpus is every PDF under DATA_DIR plus 'pdf_paths' (default: PDF_PATH if present).
+    """
+    if pdf_paths is None:
+        pdf_paths = [PDF_PATH] if os.path.exists(PDF_PATH) else []
+    pdf_paths = list(dict.fromkeys(find_pdfs(DATA_DIR) + list(pdf_paths)))
+
+    # 1. Load the Data
+    # In a real enterprise app, you would have logic here to handle
+    # different file types (confluence, slack dumps, etc.)
+    missing = [p for p in pdf_paths if not os.path.exists(p)]
+    for path in missing:
+        print(f"❌ Error: Could not find {path}. Please add a PDF to the folder.")
+    pdf_paths = [p for p in pdf_paths if p not in missing]
+
+    index_exists = os.path.exists(os.path.join(DB_PATH, "index.faiss"))
+    if incremental and index_exists:
+        manifest = load_manifest()
+    else:
+        manifest = {"version": MANIFEST_VERSION, "files": {}}
+    if not manifest["files"]:
+        # No usable manifest: we can't know which vectors are ours, so rebuild.
+        index_exists = False
+    meta = vector_index.load_meta(DB_PATH) if index_exists else {"index_type": "flat", "params": {}}
+    # A rebuild starts flat but keeps the type of the index on disk, if any
+    index_type = index_type or vector_index.current_index_type(DB_PATH)
+
+    # 2. Diff every source file against the manifest (by whole-file hash first)
+    hashes = {path: file_sha256(path) for path in pdf_paths}
+    changed = [p for p in pdf_paths if manifest["files"].get(p, {}).get("sha256") != hashes[p]]
+    removed = removed_files(manifest["files"], pdf_paths)
+
+    # Tables go to their own Parquet index (unchanged PDFs are skipped by hash).
+    # The text index doesn't depend on it, so a failure here only warns.
+    try:
+        table_store.update_tables(pdf_paths, prune=False, hashes=hashes)
+        table_store.drop_tables(removed)
+    except Exception as e:
+        print(f"⚠️  Table extraction failed: {e}")
+
+    if index_exists and not changed and not removed and index_type == meta["index_type"]:
+        print("✅ Knowledge base is already up to date. Nothing to embed.")
+        return
 
     # 3. Create Embeddings & Store in Vector DB
     # We use 'nomic-embed-text' to turn text into numbers.
-    print("🧠 Creating Vector Embeddings (this may take a moment)...")
-    embeddings = OllamaEmbeddings(model="nomic-embed-text")
-    
-    # FAISS (Facebook AI Similarity Search) creates the efficient index
-    vector_db = FAISS.from_documents(documents=chunks, embedding=embeddings)
+    # The cache means re-ingesting the same text never hits Ollama twice;
+    # cache misses go out as adaptive, concurrent batches.
+    embeddings = make_embeddings()
+    vector_db = None
+    if index_exists:
+        vector_db = FAISS.load_local(DB_PATH, embeddings, allow_dangerous_deserialization=True)
+
+    # Unchanged files, plus files outside DATA_DIR this run wasn't given
+    new_files = {p: f for p, f in manifest["files"].items() if p not in changed and p not in removed}
+    to_delete = []
+    failed = {}
+    added = 0
+
+    for path in changed:
+        print(f"📄 Streaming {path}...")
+        previous = set(manifest["files"].get(path, {}).get("chunks", ()))
+        chunk_hashes = set()
+        new_ids = []
+        try:
+            for window in iter_chunk_windows(path, window_size):
+                docs, ids = [], []
+                for chunk in window:
+                    cid = chunk_id(chunk)
+                    if cid in chunk_hashes:
+                        continue  # Identical chunk twice on the same page; keep one vector
+                    chunk_hashes.add(cid)
+                    if cid not in previous:
+                        docs.append(chunk)
+                        ids.append(cid)
+                if not docs:
+                    continue
+                if vector_db is None:
+                    # FAISS (Facebook AI Similarity Search) creates the efficient index
+                    print("🧠 Creating Vector Embeddings (this may take a moment)...")
+                    vector_db = FAISS.from_documents(documents=docs, embedding=embeddings, ids=ids)
+                else:
+                    vector_db.add_documents(docs, ids=ids)
+                new_ids.extend(ids)
+                added += len(docs)
+        except Exception as e:
+            # Keep the file's previous version (if any) and index the rest
+            failed[path] = e
+            to_delete.extend(new_ids)
+            added -= len(new_ids)
+            if path in manifest["files"]:
+                new_files[path] = manifest["files"][path]
+            continue
+
+        to_delete.extend(cid for cid in previous if cid not in chunk_hashes)
+        new_files[path] = {"sha256": hashes[path], "chunks": sorted(chunk_hashes)}
+
+    # Files that disappeared from the corpus take their vectors with them
+    for path in removed:
+        print(f"🗑️  {path} was removed. Dropping its vectors.")
+        to_delete.extend(manifest["files"][path]["chunks"])
+
+    for path, error in failed.items():
+        print(f"❌ Could not read {path}: {error}")
+    if vector_db is None:
+        print("❌ Error: No text chunks to index.")
+        return
+    meta = vector_index.delete_ids(vector_db, to_delete, meta)
+    print(f"   - {added} new/changed chunks embedded, {len(to_delete)} stale chunks removed.")
+
+    # Fresh builds start as an exact flat index; train the requested type now
+    if index_type != meta["index_type"]:
+        meta = vector_index.build_index(vector_db, index_type)
 
     # 4. Save to Disk
     # We save this so we don't have to re-process the PDF every time.
     vector_db.save_local(DB_PATH)
+    mmap_store.export_store(vector_db, DB_PATH)
+    bm25_index.build_from_vector_db(vector_db, DB_PATH)
+    vector_index.save_meta(DB_PATH, meta)
+    manifest["files"] = new_files
+    save_manifest(manifest)
     print(f"✅ Success! Knowledge base saved to folder: '{DB_PATH}'")
+    if failed:
+        print(f"⚠️  {len(failed)} file(s) could not be read and kept their previous version: {', '.join(failed)}")
 
 if __name__ == "__main__":
-    ingest_documents()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build the FAISS knowledge base.")
+    parser.add_argument("pdfs", nargs="*", help=f"PDF files to index besides those under {DATA_DIR}/ (default: {PDF_PATH})")
+    parser.add_argument("--full", action="store_true", help="Ignore the manifest and rebuild everything.")
+    parser.add_argument("--window", type=int, default=WINDOW_SIZE, help="Chunks per streaming window.")
+    parser.add_argument("--index-type", choices=vector_index.INDEX_TYPES, default=None,
+                        help="FAISS index type (default: keep the current one, 'flat' for new indexes).")
+    args = parser.parse_args()
+    ingest_documents(args.pdfs or None, incremental=not args.full, window_size=args.window,
+                     index_type=args.index_type)
@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import argparse
+import threading
+import subprocess
+import tracing
+
+# --- Persistent Code-Interpreter Pool ---
+# The analyst's Python snippets run in a few long-lived worker processes
+# that imported pandas/numpy once at start-up, instead of a fresh REPL per
+# call. Each session (one crew run) is pinned to a worker and keeps its own
+# namespace, so a DataFrame loaded in step 1 is still there in step 3.
+# Every call runs under a CPU-time limit (SIGXCPU), every worker under an
+# address-space limit, and a worker that hangs or dies is killed and
+# replaced. This isolates resource use; it is not a security sandbox.
+# The worker side lives in interpreter_worker.py (JSON lines over stdin/stdout).
+
+INTERPRETER_WORKERS = int(os.getenv("INTERPRETER_WORKERS", "2"))
+INTERPRETER_CPU_SECONDS = int(os.getenv("INTERPRETER_CPU_SECONDS", "10"))
+INTERPRETER_MEMORY_MB = int(os.getenv("INTERPRETER_MEMORY_MB", "1024"))  # on top of the warm baseline
+WARM_IMPORTS = ("numpy", "pandas")
+START_TIMEOUT = 60.0   # seconds for a worker to import WARM_IMPORTS
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "interpreter_worker.py")
+DEFAULT_SESSION = "default"
+
+
+class _Worker:
+    def __init__(self, imports, memory_mb):
+        env = dict(os.environ)
+        # One BLAS/OpenMP thread per worker, so the CPU limit means one core
+        for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+            env.setdefault(var, "1")
+        self.proc = subprocess.Popen(
+            [sys.executable, WORKER_SCRIPT, "--memory-mb", str(memory_mb), *imports],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env, text=True, encoding="utf-8", bufsize=1,
+        )
+        self.lock = threading.Lock()
+        self.sessions = set()
+        self.ready = False
+        self._replies = queue.Queue()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        for line in self.proc.stdout:
+            self._replies.put(line)
+        self._replies.put(None)  # EOF: the worker died
+
+    def call(self, request, timeout):
+        """Sends one request and waits for its reply. Raises TimeoutError / EOFError."""
+        if not self.ready:
+            self._receive(START_TIMEOUT)
+            self.ready = True
+        self.proc.stdin.write(json.dumps(request) + "\n")
+        self.proc.stdin.flush()
+        return self._receive(timeout)
+
+    def _receive(self, timeout):
+        try:
+            line = self._replies.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"no reply within {timeout:.0f}s")
+        if line is None:
+            raise EOFError(f"worker exited with code {self.proc.wait()}")
+        return json.loads(line)
+
+    def kill(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+
+
+class InterpreterPool:
+    def __init__(self, size=INTERPRETER_WORKERS, imports=WARM_IMPORTS,
+                 cpu_seconds=INTERPRETER_CPU_SECONDS, memory_mb=INTERPRETER_MEMORY_MB):
+        self.imports = list(imports)
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self._lock = threading.Lock()
+        self._sessions = {}  # session id -> worker
+        # Started right away: the imports happen in the background while the
+        # crew is still researching.
+        self._workers = [_Worker(self.imports, memory_mb) for _ in range(max(size, 1))]
+        self.calls = 0
+        self.restarts = 0
+
+    def _worker_for(self, session):
+        with self._lock:
+            worker = self._sessions.get(session)
+            if worker is None:
+                worker = min(self._workers, key=lambda w: len(w.sessions))
+                worker.sessions.add(session)
+                self._sessions[session] = worker
+            return worker
+
+    def _replace(self, worker):
+        worker.kill()
+        with self._lock:
+            if worker not in self._workers:
+                return  # Another caller already replaced it
+            for session in worker.sessions:
+                self._sessions.pop(session, None)
+            self._workers[self._workers.index(worker)] = _Worker(self.imports, self.memory_mb)
+            self.restarts += 1
+
+    def run(self, code, session=DEFAULT_SESSION, cpu_seconds=None):
+        """{"stdout", "result" (repr or None), "error" (traceback or None), "seconds"} for one snippet."""
+        cpu_seconds = cpu_seconds or self.cpu_seconds
+        worker = self._worker_for(session)
+        with tracing.span("interpreter.run") as s:
+            with worker.lock:
+                try:
+                    # Wall-clock backstop for code that blocks without using CPU
+                    reply = worker.call({"op": "exec", "session": session, "code": code,
+                                         "cpu_seconds": cpu_seconds}, timeout=cpu_seconds * 3 + 5)
+                except (TimeoutError, EOFError, OSError) as e:
+                    self._replace(worker)
+                    s.add(interpreter_restarts=1)
+                    return {"stdout": "", "result": None, "seconds": None,
+                            "error": f"Interpreter worker was restarted ({e}); session state was lost."}
+            self.calls += 1
+            s.add(interpreter_calls=1)
+            s.set(exec_ms=reply["seconds"] * 1000, error=bool(reply["error"]))
+            return reply
+
+    def end_session(self, session):
+        """Frees a session's namespace (the next run() under that id starts fresh)."""
+        with self._lock:
+            worker = self._sessions.pop(session, None)
+            if worker is not None:
+                worker.sessions.discard(session)
+        if worker is not None:
+            with worker.lock:
+                try:
+                    worker.call({"op": "drop", "session": session}, timeout=5)
+                except (TimeoutError, EOFError, OSError):
+                    pass
+
+    def warm_up(self):
+        """Blocks until every worker has finished its imports."""
+        for worker in list(self._workers):
+            with worker.lock:
+                worker.call({"op": "ping"}, timeout=START_TIMEOUT)
+
+    def close(self):
+        for worker in self._workers:
+            worker.kill()
+
+    def stats(self):
+        return {"workers": len(self._workers), "sessions": len(self._sessions),
+                "calls": self.calls, "restarts": self.restarts}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_interpreter_pool():
+    """The process-wide interpreter pool (workers start on first use)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = InterpreterPool()
+                atexit.register(_pool.close)
+    return _pool
+
+
+def format_reply(reply):
+    """Tool output for an agent: stdout, then the result repr or the error, then the time."""
+    parts = [reply["stdout"].rstrip()] if reply["stdout"].strip() else []
+    if reply["error"]:
+        parts.append(f"Error: {reply['error']}")
+    elif reply["result"] is not None:
+        parts.append(f"Out: {reply['result']}")
+    if not parts:
+        parts.append("(no output)")
+    if reply["seconds"] is not None:
+        parts.append(f"[{reply['seconds'] * 1000:.1f} ms]")
+    return "\n".join(parts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare a fresh interpreter with the warm worker pool.")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    setup = "df = pd.DataFrame({'q': [1, 2, 3, 4], 'rev': [10.0, 12.5, 11.0, 14.2]})"
+    expr = "df['rev'].pct_change().mean()"
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, "-c", f"import pandas as pd\n{setup}\nprint({expr})"], check=True, capture_output=True)
+    cold = time.perf_counter() - t0
+
+    pool = get_interpreter_pool()
+    t0 = time.perf_counter()
+    pool.warm_up()
+    print(f"🔥 {pool.stats()['workers']} worker(s) warm in {time.perf_counter() - t0:.2f}s")
+    pool.run(setup, session="demo")
+    latencies = []
+    for _ in range(args.runs):
+        t0 = time.perf_counter()
+        reply = pool.run(expr, session="demo")  # 'df' is still there from the first call
+        latencies.append(time.perf_counter() - t0)
+    print(format_reply(reply))
+    print(f"🐢 Fresh interpreter: {cold * 1000:.0f} ms")
+    print(f"⚡ Warm pool: p50 {sorted(latencies)[len(latencies) // 2] * 1000:.1f} ms")
+    print(f"📊 {pool.stats()}")
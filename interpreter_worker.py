@@ -0,0 +1,139 @@
+import os
+import io
+import sys
+import ast
+import json
+import time
+import signal
+import argparse
+import traceback
+from contextlib import redirect_stdout, redirect_stderr
+
+try:
+    import resource  # POSIX only; limits are skipped elsewhere
+except ImportError:
+    resource = None
+
+# --- Code-Interpreter Worker Process ---
+# Started by interpreter_pool.InterpreterPool; not meant to be run by hand.
+# Imports the warm modules once, then serves JSON-line requests on stdin:
+#   {"op": "exec", "session": id, "code": str, "cpu_seconds": n}
+#   {"op": "drop", "session": id}
+#   {"op": "ping"}
+# Deliberately imports nothing from the project, so start-up stays cheap.
+
+MAX_OUTPUT = 10000  # characters of stdout / repr handed back
+ALIASES = {"numpy": "np", "pandas": "pd"}
+
+
+class CPUTimeExceeded(BaseException):
+    """BaseException, so a bare 'except Exception' in user code can't swallow it."""
+
+
+def _on_sigxcpu(signum, frame):
+    raise CPUTimeExceeded("CPU time limit exceeded")
+
+
+def _cpu_used():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def set_cpu_limit(seconds):
+    """Soft RLIMIT_CPU 'seconds' from now (None: unlimited). The hard limit is left alone so it can be raised again."""
+    if resource is None:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = resource.RLIM_INFINITY if seconds is None else int(_cpu_used() + seconds) + 1
+    if hard != resource.RLIM_INFINITY:
+        soft = hard if soft == resource.RLIM_INFINITY else min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def limit_memory(extra_mb):
+    """Caps the address space at the current (warm) size plus 'extra_mb'."""
+    if resource is None or not os.path.exists("/proc/self/statm"):
+        return
+    with open("/proc/self/statm") as f:
+        baseline = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    limit = baseline + extra_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _truncate(text):
+    return text if len(text) <= MAX_OUTPUT else text[:MAX_OUTPUT] + f"\n... [{len(text) - MAX_OUTPUT} more characters]"
+
+
+def execute(code, namespace, cpu_seconds=None):
+    """Runs 'code' in 'namespace' like a notebook cell: the value of a trailing expression is the result."""
+    out = io.StringIO()
+    result = error = None
+    t0 = time.perf_counter()
+    try:
+        tree = ast.parse(code, mode="exec")
+        last = tree.body.pop() if tree.body and isinstance(tree.body[-1], ast.Expr) else None
+        set_cpu_limit(cpu_seconds)
+        with redirect_stdout(out), redirect_stderr(out):
+            exec(compile(tree, "<cell>", "exec"), namespace)
+            if last is not None:
+                value = eval(compile(ast.Expression(last.value), "<cell>", "eval"), namespace)
+                if value is not None:
+                    result = _truncate(repr(value))
+    except BaseException as e:  # SystemExit / KeyboardInterrupt from user code must not kill the worker
+        frames = [f for f in traceback.extract_tb(e.__traceback__) if f.filename != __file__]  # Only user frames
+        error = ("Traceback (most recent call last):\n" + "".join(traceback.format_list(frames))
+                 + "".join(traceback.format_exception_only(type(e), e))).strip()
+    finally:
+        set_cpu_limit(None)
+    return {"stdout": _truncate(out.getvalue()), "result": result, "error": error,
+            "seconds": time.perf_counter() - t0}
+
+
+def serve(imports, memory_mb):
+    # Keep the protocol pipes private: user code (and C extensions) printing
+    # to fd 1 or reading fd 0 must not corrupt them.
+    requests_in = os.fdopen(os.dup(0), "r", encoding="utf-8")
+    replies_out = os.fdopen(os.dup(1), "w", encoding="utf-8", buffering=1)
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(2, 1)
+    sys.stdin = io.StringIO()
+
+    t0 = time.perf_counter()
+    modules = {}
+    for name in imports:
+        try:
+            modules[ALIASES.get(name, name)] = __import__(name)
+        except ImportError:
+            pass
+    if resource is not None:
+        signal.signal(signal.SIGXCPU, _on_sigxcpu)
+        try:
+            limit_memory(memory_mb)
+        except (ValueError, OSError):
+            pass
+    replies_out.write(json.dumps({"ready": True, "import_seconds": time.perf_counter() - t0}) + "\n")
+
+    sessions = {}
+    for line in requests_in:
+        request = json.loads(line)
+        op = request.get("op")
+        if op == "exec":
+            namespace = sessions.get(request["session"])
+            if namespace is None:
+                namespace = sessions[request["session"]] = {"__name__": "__main__", **modules}
+            reply = execute(request["code"], namespace, request.get("cpu_seconds"))
+        elif op == "drop":
+            sessions.pop(request["session"], None)
+            reply = {"ok": True}
+        else:
+            reply = {"ok": True, "sessions": len(sessions)}
+        replies_out.write(json.dumps(reply) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Code-interpreter worker (started by interpreter_pool).")
+    parser.add_argument("--memory-mb", type=int, required=True)
+    parser.add_argument("imports", nargs="*")
+    args = parser.parse_args()
+    serve(args.imports, args.memory_mb)
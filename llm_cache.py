@@ -0,0 +1,248 @@
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+import threading
+from typing import Any, Optional
+
+from langchain_core.caches import BaseCache
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatResult
+import tracing
+
+# --- Deterministic LLM Response Cache ---
+# The validator, rewriter and generator all run phi3 at temperature 0, so the
+# same prompt always produces the same answer. Chat models built through
+# make_chat_model() get a shared SQLite cache keyed by sha256(model + params +
+# prompt); LangChain consults it inside invoke()/batch()/chains, so callers
+# don't change. The least recently used answers are evicted once the stored
+# responses exceed 'max_bytes'; their total size is kept in a one-row table
+# (updated in the same transaction as every write) so no write has to scan
+# the responses. Streaming calls (astream) bypass the cache.
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite")
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "256"))
+# "ollama": real models; "fake": offline, deterministic stand-in (tests, benchmarks)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "ollama")
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0.05"))
+
+
+class LLMResponseCache(BaseCache):
+    def __init__(self, path=LLM_CACHE_PATH, max_bytes=int(LLM_CACHE_MAX_MB * 1024 * 1024)):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                latency REAL NOT NULL,
+                used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL)")
+        # One full scan, only for a cache file written before the totals table existed
+        self._conn.execute("INSERT OR IGNORE INTO totals (id, size) SELECT 0, COALESCE(SUM(size), 0) FROM responses")
+        self._conn.commit()
+        self._misses_at = {}  # key -> perf_counter() of the miss, to time the real call
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.seconds_saved = 0.0
+
+    @staticmethod
+    def _key(prompt, llm_string):
+        return hashlib.sha256(f"{llm_string}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt, llm_string):
+        key = self._key(prompt, llm_string)
+        with self._lock:
+            row = self._conn.execute("SELECT value, latency FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                self._misses_at[key] = time.perf_counter()
+                tracing.add(llm_cache_misses=1)
+                return None
+            self._conn.execute("UPDATE responses SET used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            self.seconds_saved += row[1]
+        tracing.add(llm_cache_hits=1)
+        return [ChatGeneration(message=m) for m in messages_from_dict(json.loads(row[0]))]
+
+    def update(self, prompt, llm_string, return_val):
+        key = self._key(prompt, llm_string)
+        value = json.dumps([message_to_dict(g.message) for g in return_val])
+        with self._lock:
+            started = self._misses_at.pop(key, None)
+            latency = time.perf_counter() - started if started is not None else 0.0
+            # IMMEDIATE: the size read below and the writes are one unit, even
+            # with other processes writing to the same file
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, size, latency, used) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value), latency, time.time()),
+                )
+                self._add_size(len(value) - (old[0] if old else 0))
+                self._evict()
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+    def _add_size(self, delta):
+        self._conn.execute("UPDATE totals SET size = size + ? WHERE id = 0", (delta,))
+
+    def _evict(self):
+        total = self._conn.execute("SELECT size FROM totals WHERE id = 0").fetchone()[0]
+        while total > self.max_bytes:
+            # Oldest first, straight off the 'used' index, a few rows at a time
+            rows = self._conn.execute("SELECT key, size FROM responses ORDER BY used LIMIT 32").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._add_size(-size)
+                self.evictions += 1
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def clear(self, **kwargs):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.execute("UPDATE totals SET size = 0 WHERE id = 0")
+            self._conn.commit()
+            self._misses_at.clear()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            size = self._conn.execute("SELECT size FROM totals WHERE id = 0").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "seconds_saved": round(self.seconds_saved, 3),
+            "entries": entries,
+            "bytes": size,
+            "evictions": self.evictions,
+        }
+
+
+class ScopedResponseCache(BaseCache):
+    """
+    View of the shared cache for one model configuration. ChatOllama's own
+    llm_string leaves out the model name and options, so they're added here.
+    """
+    def __init__(self, cache, scope):
+        self.cache = cache
+        self.scope = scope
+
+    def lookup(self, prompt, llm_string):
+        return self.cache.lookup(prompt, f"{self.scope}|{llm_string}")
+
+    def update(self, prompt, llm_string, return_val):
+        self.cache.update(prompt, f"{self.scope}|{llm_string}", return_val)
+
+    def clear(self, **kwargs):
+        self.cache.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """The process-wide response cache (opened on first use)."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LLMResponseCache()
+    return _cache
+
+
+# --- Offline backend ---
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for ChatOllama: answers depend only on the prompt,
+    after sleeping 'latency' seconds. With format="json" it speaks the
+    validator's formats (single verdict, or one verdict per "[n]" snippet).
+    """
+    model: str = "fake"
+    temperature: float = 0.0
+    format: Optional[str] = None
+    num_predict: Optional[int] = None
+    latency: float = 0.05
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    @property
+    def _identifying_params(self):
+        return {"model": self.model, "temperature": self.temperature, "format": self.format}
+
+    def _reply(self, prompt):
+        digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+        if self.format != "json":
+            return f"Fake answer {digest.hex()[:12]}."
+        verdict = lambda i: "no" if digest[i % len(digest)] % 4 == 0 else "yes"
+        snippets = re.findall(r"^\s*\[(\d+)\]", prompt, re.MULTILINE)
+        if snippets:
+            return json.dumps({"results": [{"id": int(n), "relevance": verdict(int(n)), "reason": "fake"}
+                                           for n in snippets]})
+        return json.dumps({"relevance": verdict(0), "reason": "fake"})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        time.sleep(self.latency)
+        prompt = "\n".join(str(m.content) for m in messages)
+        reply = self._reply(prompt)
+        usage = {"input_tokens": len(prompt.split()), "output_tokens": len(reply.split())}
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        message = AIMessage(content=reply, usage_metadata=usage)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def make_chat_model(model, backend=None, **params):
+    """
+    Builds a chat model on LLM_BACKEND. Deterministic (temperature 0) models
+    share the response cache; anything sampled is left uncached.
+    """
+    backend = backend or LLM_BACKEND
+    if params.get("temperature") == 0:
+        # Model parameters only: callbacks/caches have per-process reprs and would
+        # make the scope (and so the persistent cache) differ on every run
+        scoped = {k: v for k, v in params.items() if k not in ("callbacks", "cache")}
+        scope = json.dumps({"backend": backend, "model": model, **scoped}, sort_keys=True, default=str)
+        params["cache"] = ScopedResponseCache(get_response_cache(), scope)
+    params.setdefault("callbacks", [tracing.llm_trace_handler])
+    if backend == "fake":
+        return FakeChatModel(model=model, latency=FAKE_LLM_LATENCY, **params)
+    from langchain_ollama import ChatOllama
+    return ChatOllama(model=model, **params)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or clear the LLM response cache.")
+    parser.add_argument("--clear", action="store_true", help="Drop every cached response.")
+    args = parser.parse_args()
+
+    cache = get_response_cache()
+    if args.clear:
+        cache.clear()
+        print(f"🧹 Cleared {cache.path}")
+    print(f"📦 LLM response cache: {cache.stats()}")
@@ -0,0 +1,151 @@
+import os
+import json
+import mmap
+import numpy as np
+import faiss
+from collections.abc import Mapping
+from langchain_core.documents import Document
+from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.base import Docstore
+import vector_index
+
+# --- Memory-Mapped, Read-Only Vector Store ---
+# FAISS.load_local() unpickles the whole docstore and copies every vector
+# into each process. Here the faiss index is opened with mmap flags and the
+# chunk texts/metadata live in one flat file that is also memory-mapped, so
+# any number of Streamlit workers share the same OS page cache and startup
+# only costs a few file opens.
+#
+# Layout (written next to index.faiss by export_store):
+#   chunks.bin   - row i = UTF-8 text bytes followed by JSON metadata bytes
+#   chunks.npy   - int64 array (N, 3): offset, text_len, meta_len for row i
+#   chunk_ids.npy / chunk_rows.npy - chunk ids sorted, plus their rows
+#                  (binary-searched to fetch a document by its chunk id)
+# Row i matches faiss position i, so no id mapping has to be loaded.
+
+CHUNKS_FILE = "chunks.bin"
+OFFSETS_FILE = "chunks.npy"
+IDS_FILE = "chunk_ids.npy"
+ROWS_FILE = "chunk_rows.npy"
+# IVF inverted lists are mapped with IO_FLAG_MMAP; flat/HNSW vector storage
+# needs IO_FLAG_MMAP_IFC (faiss >= 1.10). The two can't be combined.
+IVF_MMAP_FLAGS = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+FLAT_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def _save_array(path, array):
+    """np.save to a temp file, then os.replace: readers that mapped the old file keep a valid copy."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def export_store(vector_db, db_path):
+    """Writes the flat chunk file for 'vector_db' (call right after save_local)."""
+    n = vector_db.index.ntotal
+    offsets = np.zeros((n, 3), dtype=np.int64)
+    ids = []
+    tmp_chunks = os.path.join(db_path, CHUNKS_FILE + ".tmp")
+
+    with open(tmp_chunks, "wb") as f:
+        pos = 0
+        for i in range(n):
+            doc_id = vector_db.index_to_docstore_id[i]
+            ids.append(str(doc_id).encode("utf-8"))
+            doc = vector_db.docstore.search(doc_id)
+            text = doc.page_content.encode("utf-8")
+            meta = json.dumps({"id": doc_id, "metadata": doc.metadata}, default=str).encode("utf-8")
+            f.write(text)
+            f.write(meta)
+            offsets[i] = (pos, len(text), len(meta))
+            pos += len(text) + len(meta)
+
+    ids = np.array(ids, dtype=f"S{max((len(i) for i in ids), default=1)}")
+    order = np.argsort(ids, kind="stable")
+    _save_array(os.path.join(db_path, IDS_FILE), ids[order])
+    _save_array(os.path.join(db_path, ROWS_FILE), order.astype(np.int64))
+    os.replace(tmp_chunks, os.path.join(db_path, CHUNKS_FILE))
+    _save_array(os.path.join(db_path, OFFSETS_FILE), offsets)  # Last: has_store() keys off it
+
+
+def has_store(db_path):
+    return all(os.path.exists(os.path.join(db_path, f)) for f in ("index.faiss", CHUNKS_FILE, OFFSETS_FILE, IDS_FILE, ROWS_FILE))
+
+
+class MmapDocstore(Docstore):
+    """
+    Read-only docstore where the document id is the faiss row number.
+    A chunk id string is also accepted (e.g. from vector_db.get_by_ids()).
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        # All tables are opened up front, so a later re-export can't pair
+        # this store's rows with another export's id table
+        self.offsets = np.load(os.path.join(db_path, OFFSETS_FILE), mmap_mode="r")
+        self._ids = np.load(os.path.join(db_path, IDS_FILE), mmap_mode="r")
+        self._rows = np.load(os.path.join(db_path, ROWS_FILE), mmap_mode="r")
+        self._file = open(os.path.join(db_path, CHUNKS_FILE), "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _row_for_id(self, chunk_id):
+        key = chunk_id.encode("utf-8")
+        pos = int(np.searchsorted(self._ids, key))
+        if pos < len(self._ids) and self._ids[pos] == key:
+            return int(self._rows[pos])
+        return -1
+
+    def search(self, row):
+        if isinstance(row, str):
+            row = self._row_for_id(row)
+        if not 0 <= row < len(self.offsets):
+            return f"ID {row} not found."
+        start, text_len, meta_len = (int(x) for x in self.offsets[row])
+        text = self._data[start:start + text_len].decode("utf-8")
+        meta = json.loads(self._data[start + text_len:start + text_len + meta_len])
+        return Document(id=meta["id"], page_content=text, metadata=meta["metadata"])
+
+    def delete(self, ids):
+        raise NotImplementedError("The memory-mapped store is read-only. Re-run ingest.py instead.")
+
+
+class _RowIds(Mapping):
+    """index_to_docstore_id without building a dict: faiss row i -> docstore row i."""
+
+    def __init__(self, n):
+        self.n = n
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.n:
+            raise KeyError(i)
+        return int(i)
+
+    def __iter__(self):
+        return iter(range(self.n))
+
+    def __len__(self):
+        return self.n
+
+
+def load_store(db_path, embeddings):
+    """
+    Opens the index read-only with memory-mapped vectors and chunks.
+    Returns a LangChain FAISS object, or None if the flat files are missing
+    or don't match the index (e.g. written by an older ingest).
+    """
+    if not has_store(db_path):
+        return None
+    is_ivf = vector_index.load_meta(db_path)["index_type"].startswith("ivf")
+    flags = IVF_MMAP_FLAGS if is_ivf else FLAT_MMAP_FLAGS
+    index = faiss.read_index(os.path.join(db_path, "index.faiss"), flags)
+    docstore = MmapDocstore(db_path)
+    if len(docstore) != index.ntotal:
+        print("⚠️  Flat chunk store is out of sync with the index. Ignoring it.")
+        return None
+    return FAISS(embedding_function=embeddings, index=index, docstore=docstore,
+                 index_to_docstore_id=_RowIds(index.ntotal))
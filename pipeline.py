@@ -0,0 +1,331 @@
+import os
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from langchain_core.documents import Document
+from langchain_community.vectorstores import FAISS
+from batch_embedder import make_embeddings
+import ingest
+import vector_index
+import mmap_store
+import bm25_index
+import table_store
+from ingest import DATA_DIR, find_pdfs  # One corpus definition for both entry points
+
+# --- Parallel Ingestion Pipeline over data/ ---
+# Three stages connected by bounded queues:
+#   1. Parse  - page ranges of every PDF are read in a process pool (CPU bound)
+#   2. Split  - pages are chunked and diffed against the manifest
+#   3. Embed  - new chunks are embedded in batches and appended to FAISS (I/O bound)
+# Big files are cut into page ranges, so one slow 500-page scan is spread
+# over all workers instead of holding up the small files behind it.
+# Tables are extracted to their own Parquet index alongside (see table_store.py).
+
+PAGES_PER_TASK = 16
+EMBED_BATCH_SIZE = 256  # BatchingEmbeddings re-splits this into concurrent requests
+QUEUE_SIZE = 8
+_DONE = object()
+
+
+def parse_page_range(path, start, end):
+    """Runs in a worker process. Returns the (page_number, label, text) tuples for one page range."""
+    import pypdf
+    t0 = time.perf_counter()
+    reader = pypdf.PdfReader(path)
+    labels = reader.page_labels
+    pages = []
+    for page_number in range(start, min(end, len(reader.pages))):
+        text = reader.pages[page_number].extract_text() or ""
+        pages.append((page_number, labels[page_number], text.strip()))
+    return path, len(reader.pages), pages, time.perf_counter() - t0
+
+
+def count_pages(path):
+    import pypdf
+    return len(pypdf.PdfReader(path).pages)
+
+
+class StageStats:
+    """Counts items and busy time for one pipeline stage."""
+
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.busy = 0.0
+        self.started = None
+        self.finished = None
+
+    def start(self):
+        self.started = time.perf_counter()
+
+    def record(self, items, seconds):
+        self.items += items
+        self.busy += seconds
+        self.finished = time.perf_counter()
+
+    def rate(self):
+        if self.started is None or self.finished is None:
+            return 0.0  # Nothing recorded (e.g. only removals this run)
+        wall = self.finished - self.started
+        return self.items / wall if wall > 0 else 0.0
+
+    def report(self):
+        return f"   - {self.name:<6} {self.items:>8} {self.unit:<10} {self.rate():>10.1f} {self.unit}/s  (busy {self.busy:.2f}s)"
+
+
+class IngestionPipeline:
+    def __init__(self, data_dir=DATA_DIR, workers=None, embeddings=None,
+                 pages_per_task=PAGES_PER_TASK, embed_batch_size=EMBED_BATCH_SIZE,
+                 queue_size=QUEUE_SIZE, incremental=True, index_type=None):
+        self.data_dir = data_dir
+        self.index_type = index_type
+        self.workers = workers or os.cpu_count() or 2
+        self.embeddings = embeddings or make_embeddings()
+        self.pages_per_task = pages_per_task
+        self.embed_batch_size = embed_batch_size
+        self.incremental = incremental
+
+        self.pages_q = queue.Queue(maxsize=queue_size)
+        self.chunks_q = queue.Queue(maxsize=queue_size)
+        self.stats = {
+            "parse": StageStats("parse", "pages"),
+            "split": StageStats("split", "chunks"),
+            "embed": StageStats("embed", "embeddings"),
+        }
+        self.errors = []   # Run-level failures: nothing is saved
+        self.failed = {}   # path -> error for files that couldn't be read (the rest is indexed)
+        self.chunk_ids = {}  # path -> every chunk id seen this run
+        self.vector_db = None
+
+    # --- Stage 1: Parse (process pool) ---
+
+    def _parse_stage(self, paths):
+        self.stats["parse"].start()
+        try:
+            tasks = []
+            for path in paths:
+                try:
+                    total = count_pages(path)
+                except Exception as e:
+                    self.failed[path] = e
+                    continue
+                for start in range(0, max(total, 1), self.pages_per_task):
+                    tasks.append((path, start, start + self.pages_per_task))
+
+            # Keep only a bounded number of ranges in flight; the queue put()
+            # blocks when the splitter falls behind (back-pressure).
+            max_in_flight = self.workers * 2
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                pending = {}  # future -> path
+                task_iter = iter(tasks)
+                while True:
+                    while len(pending) < max_in_flight:
+                        task = next(task_iter, None)
+                        if task is None:
+                            break
+                        pending[pool.submit(parse_page_range, *task)] = task[0]
+                    if not pending:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        task_path = pending.pop(future)
+                        try:
+                            path, total, pages, seconds = future.result()
+                        except Exception as e:
+                            # run() keeps this file's previous version and drops what was added
+                            self.failed.setdefault(task_path, e)
+                            continue
+                        self.stats["parse"].record(len(pages), seconds)
+                        self.pages_q.put((path, total, pages))
+        except Exception as e:
+            self.errors.append(f"parse: {e}")  # Never let the thread die silently
+        finally:
+            self.pages_q.put(_DONE)
+
+    # --- Stage 2: Split + diff against the manifest ---
+
+    def _split_stage(self, previous_files):
+        self.stats["split"].start()
+        splitter = ingest.make_splitter()
+        known_ids = {p: set(f["chunks"]) for p, f in previous_files.items()}
+        batch = []
+        try:
+            while True:
+                item = self.pages_q.get()
+                if item is _DONE:
+                    break
+                t0 = time.perf_counter()
+                path, total, pages = item
+                docs = [
+                    Document(page_content=text, metadata={
+                        "source": path, "total_pages": total,
+                        "page": page_number, "page_label": label,
+                    })
+                    for page_number, label, text in pages
+                ]
+                chunks = splitter.split_documents(docs)
+                seen = self.chunk_ids.setdefault(path, set())
+                known = known_ids.get(path, ())
+                for chunk in chunks:
+                    cid = ingest.chunk_id(chunk)
+                    if cid in seen:
+                        continue
+                    seen.add(cid)
+                    if cid not in known:
+                        batch.append((cid, chunk))
+                    if len(batch) >= self.embed_batch_size:
+                        self.chunks_q.put(batch)
+                        batch = []
+                self.stats["split"].record(len(chunks), time.perf_counter() - t0)
+            if batch:
+                self.chunks_q.put(batch)
+        finally:
+            self.chunks_q.put(_DONE)
+
+    # --- Stage 3: Embed + add to FAISS ---
+
+    def _embed_stage(self):
+        self.stats["embed"].start()
+        while True:
+            batch = self.chunks_q.get()
+            if batch is _DONE:
+                break
+            t0 = time.perf_counter()
+            try:
+                ids = [cid for cid, _ in batch]
+                texts = [chunk.page_content for _, chunk in batch]
+                metadatas = [chunk.metadata for _, chunk in batch]
+                vectors = self.embeddings.embed_documents(texts)
+                pairs = list(zip(texts, vectors))
+                if self.vector_db is None:
+                    self.vector_db = FAISS.from_embeddings(pairs, self.embeddings, metadatas=metadatas, ids=ids)
+                else:
+                    self.vector_db.add_embeddings(pairs, metadatas=metadatas, ids=ids)
+            except Exception as e:
+                # Keep draining so the upstream stages never block forever
+                self.errors.append(f"embed: {e}")
+                continue
+            self.stats["embed"].record(len(batch), time.perf_counter() - t0)
+
+    # --- Side stage: tables to Parquet ---
+
+    def _table_stage(self, paths, hashes, removed):
+        try:
+            table_store.update_tables(paths, self.workers, prune=False, hashes=hashes)
+            table_store.drop_tables(removed)
+        except Exception as e:
+            # The text index doesn't depend on it; report and carry on
+            print(f"⚠️  Table extraction failed: {e}")
+
+    # --- Orchestration ---
+
+    def run(self):
+        start = time.perf_counter()
+        paths = find_pdfs(self.data_dir)
+
+        index_exists = os.path.exists(os.path.join(ingest.DB_PATH, "index.faiss"))
+        manifest = ingest.load_manifest() if (self.incremental and index_exists) else None
+        if not manifest or not manifest["files"]:
+            manifest = {"version": ingest.MANIFEST_VERSION, "files": {}}
+            index_exists = False
+        meta = vector_index.load_meta(ingest.DB_PATH) if index_exists else {"index_type": "flat", "params": {}}
+        # A rebuild (--full) starts flat but keeps the type of the index on disk, if any
+        index_type = self.index_type or vector_index.current_index_type(ingest.DB_PATH)
+
+        # Unchanged files (same sha256) never reach the process pool
+        hashes = {p: ingest.file_sha256(p) for p in paths}
+        changed = [p for p in paths if manifest["files"].get(p, {}).get("sha256") != hashes[p]]
+        removed = ingest.removed_files(manifest["files"], paths, self.data_dir)
+
+        # Tables go to their own Parquet index (unchanged PDFs are skipped by
+        # hash), extracted alongside the text stages
+        tables = threading.Thread(target=self._table_stage, args=(paths, hashes, removed), daemon=True)
+        tables.start()
+
+        if index_exists and not changed and not removed and index_type == meta["index_type"]:
+            tables.join()
+            print("✅ Knowledge base is already up to date. Nothing to embed.")
+            return self.stats
+
+        print(f"🚚 Ingesting {len(changed)} changed PDF(s) from '{self.data_dir}' with {self.workers} workers...")
+        if index_exists:
+            self.vector_db = FAISS.load_local(ingest.DB_PATH, self.embeddings, allow_dangerous_deserialization=True)
+
+        stages = [
+            threading.Thread(target=self._parse_stage, args=(changed,), daemon=True),
+            threading.Thread(target=self._split_stage, args=(manifest["files"],), daemon=True),
+            threading.Thread(target=self._embed_stage, daemon=True),
+        ]
+        for t in stages:
+            t.start()
+        for t in stages:
+            t.join()
+        tables.join()
+
+        if self.errors:
+            # Don't write a manifest that claims chunks we never stored
+            for err in self.errors:
+                print(f"❌ {err}")
+            print("❌ Ingestion failed. The existing index was left untouched.")
+            return self.stats
+
+        # Drop vectors for chunks that no longer exist. A file that failed to
+        # parse keeps its previous chunks; whatever it added this run goes.
+        to_delete = []
+        for path in changed:
+            previous = manifest["files"].get(path, {}).get("chunks", ())
+            seen = self.chunk_ids.get(path, set())
+            if path in self.failed:
+                to_delete.extend(c for c in seen if c not in set(previous))
+            else:
+                to_delete.extend(c for c in previous if c not in seen)
+        for path in removed:
+            print(f"🗑️  {path} was removed. Dropping its vectors.")
+            to_delete.extend(manifest["files"][path]["chunks"])
+        if self.vector_db is not None:
+            meta = vector_index.delete_ids(self.vector_db, to_delete, meta)
+            if index_type != meta["index_type"]:
+                meta = vector_index.build_index(self.vector_db, index_type)
+
+        # Unchanged or failed files keep their entry, and so do files outside
+        # data_dir that another run (ingest.py with explicit paths) indexed
+        new_files = {p: f for p, f in manifest["files"].items() if p not in removed}
+        for path in changed:
+            if path not in self.failed:
+                new_files[path] = {"sha256": hashes[path], "chunks": sorted(self.chunk_ids.get(path, ()))}
+
+        if self.vector_db is None:
+            print("❌ Error: No text chunks to index.")
+            return self.stats
+        self.vector_db.save_local(ingest.DB_PATH)
+        mmap_store.export_store(self.vector_db, ingest.DB_PATH)
+        bm25_index.build_from_vector_db(self.vector_db, ingest.DB_PATH)
+        vector_index.save_meta(ingest.DB_PATH, meta)
+        manifest["files"] = new_files
+        ingest.save_manifest(manifest)
+
+        print(f"✅ Success! Knowledge base saved to folder: '{ingest.DB_PATH}' ({time.perf_counter() - start:.2f}s)")
+        print("📊 Stage throughput:")
+        for stage in self.stats.values():
+            print(stage.report())
+        for path, error in self.failed.items():
+            print(f"⚠️  Could not read {path} (previous version kept, if any): {error}")
+        return self.stats
+
+
+def run_pipeline(data_dir=DATA_DIR, workers=None, incremental=True, index_type=None):
+    return IngestionPipeline(data_dir=data_dir, workers=workers, incremental=incremental,
+                             index_type=index_type).run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index every PDF under data/ in parallel.")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--full", action="store_true", help="Ignore the manifest and rebuild everything.")
+    parser.add_argument("--index-type", choices=vector_index.INDEX_TYPES, default=None)
+    args = parser.parse_args()
+    run_pipeline(args.data_dir, args.workers, incremental=not args.full, index_type=args.index_type)
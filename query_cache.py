@@ -0,0 +1,144 @@
+import os
+import re
+import time
+import threading
+import numpy as np
+
+# --- Semantic Query-Result Cache ---
+# Sits in front of retrieve_documents(). A new query is embedded, compared
+# (cosine) with recently answered queries, and if one is similar enough its
+# reranked chunk ids are returned, skipping the FAISS search and the
+# cross-encoder. Entries expire after 'ttl' seconds, the least recently used
+# entry is evicted when full, and everything is dropped as soon as the index
+# manifest on disk changes (i.e. someone re-ran ingest); 'on_invalidate' is
+# called at that point too, so callers can reopen the index files.
+# Queries that differ only in an identifier ("part PN-0042" vs "part PN-0043",
+# "errors in 2023" vs "2024") embed almost identically, so callers put
+# identifier_tokens(query) into the lookup key: those must match exactly.
+
+DEFAULT_THRESHOLD = float(os.getenv("QUERY_CACHE_THRESHOLD", "0.95"))
+DEFAULT_TTL = 3600
+DEFAULT_MAX_ENTRIES = 1024
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+
+
+def identifier_tokens(text):
+    """Sorted, de-duplicated tokens that contain a digit (part numbers, error codes, years, amounts)."""
+    return tuple(sorted({t for t in _TOKEN_RE.findall(text.lower()) if any(c.isdigit() for c in t)}))
+
+
+class SemanticQueryCache:
+    def __init__(self, manifest_path, threshold=DEFAULT_THRESHOLD, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES,
+                 on_invalidate=None):
+        self.manifest_path = manifest_path
+        self.on_invalidate = on_invalidate
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._clear()
+        self._manifest_stamp = self._stamp()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.seconds_saved = 0.0
+
+    def _clear(self):
+        self._vectors = None  # (n, dim) unit vectors, row i <-> self._entries[i]
+        self._entries = []    # dicts: key, ids, scores, cost, created, used
+
+    def _stamp(self):
+        try:
+            st = os.stat(self.manifest_path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def _check_manifest(self):
+        stamp = self._stamp()
+        if stamp != self._manifest_stamp:
+            self._manifest_stamp = stamp
+            if self._entries:
+                self.invalidations += 1
+            self._clear()
+            if self.on_invalidate is not None:
+                self.on_invalidate()
+
+    def check_manifest(self):
+        """Clears the cache (and fires 'on_invalidate') if the manifest changed since the last check."""
+        with self._lock:
+            self._check_manifest()
+
+    @staticmethod
+    def _unit(vector):
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def _drop(self, rows):
+        keep = [i for i in range(len(self._entries)) if i not in rows]
+        self._entries = [self._entries[i] for i in keep]
+        self._vectors = self._vectors[keep] if keep else None
+
+    def lookup(self, query_vector, key=()):
+        """
+        Returns (chunk_ids, scores) for the most similar earlier query with the
+        same 'key' (retrieval parameters), or None.
+        """
+        q = self._unit(query_vector)
+        now = time.time()
+        with self._lock:
+            self._check_manifest()
+            if self._vectors is not None:
+                expired = {i for i, e in enumerate(self._entries) if now - e["created"] > self.ttl}
+                if expired:
+                    self._drop(expired)
+            if self._vectors is None:
+                self.misses += 1
+                return None
+
+            sims = self._vectors @ q
+            for i in np.argsort(sims)[::-1]:
+                if sims[i] < self.threshold:
+                    break
+                entry = self._entries[i]
+                if entry["key"] == key:
+                    entry["used"] = now
+                    self.hits += 1
+                    self.seconds_saved += entry["cost"]
+                    return list(entry["ids"]), list(entry["scores"])
+            self.misses += 1
+            return None
+
+    def store(self, query_vector, ids, cost, key=(), scores=None):
+        """
+        Remembers the reranked chunk ids (and their rerank scores) for a query;
+        'cost' is the time the search + rerank took.
+        """
+        q = self._unit(query_vector)
+        now = time.time()
+        with self._lock:
+            self._check_manifest()
+            if len(self._entries) >= self.max_entries:
+                lru = min(range(len(self._entries)), key=lambda i: self._entries[i]["used"])
+                self._drop({lru})
+            self._entries.append({"key": key, "ids": list(ids), "scores": list(scores or [None] * len(ids)),
+                                  "cost": cost, "created": now, "used": now})
+            self._vectors = q[None, :] if self._vectors is None else np.vstack([self._vectors, q])
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "seconds_saved": round(self.seconds_saved, 3),
+            "entries": len(self._entries),
+            "invalidations": self.invalidations,
+        }
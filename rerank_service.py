@@ -0,0 +1,190 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+import tracing
+
+# --- Batched, Cached Cross-Encoder Reranking ---
+# Concurrent retrieve_documents() calls each used to run their own small
+# forward pass. The service queues (query, chunk) pairs from all callers and
+# a single worker thread scores them together in micro-batches, flushing when
+# the batch is full or the oldest request has waited 'max_wait_ms'.
+# Scores are memoised per (query hash, chunk id) in a bounded LRU.
+
+MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+DEFAULT_BACKEND = os.getenv("RERANKER_BACKEND", "torch")  # torch | torch-int8 | onnx | fake
+FAKE_RERANK_LATENCY = float(os.getenv("FAKE_RERANK_LATENCY", "0.002"))  # seconds per pair
+MAX_BATCH_PAIRS = 64
+MAX_WAIT_MS = 10
+CACHE_SIZE = 50_000
+
+
+def load_cross_encoder(model_name=MODEL_NAME, backend=DEFAULT_BACKEND):
+    """
+    Builds the CrossEncoder on the requested CPU backend:
+      torch       - stock PyTorch model
+      torch-int8  - dynamic int8 quantization of the Linear layers
+      onnx        - ONNX Runtime via sentence-transformers (needs 'optimum[onnxruntime]')
+      fake        - FakeCrossEncoder, for offline tests and benchmarks
+    Falls back to plain torch if the backend isn't available.
+    """
+    if backend == "fake":
+        return FakeCrossEncoder(per_pair_latency=FAKE_RERANK_LATENCY)
+    from sentence_transformers import CrossEncoder
+
+    if backend == "onnx":
+        try:
+            return CrossEncoder(model_name, backend="onnx")
+        except Exception as e:
+            print(f"⚠️  ONNX reranker unavailable ({e}). Falling back to torch.")
+
+    model = CrossEncoder(model_name)
+    if backend == "torch-int8":
+        import torch
+        model.model = torch.quantization.quantize_dynamic(model.model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+class FakeCrossEncoder:
+    """
+    Deterministic stand-in: the score is the share of query words found in
+    the chunk, mapped onto the ms-marco logit range [-10, 10]. Sleeps
+    base + per_pair * len(pairs), like one forward pass.
+    """
+
+    def __init__(self, base_latency=0.005, per_pair_latency=0.002):
+        self.base_latency = base_latency
+        self.per_pair_latency = per_pair_latency
+
+    def predict(self, pairs, batch_size=32):
+        time.sleep(self.base_latency + self.per_pair_latency * len(pairs))
+        scores = []
+        for query, text in pairs:
+            words = set(query.lower().split())
+            found = set(text.lower().split())
+            scores.append(20.0 * len(words & found) / max(len(words), 1) - 10.0)
+        return scores
+
+
+def query_hash(query):
+    return hashlib.sha256(" ".join(query.split()).encode("utf-8")).hexdigest()
+
+
+def doc_key(doc):
+    """Chunk id assigned at ingest; content hash for documents without one."""
+    if getattr(doc, "id", None):
+        return doc.id
+    return hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()
+
+
+class RerankService:
+    def __init__(self, model, max_batch_pairs=MAX_BATCH_PAIRS, max_wait_ms=MAX_WAIT_MS, cache_size=CACHE_SIZE):
+        self.model = model
+        self.max_batch_pairs = max_batch_pairs
+        self.max_wait = max_wait_ms / 1000
+        self.cache_size = cache_size
+
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._pending = []  # [(pairs, future), ...]
+        self._cond = threading.Condition()
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+
+        self._worker = threading.Thread(target=self._run, daemon=True, name="rerank-batcher")
+        self._worker.start()
+
+    # --- Cache ---
+
+    def _cache_get(self, key):
+        with self._cache_lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+            return score
+
+    def _cache_put(self, key, score):
+        with self._cache_lock:
+            self._cache[key] = score
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # --- Micro-batching worker ---
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # Give other callers until the deadline to join this batch
+                deadline = time.monotonic() + self.max_wait
+                while sum(len(p) for p, _ in self._pending) < self.max_batch_pairs:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                requests, self._pending = self._pending, []
+
+            pairs = [pair for p, _ in requests for pair in p]
+            try:
+                with tracing.span("rerank.batch", pairs=len(pairs), requests=len(requests)):
+                    scores = self.model.predict(pairs, batch_size=self.max_batch_pairs)
+                self.batches += 1
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for p, future in requests:
+                future.set_result([float(s) for s in scores[offset:offset + len(p)]])
+                offset += len(p)
+
+    def _submit(self, pairs):
+        future = Future()
+        with self._cond:
+            self._pending.append((pairs, future))
+            self._cond.notify()
+        return future
+
+    # --- Public API ---
+
+    def score(self, query, docs):
+        """Cross-encoder scores for 'docs' against 'query' (same order as docs)."""
+        qh = query_hash(query)
+        keys = [(qh, doc_key(d)) for d in docs]
+        scores = [self._cache_get(k) for k in keys]
+        missing = [i for i, s in enumerate(scores) if s is None]
+        with self._cache_lock:
+            self.hits += len(docs) - len(missing)
+            self.misses += len(missing)
+        tracing.add(rerank_cache_hits=len(docs) - len(missing))
+
+        if missing:
+            fresh = self._submit([[query, docs[i].page_content] for i in missing]).result()
+            for i, s in zip(missing, fresh):
+                scores[i] = s
+                self._cache_put(keys[i], s)
+        return scores
+
+    def clear(self):
+        """Forgets every cached score."""
+        with self._cache_lock:
+            self._cache.clear()
+
+    def predict(self, pairs):
+        """CrossEncoder-compatible entry point (uncached, still micro-batched)."""
+        return self._submit([list(p) for p in pairs]).result()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "batches": self.batches,
+            "cached_pairs": len(self._cache),
+        }
@@ -0,0 +1,105 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Lazy Resource Registry ---
+# Heavy objects (embedder, FAISS index, validator LLM, cross-encoder) are
+# registered as factories and only built the first time someone asks for
+# them. Each resource has its own lock, so concurrent first calls wait for a
+# single load instead of loading twice, and loading one resource never
+# blocks access to another.
+
+_MISSING = object()
+
+
+class ResourceRegistry:
+    def __init__(self):
+        self._factories = {}
+        self._values = {}
+        self._locks = {}
+        self._load_times = {}
+        self._errors = {}
+        self._registry_lock = threading.Lock()
+
+    def register(self, name, factory):
+        """Registers 'factory' (a no-argument callable) under 'name'."""
+        with self._registry_lock:
+            self._factories[name] = factory
+            self._locks[name] = threading.Lock()
+
+    def get(self, name):
+        value = self._values.get(name, _MISSING)
+        if value is not _MISSING:
+            return value  # Fast path: no locking once loaded
+        if name not in self._factories:
+            raise KeyError(f"Unknown resource '{name}'")
+
+        with self._locks[name]:
+            # Double-checked: another thread may have finished while we waited
+            value = self._values.get(name, _MISSING)
+            if value is not _MISSING:
+                return value
+            t0 = time.perf_counter()
+            try:
+                value = self._factories[name]()
+            except Exception as e:
+                self._errors[name] = str(e)
+                raise
+            self._load_times[name] = time.perf_counter() - t0
+            self._errors.pop(name, None)
+            # None means "not available yet" (e.g. no index on disk): don't
+            # cache it, so the next call tries again.
+            if value is not None:
+                self._values[name] = value
+            return value
+
+    def is_loaded(self, name):
+        return name in self._values
+
+    def reset(self, name):
+        """Forgets a loaded resource (e.g. after the index was rebuilt)."""
+        with self._locks[name]:
+            self._values.pop(name, None)
+
+    def warm_up(self, names=None, parallel=True):
+        """
+        Loads the given resources (default: all) ahead of the first request.
+        Failures are recorded in report() instead of raised.
+        """
+        names = list(names or self._factories)
+
+        def load(name):
+            try:
+                self.get(name)
+            except Exception:
+                pass
+
+        if parallel and len(names) > 1:
+            with ThreadPoolExecutor(max_workers=len(names)) as pool:
+                list(pool.map(load, names))
+        else:
+            for name in names:
+                load(name)
+        return self.report()
+
+    def report(self):
+        """{name: {"loaded": bool, "seconds": float | None, "error": str | None}}"""
+        return {
+            name: {
+                "loaded": name in self._values,
+                "seconds": self._load_times.get(name),
+                "error": self._errors.get(name),
+            }
+            for name in self._factories
+        }
+
+    def print_report(self):
+        print("📦 Resource load times:")
+        for name, info in self.report().items():
+            if info["error"]:
+                status = f"❌ {info['error']}"
+            elif info["loaded"]:
+                status = f"{info['seconds'] * 1000:8.1f} ms"
+            else:
+                status = "not loaded"
+            print(f"   - {name:<12} {status}")
@@ -0,0 +1,274 @@
+import os
+import re
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import fitz
+import pandas as pd
+
+# --- Structured Table Index ---
+# At ingest time every PDF page goes through PyMuPDF's table finder. Each
+# table is stored as one Parquet file (typed columns: "1,234" and "12%"
+# become numbers) and listed in TABLE_DIR/manifest.json under a stable id
+# "<pdf path under data/>:p<page>:t<n>". The analyst loads a table straight into the
+# Code Interpreter as a DataFrame instead of re-typing numbers from chunk
+# text. Like the image extractor, results are keyed by the PDF's sha256, so
+# unchanged PDFs are never scanned twice and removed PDFs lose their tables.
+
+TABLE_DIR = "tables"
+ID_ROOT = "data"  # Table ids are relative to the corpus root (ingest.DATA_DIR)
+TABLE_MANIFEST = os.path.join(TABLE_DIR, "manifest.json")
+TABLE_PAGES_PER_TASK = 8  # the table finder costs ~0.1s per page
+MIN_TABLE_ROWS = 2
+MIN_TABLE_COLS = 2
+
+_NUMBER = re.compile(r"^[-+]?[$€£]?\s*\d[\d,]*(\.\d+)?\s*%?$")
+
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def source_name(pdf_path):
+    """The PDF part of a table id: its path under ID_ROOT (relative to the cwd if outside), with '/'."""
+    root = os.path.abspath(ID_ROOT)
+    path = os.path.abspath(pdf_path)
+    inside = os.path.commonpath([path, root]) == root
+    return os.path.relpath(path, root if inside else os.getcwd()).replace(os.sep, "/")
+
+
+def clean_columns(columns):
+    """Parquet needs unique, non-empty string column names."""
+    names, seen = [], {}
+    for i, col in enumerate(columns):
+        name = " ".join(str(col or "").split()) or f"col{i + 1}"
+        if re.fullmatch(r"Col\d+", name):  # PyMuPDF's placeholder for a missing header
+            name = f"col{i + 1}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}_{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def coerce_numeric(df):
+    """Turns text columns that only hold numbers (with ',', '%', currency signs) into numeric ones."""
+    for col in df.columns:
+        values = df[col].astype("string").str.strip().replace("", pd.NA)
+        present = values.dropna()
+        if present.empty or not present.map(lambda v: bool(_NUMBER.match(v))).all():
+            df[col] = values
+            continue
+        df[col] = pd.to_numeric(values.str.replace(r"[,$€£%\s]", "", regex=True), errors="coerce")
+    return df
+
+
+def _extract_page_range(pdf_path, start, end, out_dir):
+    """
+    Runs in a worker process. Writes each table found on pages [start, end)
+    to Parquet and returns (manifest entries, error or None).
+    """
+    name = source_name(pdf_path)
+    found = []
+    try:
+        with fitz.open(pdf_path) as doc:
+            for page_index in range(start, min(end, doc.page_count)):
+                try:
+                    tables = doc[page_index].find_tables().tables
+                except Exception:
+                    continue  # A page the finder chokes on shouldn't lose the whole PDF
+                for table_index, table in enumerate(tables):
+                    df = table.to_pandas()
+                    if len(df) < MIN_TABLE_ROWS or len(df.columns) < MIN_TABLE_COLS:
+                        continue
+                    df.columns = clean_columns(df.columns)
+                    df = coerce_numeric(df.reset_index(drop=True))
+                    page, n = page_index + 1, table_index + 1
+                    path = os.path.join(out_dir, f"p{page}_t{n}.parquet")
+                    df.to_parquet(path, index=False)
+                    found.append({
+                        "id": f"{name}:p{page}:t{n}",
+                        "source": pdf_path,
+                        "page": page,
+                        "rows": len(df),
+                        "columns": list(df.columns),
+                        "file": path,
+                    })
+    except Exception as e:
+        return found, f"{type(e).__name__}: {e}"
+    return found, None
+
+
+def load_table_manifest():
+    if not os.path.exists(TABLE_MANIFEST):
+        return {"files": {}}
+    with open(TABLE_MANIFEST, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_table_manifest(manifest):
+    os.makedirs(TABLE_DIR, exist_ok=True)
+    tmp_path = TABLE_MANIFEST + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, TABLE_MANIFEST)
+
+
+def _remove_tables(entry):
+    for table in entry.get("tables", ()):
+        if os.path.exists(table["file"]):
+            os.remove(table["file"])
+        _remove_dir_if_empty(os.path.dirname(table["file"]))
+
+
+def _table_dir(pdf_path, digest):
+    # From the id's path, so a/report.pdf and b/report.pdf never share a folder
+    stem = re.sub(r"[^\w.-]", "_", os.path.splitext(source_name(pdf_path))[0])
+    return os.path.join(TABLE_DIR, f"{stem}_{digest[:12]}")
+
+
+def _remove_dir_if_empty(folder):
+    if os.path.isdir(folder) and not os.listdir(folder):
+        os.rmdir(folder)
+
+
+def extract_tables(pdf_digests, workers=None, pages_per_task=TABLE_PAGES_PER_TASK):
+    """
+    Scans {pdf path: sha256} and returns ({pdf path: [manifest entries]},
+    {pdf path: error}). A PDF that fails anywhere is left out of the first
+    dict (its partial files removed). All page ranges share one process pool.
+    """
+    tasks, errors = [], {}
+    for path, digest in pdf_digests.items():
+        try:
+            with fitz.open(path) as doc:
+                page_count = doc.page_count
+        except Exception as e:
+            errors[path] = f"{type(e).__name__}: {e}"
+            continue
+        out_dir = _table_dir(path, digest)
+        os.makedirs(out_dir, exist_ok=True)
+        tasks.extend((path, s, s + pages_per_task, out_dir) for s in range(0, page_count, pages_per_task))
+
+    found = {path: [] for path in pdf_digests if path not in errors}
+    workers = min(workers or os.cpu_count() or 2, len(tasks))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_extract_page_range, *zip(*tasks)))
+    else:
+        parts = [_extract_page_range(*task) for task in tasks]
+    for (path, *_), (tables, error) in zip(tasks, parts):
+        found[path].extend(tables)
+        if error:
+            errors.setdefault(path, error)
+
+    for path in errors:
+        if path in found:
+            _remove_tables({"tables": found.pop(path)})
+        _remove_dir_if_empty(_table_dir(path, pdf_digests[path]))
+    return found, errors
+
+
+def update_tables(pdf_paths, workers=None, prune=True, hashes=None):
+    """
+    Brings the table index in line with 'pdf_paths': new or changed PDFs are
+    scanned, unchanged ones skipped and, with prune=True, tables of PDFs no
+    longer listed dropped. 'hashes' ({path: sha256}) saves re-hashing files
+    the caller already hashed. PDFs that can't be read are reported and left
+    out (so they're retried next time). Returns the number of tables in the index.
+    """
+    hashes = hashes or {}
+    manifest = load_table_manifest()
+    files = manifest["files"]
+    if prune:
+        for path in [p for p in files if p not in pdf_paths]:
+            _remove_tables(files.pop(path))
+
+    stale, errors = {}, {}
+    for path in pdf_paths:
+        try:
+            digest = hashes.get(path) or _file_sha256(path)
+        except OSError as e:
+            errors[path] = str(e)
+            continue
+        entry = files.get(path)
+        prefix = source_name(path) + ":"
+        if (entry and entry["sha256"] == digest
+                and all(os.path.exists(t["file"]) and t["id"].startswith(prefix) for t in entry["tables"])):
+            continue  # (Ids from an older naming scheme are re-extracted)
+        if entry:
+            _remove_tables(files.pop(path))
+        stale[path] = digest
+
+    if stale:
+        found, failed = extract_tables(stale, workers)
+        errors.update(failed)
+        for path, tables in found.items():
+            files[path] = {"sha256": stale[path], "tables": tables}
+            if tables:
+                print(f"   - 📊 {len(tables)} table(s) extracted from {path}")
+    for path, error in errors.items():
+        print(f"⚠️  Skipped tables of {path}: {error}")
+    save_table_manifest(manifest)
+    return sum(len(f["tables"]) for f in files.values())
+
+
+def drop_tables(pdf_paths):
+    """Removes the tables of 'pdf_paths' (e.g. PDFs that left the corpus) from the index."""
+    manifest = load_table_manifest()
+    dropped = [p for p in pdf_paths if p in manifest["files"]]
+    for path in dropped:
+        _remove_tables(manifest["files"].pop(path))
+    if dropped:
+        save_table_manifest(manifest)
+
+
+def list_tables(query=""):
+    """Manifest entries whose id or column names contain 'query' (case-insensitive)."""
+    query = query.lower().strip()
+    tables = [t for f in load_table_manifest()["files"].values() for t in f["tables"]]
+    if query:
+        tables = [t for t in tables if query in t["id"].lower() or any(query in c.lower() for c in t["columns"])]
+    return tables
+
+
+def get_table(table_id):
+    """
+    The table with this id, or None. A shorter id matching the end of a full
+    one ('report.pdf:p3:t1' for 'q3/report.pdf:p3:t1') is accepted when only
+    one table matches; if several do, ValueError names them.
+    """
+    tables = list_tables()
+    for table in tables:
+        if table["id"] == table_id:
+            return table
+    matches = [t for t in tables if t["id"].endswith("/" + table_id)]
+    if len(matches) > 1:
+        raise ValueError(f"'{table_id}' is ambiguous: {', '.join(t['id'] for t in matches)}")
+    return matches[0] if matches else None
+
+
+def variable_name(table_id):
+    """Python identifier for a table id, e.g. 'q3/report.pdf:p3:t1' -> 'q3_report_p3_t1'."""
+    stem, _, rest = table_id.partition(":")
+    name = re.sub(r"\W", "_", f"{os.path.splitext(stem)[0]}_{rest.replace(':', '_')}").strip("_")
+    return name if not name[:1].isdigit() else f"t_{name}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract PDF tables to Parquet, or list the extracted ones.")
+    parser.add_argument("pdfs", nargs="*", help="PDFs to index (default: just list the current index)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--grep", default="", help="Only list tables whose id or columns contain this.")
+    args = parser.parse_args()
+    if args.pdfs:
+        update_tables(args.pdfs, args.workers, prune=False)
+    for table in list_tables(args.grep):
+        print(f"{table['id']:<40} {table['rows']:>5} rows  {', '.join(table['columns'])}")
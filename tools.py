@@ -4,78 +4,194 @@ os.environ["USE_TF"] = "0"
 os.environ["USE_TORCH"] = "1"
 os.environ["TRANSFORMERS_NO_ADVISORY_WARNINGS"] = "true"
 
-from langchain_ollama import OllamaEmbeddings, ChatOllama
 from langchain_community.vectorstores import FAISS
 from langchain_core.prompts import PromptTemplate
-from sentence_transformers import CrossEncoder
+import re
+import time
+import json
 import numpy as np
+from batch_embedder import make_embeddings
+from resources import ResourceRegistry
+from rerank_service import RerankService, load_cross_encoder, doc_key
+from query_cache import SemanticQueryCache, identifier_tokens
+from llm_cache import make_chat_model
+from context_budget import assemble_context
+import tracing
+import bm25_index
+import vector_index
+import mmap_store
 
-# --- 1. SETUP: Load the "Brain", "Memory", and "Re-ranker" ---
+# --- 1. SETUP: Register the "Brain", "Memory", and "Re-ranker" ---
+# Nothing heavy is built at import time. Each resource is loaded on first
+# use (or by warm_up()) through the registry, which also times the loads.
 
-print("⚙️  Loading resources (Embeddings, FAISS, Re-ranker)...")
+DB_PATH = "faiss_index"
+# "mmap": open vectors + chunks memory-mapped and read-only (shared across workers)
+# "full": FAISS.load_local, i.e. a private, writable copy per process
+DB_LOAD_MODE = os.getenv("VECTOR_DB_LOAD_MODE", "mmap")
+# "hybrid": dense + BM25 fused with reciprocal-rank fusion; "dense": FAISS only
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# Output cap for the validator LLM, per verdict it has to write
+VALIDATOR_MAX_TOKENS = int(os.getenv("VALIDATOR_MAX_TOKENS", "64"))
+# Token budget for what the crew's search tool hands back to an agent
+SEARCH_TOOL_TOKEN_BUDGET = int(os.getenv("SEARCH_TOOL_TOKEN_BUDGET", "1000"))
 
-# A. Load Embeddings (for retrieval)
-embeddings = OllamaEmbeddings(model="nomic-embed-text")
+registry = ResourceRegistry()
 
-# B. Load Vector Database (The "Memory")
-# This defines 'vector_db' so the functions below can use it.
-DB_PATH = "faiss_index"
-vector_db = None
+# A. Embeddings (for retrieval)
+# Wrapped in the on-disk cache so repeated queries skip Ollama entirely.
+def _load_embeddings():
+    return make_embeddings(batching=False)
+
+# B. Vector Database (The "Memory")
+def _load_vector_db():
+    # Returning None (no index yet) isn't cached, so a later call retries
+    if not os.path.exists(DB_PATH):
+        return None
+    print("⚙️ Loading Vector Database...")
+    embeddings = registry.get("embeddings")
+    if DB_LOAD_MODE == "mmap":
+        db = mmap_store.load_store(DB_PATH, embeddings)
+        if db is not None:
+            return db
+    return FAISS.load_local(DB_PATH, embeddings, allow_dangerous_deserialization=True)
+
+# C. Validator LLM (The "Editor")
+# Built through make_chat_model, so identical prompts are answered from the
+# shared response cache (LLM_BACKEND=fake runs it offline).
+def _load_llm():
+    return make_chat_model("phi3", format="json", temperature=0, num_predict=VALIDATOR_MAX_TOKENS)
+
+# D. Re-ranker (The "Second Opinion")
+# Shared service: micro-batches pairs across concurrent queries and caches scores.
+# RERANKER_BACKEND=torch-int8 / onnx picks a faster CPU backend.
+def _load_reranker():
+    return RerankService(load_cross_encoder())
+
+# E. Lexical BM25 index (memory-mapped; None until ingest has built it)
+def _load_bm25():
+    return bm25_index.BM25Index.load(DB_PATH)
+
+registry.register("embeddings", _load_embeddings)
+registry.register("vector_db", _load_vector_db)
+registry.register("llm", _load_llm)
+registry.register("reranker", _load_reranker)
+registry.register("bm25", _load_bm25)
+
+# F. Semantic query cache (cheap, so not lazy). Cleared whenever ingest
+# rewrites the manifest, so it never serves chunks from an old index. The
+# same check drops the loaded FAISS/BM25 objects: they still point at the
+# files the re-ingest replaced.
+def _reload_index():
+    registry.reset("vector_db")
+    registry.reset("bm25")
+
+query_cache = SemanticQueryCache(manifest_path=os.path.join(DB_PATH, "manifest.json"), on_invalidate=_reload_index)
 
 def get_vector_db():
     """
     Safely loads the database only when needed.
     """
-    global vector_db
-    if vector_db is not None:
-        return vector_db
-    
-    # Check if the folder exists before trying to load
-    if os.path.exists(DB_PATH):
-        try:
-            print("⚙️ Loading Vector Database...")
-            vector_db = FAISS.load_local(DB_PATH, embeddings, allow_dangerous_deserialization=True)
-            return vector_db
-        except Exception as e:
-            print(f"Error loading DB: {e}")
-            return None
-    return None
+    try:
+        return registry.get("vector_db")
+    except Exception as e:
+        print(f"Error loading DB: {e}")
+        return None
+
+def get_embeddings():
+    return registry.get("embeddings")
 
-# C. Load Validator LLM (The "Editor")
-llm = ChatOllama(model="phi3", format="json", temperature=0)
+def get_llm():
+    return registry.get("llm")
 
-# D. Load Re-ranker (The "Second Opinion")
-reranker = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
+def get_reranker():
+    return registry.get("reranker")
+
+def get_bm25():
+    return registry.get("bm25")
+
+def warm_up(names=None):
+    """
+    Loads resources ahead of the first request (all of them by default)
+    and prints how long each one took.
+    """
+    print("⚙️  Warming up resources (Embeddings, FAISS, Validator, Re-ranker)...")
+    report = registry.warm_up(names)
+    registry.print_report()
+    return report
 
 
 # --- 2. TOOLS: Retrieval & Validation ---
 
-def retrieve_documents(query, k_initial=10, k_final=3):
+@tracing.traced("tools.retrieve_documents")
+def retrieve_documents(query, k_initial=10, k_final=3, nprobe=None, ef_search=None, with_scores=False):
     """
     1. Retrieval: Get top 10 docs from FAISS (Broad Search)
     2. Re-ranking: sort them by actual relevance (Precise Filter)
+    'nprobe' (IVF indexes) / 'ef_search' (HNSW) trade recall for speed per query;
+    None uses the value saved at ingest time.
+    Near-identical earlier questions are answered from the semantic query cache.
+    with_scores=True returns (doc, cross-encoder score) pairs.
     """
     print(f"🕵️  Broad Search for: '{query}'...")
     
-    # Step 1: Broad Retrieval
-    # Uses the global 'vector_db' defined above
-    initial_docs = vector_db.similarity_search(query, k=k_initial)
+    query_cache.check_manifest()  # Before get_vector_db(), so a re-ingested index is reopened
+    vector_db = get_vector_db()
+    if vector_db is None:
+        print("❌ Knowledge base not found. Run ingest.py first.")
+        return []
+
+    # Step 0: Semantic cache (skips FAISS + re-ranking on a hit)
+    t0 = time.perf_counter()
+    with tracing.span("tools.embed_query"):
+        query_vector = get_embeddings().embed_query(query)
+    # Near-identical wording isn't enough when an id differs: ids must match exactly
+    cache_key = (k_initial, k_final, nprobe, ef_search, identifier_tokens(query))
+    cached = query_cache.lookup(query_vector, cache_key)
+    if cached is not None:
+        cached_ids, cached_scores = cached
+        docs = vector_db.get_by_ids(cached_ids)
+        # get_by_ids() silently skips ids it can't find; then the entry is
+        # stale and we search normally rather than pair the wrong scores
+        if len(docs) == len(cached_ids):
+            print("   ⚡ Answered from the semantic query cache.")
+            tracing.add(query_cache_hits=1)
+            score_by_id = dict(zip(cached_ids, cached_scores))
+            return [(d, score_by_id[d.id]) for d in docs] if with_scores else docs
+
+    # Step 1: Broad Retrieval (dense, plus exact-term BM25 in hybrid mode)
+    with tracing.span("tools.dense_search"):
+        initial_docs = vector_index.similarity_search_by_vector(vector_db, query_vector, k=k_initial, nprobe=nprobe, ef_search=ef_search)
+    lexical = get_bm25() if RETRIEVAL_MODE == "hybrid" else None
+    if lexical is not None:
+        lexical_docs = []
+        with tracing.span("tools.bm25_search"):
+            lexical_hits = lexical.search(query, k=k_initial)
+        for row, _ in lexical_hits:
+            doc_id = vector_db.index_to_docstore_id.get(row)
+            doc = vector_db.docstore.search(doc_id) if doc_id is not None else None
+            if doc is not None and not isinstance(doc, str):
+                lexical_docs.append(doc)
+        # Reciprocal-rank fusion of both lists, then the cross-encoder decides
+        by_key = {doc_key(d): d for d in lexical_docs + initial_docs}
+        fused = bm25_index.reciprocal_rank_fusion([[doc_key(d) for d in initial_docs], [doc_key(d) for d in lexical_docs]])
+        initial_docs = [by_key[key] for key in fused[:k_initial]]
     
     if not initial_docs:
         return []
 
     print(f"   - Found {len(initial_docs)} candidates. Re-ranking now...")
 
-    # Step 2: Prepare pairs for the Cross-Encoder
-    pairs = [[query, doc.page_content] for doc in initial_docs]
-    
-    # Step 3: Score the pairs
-    scores = reranker.predict(pairs)
+    # Step 2 + 3: Score (query, chunk) pairs with the Cross-Encoder
+    # (cached per query/chunk, batched with other concurrent queries)
+    with tracing.span("tools.rerank", pairs=len(initial_docs)):
+        scores = get_reranker().score(query, initial_docs)
     
     # Step 4: Sort by highest score
     sorted_indices = np.argsort(scores)[::-1] # Sort descending
     
     top_docs = []
+    top_scores = []
     for i in range(min(k_final, len(initial_docs))):
         idx = sorted_indices[i]
         best_doc = initial_docs[idx]
@@ -84,38 +200,177 @@ def retrieve_documents(query, k_initial=10, k_final=3):
         # print(f"   Rank #{i+1}: Score {scores[idx]:.2f}")
         
         top_docs.append(best_doc)
-        
-    return top_docs
+        top_scores.append(float(scores[idx]))
+
+    if all(d.id for d in top_docs):
+        query_cache.store(query_vector, [d.id for d in top_docs], time.perf_counter() - t0, cache_key, top_scores)
+    return list(zip(top_docs, top_scores)) if with_scores else top_docs
+
+# --- Relevance Validator ---
+# The prompt and chain are built once (lazily, through the registry) instead
+# of on every call inside the graph's retry loop. Output is capped at
+# VALIDATOR_MAX_TOKENS per verdict so phi3 can't ramble, and the JSON is
+# parsed tolerantly: code fences, surrounding chatter, single quotes,
+# trailing commas or "Yes"/true instead of "yes" no longer count as errors.
+
+VALIDATOR_PROMPT = PromptTemplate(
+    template="""
+    You are a strict data evaluator. 
+    User Query: {query}
+    Retrieved Document Snippet: {context}
+    
+    Check if the 'Retrieved Document Snippet' contains the specific information needed to answer the 'User Query'.
+    If it is relevant, output "relevance": "yes".
+    If it is unrelated or vague, output "relevance": "no".
+    
+    Provide your response in JSON format only:
+    {{ "relevance": "yes/no", "reason": "short explanation" }}
+    """,
+    input_variables=["query", "context"]
+)
+
+_JSON_BLOCK_RE = re.compile(r"[\[{].*[\]}]", re.DOTALL)
+_VERDICT_RE = re.compile(r"relevan\w*[\"']?\s*[:=]\s*[\"']?(yes|no|true|false)", re.IGNORECASE)
 
+def _repair_json(text):
+    text = re.sub(r",\s*([}\]])", r"\1", text)                         # trailing commas
+    text = re.sub(r"([{,]\s*)([A-Za-z_]\w*)\s*:", r'\1"\2":', text)    # unquoted keys
+    text = re.sub(r"\bTrue\b", "true", re.sub(r"\bFalse\b", "false", text))
+    if '"' not in text:
+        text = text.replace("'", '"')
+    return text
+
+def loads_tolerant(text):
+    """json.loads that digs the JSON out of chatter and fixes common slips. None if hopeless."""
+    text = re.sub(r"^```(?:json)?|```$", "", text.strip()).strip()
+    candidates = [text]
+    match = _JSON_BLOCK_RE.search(text)
+    if match and match.group(0) != text:
+        candidates.append(match.group(0))
+    for candidate in candidates:
+        for attempt in (candidate, _repair_json(candidate)):
+            try:
+                return json.loads(attempt)
+            except ValueError:
+                pass
+    return None
+
+def normalize_verdict(value):
+    value = str(value).strip().strip(".").lower()
+    if value in ("yes", "true", "relevant"):
+        return "yes"
+    if value in ("no", "false", "irrelevant", "not relevant"):
+        return "no"
+    return "error"
+
+def parse_relevance(text):
+    """LLM output -> {"relevance": "yes/no/error", "reason": ...}"""
+    data = loads_tolerant(text)
+    if isinstance(data, dict) and "relevance" in data:
+        return {"relevance": normalize_verdict(data["relevance"]), "reason": str(data.get("reason", ""))}
+    match = _VERDICT_RE.search(text)
+    if match:
+        return {"relevance": normalize_verdict(match.group(1)), "reason": ""}
+    return {"relevance": "error", "reason": "LLM failed to output JSON"}
+
+class RelevanceValidator:
+    def __init__(self, llm):
+        self.chain = VALIDATOR_PROMPT | llm
+
+    def invoke(self, query, context_text):
+        response = self.chain.invoke({"query": query, "context": context_text})
+        return parse_relevance(response.content)
+
+    def batch(self, pairs, max_concurrency=8):
+        """Grades many (query, context) pairs concurrently; one verdict per pair, in order."""
+        if not pairs:
+            return []
+        responses = self.chain.batch([{"query": q, "context": c} for q, c in pairs],
+                                     config={"max_concurrency": max_concurrency})
+        return [parse_relevance(r.content) for r in responses]
+
+registry.register("validator", lambda: RelevanceValidator(get_llm()))
+
+def get_validator():
+    return registry.get("validator")
+
+@tracing.traced("tools.validate_relevance")
 def validate_relevance(query, context_text):
     """
     Asks the LLM: 'Does this text actually answer the user's question?'
     """
-    validator_prompt = PromptTemplate(
-        template="""
-        You are a strict data evaluator. 
+    return get_validator().invoke(query, context_text)
+
+# --- Batch Grading ---
+# Cross-encoder (ms-marco MiniLM) logits are well separated at the extremes:
+# chunks scoring above ACCEPT are kept and below REJECT are dropped without
+# asking the LLM. Re-fit both with calibrate_thresholds() on your own data.
+RERANK_ACCEPT_SCORE = float(os.getenv("RERANK_ACCEPT_SCORE", "6.0"))
+RERANK_REJECT_SCORE = float(os.getenv("RERANK_REJECT_SCORE", "-6.0"))
+# "batch": one structured prompt for all chunks, "concurrent": one call per chunk in parallel
+GRADING_MODE = os.getenv("GRADING_MODE", "batch")
+
+@tracing.traced("tools.validate_relevance_batch")
+def validate_relevance_batch(query, contexts, mode=None):
+    """
+    Grades every snippet in 'contexts' and returns one
+    {"relevance": "yes/no/error", "reason": ...} dict per snippet, in order.
+    Falls back to concurrent single calls if the batch answer can't be parsed.
+    """
+    if not contexts:
+        return []
+    mode = mode or GRADING_MODE
+    if mode == "batch" and len(contexts) > 1:
+        snippets = "\n\n".join(f"[{i + 1}] {text}" for i, text in enumerate(contexts))
+        prompt = f"""
+        You are a strict data evaluator.
         User Query: {query}
-        Retrieved Document Snippet: {context}
-        
-        Check if the 'Retrieved Document Snippet' contains the specific information needed to answer the 'User Query'.
-        If it is relevant, output "relevance": "yes".
-        If it is unrelated or vague, output "relevance": "no".
-        
+
+        Retrieved Document Snippets:
+        {snippets}
+
+        For EACH numbered snippet, check if it contains the specific information needed to answer the 'User Query'.
+        Answer "yes" if it is relevant, "no" if it is unrelated or vague.
+
         Provide your response in JSON format only:
-        {{ "relevance": "yes/no", "reason": "short explanation" }}
-        """,
-        input_variables=["query", "context"]
-    )
-    
-    chain = validator_prompt | llm
-    response = chain.invoke({"query": query, "context": context_text})
-    
-    import json
-    try:
-        data = json.loads(response.content)
-        return data
-    except:
-        return {"relevance": "error", "reason": "LLM failed to output JSON"}
+        {{ "results": [ {{ "id": 1, "relevance": "yes/no", "reason": "short explanation" }}, ... ] }}
+        """
+        # One verdict per snippet fits in the same per-verdict token budget
+        llm = get_llm().model_copy(update={"num_predict": VALIDATOR_MAX_TOKENS * len(contexts)})
+        response = llm.invoke(prompt)
+        data = loads_tolerant(response.content)
+        try:
+            rows = data["results"] if isinstance(data, dict) else data
+            results = {int(r["id"]): r for r in rows}
+            if all(i + 1 in results for i in range(len(contexts))):
+                return [{"relevance": normalize_verdict(results[i + 1].get("relevance")),
+                         "reason": str(results[i + 1].get("reason", ""))} for i in range(len(contexts))]
+        except (ValueError, KeyError, TypeError):
+            pass
+        print("   ⚠️  Batch grading output unusable. Grading snippets concurrently instead.")
+
+    return get_validator().batch([(query, text) for text in contexts], max_concurrency=len(contexts))
+
+def calibrate_thresholds(scored_labels, precision=0.95):
+    """
+    Picks (accept, reject) cross-encoder thresholds from [(score, is_relevant), ...]
+    collected from earlier LLM gradings: 'accept' is the lowest score above which
+    at least 'precision' of chunks were relevant, 'reject' the highest score below
+    which at least 'precision' were irrelevant.
+    """
+    ranked = sorted(scored_labels, key=lambda x: x[0])
+    accept, reject = RERANK_ACCEPT_SCORE, RERANK_REJECT_SCORE
+    for i in range(len(ranked)):
+        above = ranked[i:]
+        if sum(1 for _, rel in above if rel) / len(above) >= precision:
+            accept = ranked[i][0]
+            break
+    for i in range(len(ranked), 0, -1):
+        below = ranked[:i]
+        if sum(1 for _, rel in below if not rel) / len(below) >= precision:
+            reject = ranked[i - 1][0]
+            break
+    return accept, reject
 
 # --- 3. MAIN TEST BLOCK ---
 if __name__ == "__main__":
@@ -149,7 +404,8 @@ class EnterpriseSearchTool(BaseTool):
         docs = retrieve_documents(query, k_final=3)
         if not docs:
             return "No relevant documents found."
-        return "\n\n".join([d.page_content for d in docs])
+        # Deduplicated and trimmed, so the crew's agents don't carry raw chunks around
+        return assemble_context(query, [d.page_content for d in docs], budget=SEARCH_TOOL_TOKEN_BUDGET)
 
 # Instantiate the tool
 search_tool = EnterpriseSearchTool()
\ No newline at end of file
@@ -0,0 +1,225 @@
+import os
+import sys
+import json
+import time
+import uuid
+import inspect
+import argparse
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import defaultdict
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+
+# --- Tracing: where does the time go? ---
+# Every graph node, tool call, LLM call and CrewAI step is recorded as a span
+# (one JSON object per line in TRACE_FILE) with wall time, CPU time of the
+# calling thread, token counts and cache hits. Spans nest through a
+# contextvar, so a question's retrieve -> rerank -> LLM calls share one trace
+# id. Summarise with:  python tracing.py [traces.jsonl] [--stage PREFIX]
+# (CPU time of an async span only covers the event-loop thread.)
+
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")  # "" turns tracing off
+
+_current = contextvars.ContextVar("current_span", default=None)
+_write_lock = threading.Lock()
+_out = None
+
+
+class Span:
+    def __init__(self, stage, parent=None, attrs=None):
+        self.stage = stage
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attrs = dict(attrs or {})
+
+    def add(self, **counters):
+        for key, value in counters.items():
+            self.attrs[key] = self.attrs.get(key, 0) + value
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+def _emit(record):
+    global _out
+    if not TRACE_FILE:
+        return
+    line = json.dumps(record, default=str)
+    with _write_lock:
+        if _out is None:
+            _out = open(TRACE_FILE, "a", encoding="utf-8", buffering=1)
+        _out.write(line + "\n")
+
+
+@contextmanager
+def span(stage, **attrs):
+    """Times the enclosed block as one span; yields it so callers can add counters."""
+    current = Span(stage, _current.get(), attrs)
+    token = _current.set(current)
+    start, wall0, cpu0 = time.time(), time.perf_counter(), time.thread_time()
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        _emit({
+            "trace_id": current.trace_id, "span_id": current.span_id, "parent_id": current.parent_id,
+            "stage": stage, "start": start,
+            "wall_ms": (time.perf_counter() - wall0) * 1000, "cpu_ms": (time.thread_time() - cpu0) * 1000,
+            "error": error, **current.attrs,
+        })
+
+
+def record(stage, wall_ms, cpu_ms=None, **attrs):
+    """Emits an already-measured span (e.g. from a callback) under the current one."""
+    parent = _current.get()
+    done = Span(stage, parent, attrs)
+    _emit({
+        "trace_id": done.trace_id, "span_id": done.span_id, "parent_id": done.parent_id,
+        "stage": stage, "start": time.time() - wall_ms / 1000,
+        "wall_ms": wall_ms, "cpu_ms": cpu_ms, "error": None, **done.attrs,
+    })
+
+
+def add(**counters):
+    """Adds counters (tokens, cache hits, ...) to the innermost open span, if any."""
+    current = _current.get()
+    if current is not None:
+        current.add(**counters)
+
+
+def traced(stage):
+    """Decorator form of span() for sync and async functions."""
+    def decorate(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# --- LangChain: one span per LLM call, tokens added to the caller's span ---
+
+class LLMTraceHandler(BaseCallbackHandler):
+    run_inline = True  # Keep the caller's contextvars (current span)
+
+    def __init__(self):
+        self._started = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        usage = defaultdict(int)
+        for generations in response.generations:
+            for gen in generations:
+                meta = getattr(getattr(gen, "message", None), "usage_metadata", None) or {}
+                usage["input_tokens"] += meta.get("input_tokens", 0)
+                usage["output_tokens"] += meta.get("output_tokens", 0)
+        add(llm_calls=1, **usage)
+        if started is not None:
+            record("llm", (time.perf_counter() - started) * 1000, **usage)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+
+
+llm_trace_handler = LLMTraceHandler()
+
+
+# --- CrewAI: spans per agent step and per task ---
+
+class CrewTracer:
+    """Pass .step / .task as a Crew's step_callback / task_callback, then use kickoff()."""
+
+    def __init__(self):
+        self._last_step = self._last_task = time.perf_counter()
+
+    def step(self, output):
+        now = time.perf_counter()
+        record("crew.step", (now - self._last_step) * 1000,
+               kind=type(output).__name__, tool=getattr(output, "tool", None))
+        self._last_step = now
+
+    def task(self, output):
+        now = time.perf_counter()
+        record("crew.task", (now - self._last_task) * 1000, agent=str(getattr(output, "agent", "")))
+        self._last_task = self._last_step = now
+
+    def kickoff(self, crew, **inputs):
+        with span("crew.run") as s:
+            self._last_step = self._last_task = time.perf_counter()
+            result = crew.kickoff(**inputs)
+            usage = getattr(crew, "usage_metrics", None)
+            if usage is not None:
+                s.add(input_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+                      output_tokens=getattr(usage, "completion_tokens", 0) or 0,
+                      llm_calls=getattr(usage, "successful_requests", 0) or 0)
+            return result
+
+
+# --- Summary CLI ---
+
+def summarize(path=TRACE_FILE, prefix=""):
+    """{stage: {"n", "p50", "p95", "p99", "cpu_ms", <summed counters>}} from a trace file."""
+    walls, cpus, counters = defaultdict(list), defaultdict(list), defaultdict(lambda: defaultdict(int))
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            stage = rec.get("stage", "?")
+            if not stage.startswith(prefix):
+                continue
+            walls[stage].append(rec["wall_ms"])
+            if rec.get("cpu_ms") is not None:
+                cpus[stage].append(rec["cpu_ms"])
+            for key, value in rec.items():
+                if key.endswith(("_tokens", "_hits", "_misses", "_calls")) and isinstance(value, (int, float)):
+                    counters[stage][key] += value
+
+    summary = {}
+    for stage, values in walls.items():
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        summary[stage] = {"n": len(values), "p50": p50, "p95": p95, "p99": p99,
+                          "cpu_ms": float(np.mean(cpus[stage])) if cpus[stage] else None,
+                          **counters[stage]}
+    return summary
+
+
+def print_summary(summary):
+    print(f"{'stage':<30} {'n':>6} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'cpu ms':>9}  counters")
+    for stage, s in sorted(summary.items(), key=lambda x: -x[1]["p50"] * x[1]["n"]):
+        cpu = f"{s['cpu_ms']:9.1f}" if s["cpu_ms"] is not None else f"{'-':>9}"
+        extra = ", ".join(f"{k}={v}" for k, v in s.items() if k not in ("n", "p50", "p95", "p99", "cpu_ms"))
+        print(f"{stage:<30} {s['n']:>6} {s['p50']:>10.1f} {s['p95']:>10.1f} {s['p99']:>10.1f} {cpu}  {extra}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage latency percentiles from a trace file.")
+    parser.add_argument("path", nargs="?", default=TRACE_FILE or "traces.jsonl")
+    parser.add_argument("--stage", default="", help="Only stages starting with this prefix.")
+    args = parser.parse_args()
+    if not os.path.exists(args.path):
+        sys.exit(f"❌ No trace file at {args.path}")
+    print_summary(summarize(args.path, args.stage))
@@ -0,0 +1,245 @@
+import os
+import json
+import math
+import time
+import argparse
+import numpy as np
+import faiss
+
+# --- Switchable FAISS Index Types ---
+# LangChain's FAISS wrapper always builds an exact IndexFlatL2. For large
+# corpora we swap the raw faiss index underneath it for an approximate one:
+#   flat      - exact linear scan (baseline)
+#   ivf_flat  - inverted lists, exact vectors, search 'nprobe' lists
+#   ivf_pq    - inverted lists + product quantization (smallest memory)
+#   hnsw      - graph index, search breadth controlled by 'efSearch'
+# The chosen type and its parameters are stored in 'index_meta.json' next
+# to the FAISS files so retrieval knows how to tune searches.
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+META_FILE = "index_meta.json"
+TRAIN_SAMPLE = 50_000
+MIN_POINTS_PER_CENTROID = 39  # faiss k-means warns (and clusters poorly) below this
+MIN_PQ_BITS = 4  # Small corpora get smaller PQ codebooks, down to this, before falling back to flat
+DEFAULT_PARAMS = {
+    "ivf_flat": {"nprobe": 16},
+    "ivf_pq": {"nprobe": 16, "pq_bits": 8},
+    "hnsw": {"M": 32, "efConstruction": 200, "efSearch": 64},
+    "flat": {},
+}
+
+
+def load_meta(db_path):
+    path = os.path.join(db_path, META_FILE)
+    if not os.path.exists(path):
+        return {"index_type": "flat", "params": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def current_index_type(db_path):
+    """Type of the index saved in db_path ('flat' if there is none)."""
+    if not os.path.exists(os.path.join(db_path, "index.faiss")):
+        return "flat"
+    return load_meta(db_path)["index_type"]
+
+
+def save_meta(db_path, meta):
+    os.makedirs(db_path, exist_ok=True)
+    with open(os.path.join(db_path, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+
+def _pq_subquantizers(dim):
+    """Largest divisor of dim giving sub-vectors of at least 8 dimensions (max 64)."""
+    for m in range(min(64, dim // 8), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def make_index(index_type, dim, n_vectors, params=None):
+    """
+    Creates an (untrained) faiss index sized for 'n_vectors'.
+    Returns (index, params) with the parameters actually used.
+    """
+    params = {**DEFAULT_PARAMS[index_type], **(params or {})}
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dim), params
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, params["M"])
+        index.hnsw.efConstruction = params["efConstruction"]
+        index.hnsw.efSearch = params["efSearch"]
+        return index, params
+
+    # IVF: ~4*sqrt(n) lists, but keep at least 39 training points per list
+    nlist = params.get("nlist") or int(4 * math.sqrt(n_vectors))
+    nlist = max(1, min(nlist, n_vectors // MIN_POINTS_PER_CENTROID))
+    params["nlist"] = nlist
+    params["nprobe"] = min(params["nprobe"], nlist)
+    quantizer = faiss.IndexFlatL2(dim)
+    if index_type == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+    else:
+        params["pq_m"] = params.get("pq_m") or _pq_subquantizers(dim)
+        # Each sub-quantizer trains 2**pq_bits centroids: shrink the codebook
+        # until the corpus has enough points for it
+        fit_bits = int(math.log2(max(n_vectors // MIN_POINTS_PER_CENTROID, 1)))
+        params["pq_bits"] = max(MIN_PQ_BITS, min(params["pq_bits"], fit_bits))
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, params["pq_m"], params["pq_bits"])
+    index.nprobe = params["nprobe"]
+    return index, params
+
+
+def min_vectors(index_type, params=None):
+    """Fewest vectors we need before the index type can be trained sensibly."""
+    params = {**DEFAULT_PARAMS[index_type], **(params or {})}
+    if index_type == "ivf_flat":
+        return MIN_POINTS_PER_CENTROID * 2
+    if index_type == "ivf_pq":
+        # Enough for the smallest codebook make_index() will fall back to
+        return MIN_POINTS_PER_CENTROID * 2 ** min(params["pq_bits"], MIN_PQ_BITS)
+    return 0
+
+
+def _all_vectors(vector_db):
+    """
+    Vectors of every stored chunk, in index order, read back from the index
+    itself. Exact for flat/HNSW/ivf_flat; for ivf_pq they are the decoded
+    PQ codes (ingest.py --full rebuilds from the texts if exact ones are needed).
+    """
+    index = vector_db.index
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()  # position -> (list, offset), so reconstruct works
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def build_index(vector_db, index_type, params=None, train_sample=TRAIN_SAMPLE, vectors=None):
+    """
+    Build-and-train stage: replaces vector_db.index with an index of
+    'index_type' holding the same vectors in the same order (so the
+    LangChain id mapping stays valid). Returns the meta dict to save.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}'. Choose from {INDEX_TYPES}.")
+    if vectors is None:
+        vectors = _all_vectors(vector_db)
+    n, dim = vectors.shape
+
+    if n < min_vectors(index_type, params):
+        print(f"⚠️  Only {n} vectors: too few to train '{index_type}'. Using 'flat' for now.")
+        index_type = "flat"
+
+    index, used = make_index(index_type, dim, n, params)
+    if not index.is_trained:
+        rng = np.random.default_rng(0)
+        sample = vectors if n <= train_sample else vectors[rng.choice(n, train_sample, replace=False)]
+        print(f"🏋️  Training '{index_type}' on {len(sample)} vectors...")
+        index.train(sample)
+    index.add(vectors)
+    vector_db.index = index
+    return {"index_type": index_type, "params": used, "trained_on": int(n)}
+
+
+def delete_ids(vector_db, ids, meta):
+    """
+    Deletes chunks by docstore id. IndexFlat compacts itself and LangChain's
+    delete() handles it; IVF/HNSW indexes either can't remove vectors or keep
+    stale positions, so for those the surviving vectors are re-added in order.
+    IVF indexes keep their trained quantizers (no retraining; re-adding
+    decoded PQ vectors gives back the same codes), HNSW is rebuilt.
+    """
+    if not ids:
+        return meta
+    if meta.get("index_type", "flat") == "flat":
+        vector_db.delete(ids=ids)
+        return meta
+
+    doomed = set(ids)
+    vectors = _all_vectors(vector_db)
+    keep = [i for i in range(len(vectors)) if vector_db.index_to_docstore_id[i] not in doomed]
+    vector_db.docstore.delete(list(doomed))
+    vector_db.index_to_docstore_id = {new: vector_db.index_to_docstore_id[old] for new, old in enumerate(keep)}
+    if faiss.try_extract_index_ivf(vector_db.index) is not None:
+        vector_db.index.reset()
+        vector_db.index.add(vectors[keep])
+        return meta
+    return build_index(vector_db, meta["index_type"], meta.get("params"), vectors=vectors[keep])
+
+
+def search_params(index, nprobe=None, ef_search=None):
+    """Per-query faiss SearchParameters (thread-safe, unlike setting index.nprobe)."""
+    if nprobe is not None and isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(nprobe=nprobe)
+    if ef_search is not None and isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=ef_search)
+    return None
+
+
+def similarity_search(vector_db, query, k=4, nprobe=None, ef_search=None):
+    """Same result shape as vector_db.similarity_search, with per-query tuning."""
+    return similarity_search_by_vector(vector_db, vector_db._embed_query(query), k, nprobe, ef_search)
+
+
+def similarity_search_by_vector(vector_db, embedding, k=4, nprobe=None, ef_search=None):
+    """Like similarity_search, for callers that already embedded the query."""
+    params = search_params(vector_db.index, nprobe, ef_search)
+    if params is None:
+        return vector_db.similarity_search_by_vector(embedding, k=k)
+    vector = np.array([embedding], dtype=np.float32)
+    _, indices = vector_db.index.search(vector, k, params=params)
+    docs = []
+    for i in indices[0]:
+        if i == -1:
+            continue
+        docs.append(vector_db.docstore.search(vector_db.index_to_docstore_id[i]))
+    return docs
+
+
+# --- Benchmark: recall@k and latency vs the flat baseline ---
+
+def _clustered_vectors(n, dim, n_clusters, rng):
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32) * 4
+    labels = rng.integers(0, n_clusters, n)
+    return centers[labels] + rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def benchmark(n=100_000, dim=128, queries=500, k=10):
+    rng = np.random.default_rng(0)
+    data = _clustered_vectors(n, dim, 256, rng)
+    xq = _clustered_vectors(queries, dim, 256, rng)
+
+    flat = faiss.IndexFlatL2(dim)
+    flat.add(data)
+    t0 = time.perf_counter()
+    _, truth = flat.search(xq, k)
+    flat_ms = (time.perf_counter() - t0) * 1000 / queries
+    print(f"\n📏 {n} vectors x {dim} dims, {queries} queries, recall@{k}\n")
+    print(f"   - {'flat':<10} {'':<14} recall=1.000  {flat_ms:7.3f} ms/query")
+
+    sweeps = {"ivf_flat": [1, 8, 32], "ivf_pq": [8, 32], "hnsw": [16, 64, 256]}
+    for index_type, values in sweeps.items():
+        index, _ = make_index(index_type, dim, n)
+        t0 = time.perf_counter()
+        if not index.is_trained:
+            index.train(data[rng.choice(n, min(n, TRAIN_SAMPLE), replace=False)])
+        index.add(data)
+        build_s = time.perf_counter() - t0
+        for value in values:
+            knob = "efSearch" if index_type == "hnsw" else "nprobe"
+            params = search_params(index, nprobe=value, ef_search=value)
+            t0 = time.perf_counter()
+            _, found = index.search(xq, k, params=params)
+            ms = (time.perf_counter() - t0) * 1000 / queries
+            recall = np.mean([len(set(found[q]) & set(truth[q])) / k for q in range(queries)])
+            print(f"   - {index_type:<10} {knob + '=' + str(value):<14} recall={recall:.3f}  {ms:7.3f} ms/query  (build {build_s:.1f}s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark FAISS index types against the flat baseline.")
+    parser.add_argument("--n", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+    benchmark(args.n, args.dim, args.queries)
@@ -0,0 +1,230 @@
+import os
+import sys
+import time
+import base64
+import hashlib
+import sqlite3
+import argparse
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import fitz
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import tracing
+
+# --- Vision Client (GPT-4o image analysis) ---
+# One pooled HTTP session for every image (keep-alive, bounded retries on
+# 429/5xx, a real timeout). Images are downscaled to VISION_MAX_SIDE and
+# re-encoded as JPEG before upload unless the original is already smaller.
+# Answers are cached in SQLite by sha256(image bytes) + model + prompt, so a
+# second question about the same PDF never pays for the same image twice.
+# analyze_many() runs up to 'concurrency' requests at once.
+# Point VISION_API_URL at any OpenAI-compatible server (e.g. the stub in
+# benchmark.py) to run offline.
+
+VISION_API_URL = os.getenv("VISION_API_URL", "https://api.openai.com/v1/chat/completions")
+VISION_MODEL = os.getenv("VISION_MODEL", "gpt-4o")
+VISION_CACHE_PATH = os.getenv("VISION_CACHE_PATH", "vision_cache.sqlite")
+VISION_CONCURRENCY = int(os.getenv("VISION_CONCURRENCY", "4"))
+VISION_TIMEOUT = float(os.getenv("VISION_TIMEOUT", "60"))  # seconds per request
+VISION_MAX_SIDE = 1024    # px; GPT-4o tiles larger images down anyway
+VISION_JPEG_QUALITY = 85
+VISION_MAX_TOKENS = 400
+VISION_PROMPT = ("Describe this image in detail. If it is a chart or table, extract the data points. "
+                 "If it is a diagram, explain the process.")
+
+
+def image_sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def prepare_image(path, max_side=VISION_MAX_SIDE, quality=VISION_JPEG_QUALITY):
+    """
+    Returns (bytes, mime type) to upload: the image scaled to fit max_side and
+    re-encoded as JPEG, or the original file if that is smaller already.
+    """
+    with open(path, "rb") as f:
+        original = f.read()
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    original_mime = "image/jpeg" if ext in ("jpg", "jpeg") else f"image/{ext or 'png'}"
+
+    try:
+        pix = fitz.Pixmap(original)
+    except Exception:
+        return original, original_mime  # A format MuPDF can't decode: let the API try
+    if pix.colorspace is None or pix.colorspace.n != 3:
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)  # JPEG has no alpha channel
+    scale = max_side / max(pix.width, pix.height)
+    resized = scale < 1
+    if resized:
+        pix = fitz.Pixmap(pix, max(1, int(pix.width * scale)), max(1, int(pix.height * scale)), None)
+    encoded = pix.tobytes("jpeg", jpg_quality=quality)
+
+    if not resized and len(original) <= len(encoded):
+        return original, original_mime
+    return encoded, "image/jpeg"
+
+
+class VisionClient:
+    def __init__(self, url=None, api_key=None, model=VISION_MODEL, cache_path=VISION_CACHE_PATH,
+                 concurrency=VISION_CONCURRENCY, timeout=VISION_TIMEOUT, max_side=VISION_MAX_SIDE):
+        self.url = url or VISION_API_URL
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.model = model
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_side = max_side
+
+        self.session = requests.Session()
+        retry = Retry(total=2, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=None)  # POST is safe to retry here: analysis has no side effects
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(concurrency, 1), max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS analyses (
+                key TEXT PRIMARY KEY,
+                image_sha256 TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                latency REAL NOT NULL,
+                created REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_sent = 0
+        self.bytes_saved = 0  # original file size minus what was uploaded
+
+    def _key(self, digest, prompt):
+        return hashlib.sha256(f"{self.model}\0{VISION_MAX_TOKENS}\0{digest}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT answer FROM analyses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _store(self, key, digest, answer, latency):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analyses (key, image_sha256, answer, latency, created) VALUES (?, ?, ?, ?, ?)",
+                (key, digest, answer, latency, time.time()),
+            )
+            self._conn.commit()
+
+    def _request(self, image_bytes, mime, prompt):
+        payload = {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt},
+                        {"type": "image_url", "image_url": {
+                            "url": f"data:{mime};base64,{base64.b64encode(image_bytes).decode('utf-8')}"}},
+                    ],
+                }
+            ],
+            "max_tokens": VISION_MAX_TOKENS,
+        }
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        response = self.session.post(self.url, headers=headers, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"]
+
+    def analyze(self, path, prompt=VISION_PROMPT):
+        """Description of one image; served from the cache when this image + prompt was seen before."""
+        with tracing.span("vision.analyze", image=os.path.basename(path)) as s:
+            digest = image_sha256(path)
+            key = self._key(digest, prompt)
+            answer = self._lookup(key)
+            if answer is not None:
+                self.hits += 1
+                s.add(vision_cache_hits=1)
+                return answer
+
+            self.misses += 1
+            s.add(vision_cache_misses=1)
+            image_bytes, mime = prepare_image(path, self.max_side)
+            self.bytes_sent += len(image_bytes)
+            self.bytes_saved += max(os.path.getsize(path) - len(image_bytes), 0)
+            s.set(upload_bytes=len(image_bytes))
+            t0 = time.perf_counter()
+            answer = self._request(image_bytes, mime, prompt)
+            self._store(key, digest, answer, time.perf_counter() - t0)
+            return answer
+
+    def analyze_many(self, paths, prompt=VISION_PROMPT):
+        """{path: description or 'Error ...'} for every path, up to 'concurrency' requests in flight."""
+        def one(path):
+            try:
+                return self.analyze(path, prompt)
+            except Exception as e:
+                return f"Error analyzing image: {e}"
+
+        paths = list(dict.fromkeys(paths))
+        with ThreadPoolExecutor(max_workers=max(min(self.concurrency, len(paths)), 1)) as pool:
+            # copy_context keeps each worker's spans under the caller's trace
+            futures = [pool.submit(contextvars.copy_context().run, one, path) for path in paths]
+            return {path: future.result() for path, future in zip(paths, futures)}
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM analyses")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "entries": entries,
+            "bytes_sent": self.bytes_sent,
+            "bytes_saved": self.bytes_saved,
+        }
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_vision_client():
+    """The process-wide vision client (created on first use)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = VisionClient()
+    return _client
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyze images with the vision model (cached).")
+    parser.add_argument("images", nargs="*")
+    parser.add_argument("--prompt", default=VISION_PROMPT)
+    parser.add_argument("--clear", action="store_true", help="Drop every cached analysis.")
+    args = parser.parse_args()
+
+    client = get_vision_client()
+    if args.clear:
+        client.clear()
+        print(f"🧹 Cleared {client.cache_path}")
+    missing = [p for p in args.images if not os.path.exists(p)]
+    if missing:
+        sys.exit(f"❌ Not found: {', '.join(missing)}")
+    for path, answer in client.analyze_many(args.images, args.prompt).items():
+        print(f"🖼️  {path}\n{answer}\n")
+    print(f"📦 Vision cache: {client.stats()}")